@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Francesco Conti <f.conti@unibo.it>
+#
+# Copyright (C) 2016-2018 ETH Zurich, University of Bologna.
+# All rights reserved.
+#
+# Measures the number of git processes and the wall time of a status sweep
+# (HEAD, newest tag, staged / unstaged / untracked files) across all IPs, with
+# one git command per query (as ipstools used to do) and with the
+# GitRepository access layer.
+#   python3 bench/bench_git_status.py [-n RUNS]
+#   python3 bench/bench_git_status.py --synthetic 50
+# With --synthetic, the sweep runs on N throwaway repositories instead of the
+# IPs in ips/.
+
+import argparse, os, shutil, subprocess, sys, tempfile, time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+import ipstools
+
+def git_lines(cmd):
+    p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return [l for l in p.communicate()[0].decode().split("\n") if l != ""]
+
+def sweep_commands(paths):
+    forks = 0
+    cwd = os.getcwd()
+    for path in paths:
+        os.chdir(path)
+        git_lines("git rev-parse HEAD")
+        git_lines("git describe --tags --abbrev=0")
+        git_lines("git diff --name-only")
+        git_lines("git diff --cached --name-only")
+        git_lines("git ls-files --others --exclude-standard")
+        forks += 5
+        os.chdir(cwd)
+    return forks
+
+def sweep_repository(paths):
+    forks = ipstools.GitRepository.forks
+    for path in paths:
+        repo = ipstools.GitRepository(path)
+        repo.head()
+        repo.newest_tag()
+        repo.status()
+        repo.close()
+    return ipstools.GitRepository.forks - forks
+
+def make_synthetic(n):
+    tmp = tempfile.mkdtemp(prefix="bench_git_status_")
+    with open(os.devnull, "w") as devnull:
+        for i in range(n):
+            path = os.path.join(tmp, "ip%d" % i)
+            subprocess.check_call(["git", "init", "-q", path])
+            for j in range(20):
+                with open(os.path.join(path, "f%d.sv" % j), "w") as f:
+                    f.write("module m%d; endmodule\n" % j)
+            subprocess.check_call(["git", "add", "."], cwd=path)
+            subprocess.check_call(["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-q", "-m", "init"], cwd=path)
+            subprocess.check_call(["git", "tag", "v1.0"], cwd=path, stdout=devnull)
+            with open(os.path.join(path, "f0.sv"), "a") as f:
+                f.write("// changed\n")
+    return tmp, [os.path.join(tmp, "ip%d" % i) for i in range(n)]
+
+parser = argparse.ArgumentParser(description="Benchmark a git status sweep across all IPs.")
+parser.add_argument("-n", type=int, default=5, help="number of runs per mode")
+parser.add_argument("--synthetic", type=int, default=0, help="sweep N throwaway repositories instead of the IPs")
+args = parser.parse_args()
+
+tmp = None
+if args.synthetic > 0:
+    tmp, paths = make_synthetic(args.synthetic)
+else:
+    os.chdir(ROOT)
+    ipdb = ipstools.IPDatabase(skip_scripts=True)
+    paths = [os.path.join(ipdb.ips_dir, ip['path']) for ip in ipdb.ip_list if os.path.exists(os.path.join(ipdb.ips_dir, ip['path'], ".git"))]
+    if len(paths) == 0:
+        print("No IP is a git repository, use --synthetic N.")
+        sys.exit(1)
+
+print("%d repositories" % len(paths))
+print("%-12s %8s %10s %10s" % ("mode", "forks", "min [ms]", "mean [ms]"))
+for name, sweep in (("commands", sweep_commands), ("repository", sweep_repository)):
+    times = []
+    for i in range(args.n):
+        t0 = time.time()
+        forks = sweep(paths)
+        times.append(time.time() - t0)
+    print("%-12s %8d %10.1f %10.1f" % (name, forks, min(times)*1e3, sum(times)/len(times)*1e3))
+
+if tmp is not None:
+    shutil.rmtree(tmp)
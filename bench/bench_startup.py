@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# Francesco Conti <f.conti@unibo.it>
+#
+# Copyright (C) 2016-2018 ETH Zurich, University of Bologna.
+# All rights reserved.
+#
+# Measures the startup time of the ipstools bootstrap (importing
+# ipstools_cfg.py) in a fresh interpreter, as paid by every invocation of
+# update-ips, generate-scripts and ipstools-cli.
+#   python3 bench/bench_startup.py [-n RUNS]
+
+import argparse, os, subprocess, sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PROBE = "import time; t0 = time.time(); import ipstools_cfg; print(time.time() - t0)"
+
+def run(n, env):
+    times = []
+    for i in range(n):
+        out = subprocess.check_output([sys.executable, "-c", PROBE], cwd=ROOT, env=env)
+        times.append(float(out.decode().split()[-1]))
+    return times
+
+parser = argparse.ArgumentParser(description="Benchmark the ipstools bootstrap.")
+parser.add_argument("-n", type=int, default=10, help="number of runs per mode")
+args = parser.parse_args()
+
+modes = [
+    ("default", dict(os.environ)),
+    ("offline", dict(os.environ, IPSTOOLS_OFFLINE="1")),
+]
+print("%-10s %10s %10s %10s" % ("mode", "min [ms]", "mean [ms]", "max [ms]"))
+for name, env in modes:
+    t = run(args.n, env)
+    print("%-10s %10.1f %10.1f %10.1f" % (name, min(t)*1e3, sum(t)/len(t)*1e3, max(t)*1e3))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Francesco Conti <f.conti@unibo.it>
+#
+# Copyright (C) 2016-2018 ETH Zurich, University of Bologna.
+# All rights reserved.
+#
+# Measures the throughput (MB/s of VCD text) and the peak memory of the
+# streaming comparison of a hwpe_ctrl_ucode dump with the Python model of
+# ips/hwpe-mac-engine/ucode. The dump is synthesized from the model itself,
+# with stalls and NOISE other signals changing at each cycle, and is about
+# SIZE MB.
+#   python3 bench/bench_ucode_vcd.py --size 2000
+#   python3 bench/bench_ucode_vcd.py --size 100 --corrupt 12345 --gz
+# With --corrupt, one register is wrong at the given step, and the comparison
+# must stop there.
+
+import argparse, gzip, multiprocessing, os, resource, sys, tempfile, time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "ips", "hwpe-mac-engine", "ucode"))
+from ucode_common import *
+from ucode_trace import ucode_trace_chunks, ucode_iteration_count
+import ucode_vcd
+
+# a, b walk 64-element vectors, c and d move by one word per vector
+LOOPS_OPS = [2, 2, 1]
+CODE = [
+    {'op_sel': 1, 'a': 0, 'b': 4},
+    {'op_sel': 1, 'a': 1, 'b': 4},
+    {'op_sel': 1, 'a': 0, 'b': 5},
+    {'op_sel': 1, 'a': 2, 'b': 6},
+    {'op_sel': 1, 'a': 3, 'b': 6},
+]
+REGISTERS = [0]*4 + [4, -252, 4] + [0]*25
+def write_vcd(f, loops_range, nb_noise, corrupt=None):
+    f.write(b"$timescale 1ps $end\n$scope module tb $end\n$scope module i_dut $end\n")
+    for j in range(nb_noise):
+        f.write(("$var wire 32 n%d data_%d [31:0] $end\n" % (j, j)).encode())
+    f.write(b"$scope module i_ucode $end\n")
+    f.write(b"$var wire 1 ! clk_i $end\n$var wire 1 $ enable $end\n")
+    f.write(b"$var reg 4 % curr_addr [3:0] $end\n$var reg 128 & registers [3:0][31:0] $end\n")
+    f.write(b"$upscope $end\n$upscope $end\n$upscope $end\n$enddefinitions $end\n")
+    f.write(b"#0\n$dumpvars\n0!\n0$\nbx %\nbx &\n" + b"".join(("b0 n%d\n" % j).encode() for j in range(nb_noise)) + b"$end\n")
+    pool = [("b" + format((k * 2654435761) & 0xffffffff, "b")).encode() for k in range(251)]
+    noise = [b"".join(pool[(k+7*j) % 251] + (" n%d\n" % j).encode() for j in range(nb_noise)) for k in range(251)]
+    cycle = 1
+    # reset: registers and address cleared, not yet enabled
+    f.write(b"#2\n1!\nb0 %\nb0 &\n#3\n0!\n")
+    last = (None, None)
+    for chunk in ucode_trace_chunks(CODE, LOOPS_OPS, loops_range, REGISTERS):
+        addr = chunk['addr'].tolist()
+        regs = (chunk['registers'] & 0xffffffff).tolist()
+        out = []
+        for i in range(len(addr)):
+            cycle += 1
+            r = regs[i]
+            if corrupt == chunk['first_step'] + i:
+                r = [r[0] ^ 1] + r[1:]
+            v = r[3] << 96 | r[2] << 64 | r[1] << 32 | r[0]
+            a = ("b%s %%\n" % format(addr[i] & 0xf, "b")).encode() if addr[i] != last[0] else b""
+            b = ("b%s &\n" % format(v, "b")).encode() if v != last[1] else b""
+            last = (addr[i], v)
+            # one stall cycle every 7, to misalign cycles and steps
+            if cycle % 7 == 0:
+                out.append(b"#%d\n1!\n0$\n%s#%d\n0!\n" % (2*cycle, noise[cycle % 251], 2*cycle+1))
+                cycle += 1
+            # the state before the step is visible before this rising edge
+            out.append(b"#%d\n1!\n1$\n%s%s%s#%d\n0!\n" % (2*cycle, a, b, noise[cycle % 251], 2*cycle+1))
+        f.write(b"".join(out))
+    f.write(b"#%d\n1!\n0$\n" % (2*cycle+2))
+
+parser = argparse.ArgumentParser(description="Benchmark the streaming comparison of a ucode VCD dump with the Python model.")
+parser.add_argument("--size", type=int, default=256, help="approximate size of the dump in MB")
+parser.add_argument("--noise", type=int, default=64, help="number of other 32-bit signals changing at each cycle")
+parser.add_argument("--gz", action="store_true", help="compress the dump")
+parser.add_argument("--corrupt", type=int, default=None, help="corrupt a register at this step")
+parser.add_argument("--keep", default=None, help="write the dump here and keep it")
+args = parser.parse_args()
+
+# about 2 steps per iteration and 40 bytes per signal per cycle
+outer = max(1, args.size * 10**6 // ((40 * args.noise + 60) * 2 * 64 * 64))
+loops_range = [64, 64, outer]
+name = args.keep or os.path.join(tempfile.mkdtemp(prefix="bench_ucode_vcd_"), "dump.vcd" + (".gz" if args.gz else ""))
+def write(name):
+    with (gzip.open(name, "wb", compresslevel=1) if args.gz else open(name, "wb")) as f:
+        write_vcd(f, loops_range, args.noise, args.corrupt)
+
+# written by another process, not to count its memory in the peak below
+t0 = time.time()
+writer = multiprocessing.Process(target=write, args=(name,))
+writer.start()
+writer.join()
+t1 = time.time()
+print("%d iterations, dump of %.1f MB on disk written in %.1f s" % (ucode_iteration_count(loops_range), os.path.getsize(name)/1e6, t1-t0))
+
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.time()
+with ucode_vcd.vcd_open(name) as f:
+    scope, clk, en, addr, regs, addr_width = ucode_vcd.vcd_select(ucode_vcd.vcd_header(f), enable="enable")
+    samples = ucode_vcd.vcd_samples(f, clk, en, addr, regs)
+    reference = ucode_vcd.ucode_vcd_reference(CODE, LOOPS_OPS, loops_range, REGISTERS, addr_width)
+    mismatch, matched = ucode_vcd.ucode_vcd_compare(samples, reference)
+    size = f.tell()
+t1 = time.time()
+print("%-10s %10s %10s %10s %12s" % ("steps", "MB", "s", "MB/s", "peak RSS MB"))
+print("%-10d %10.1f %10.2f %10.1f %12.1f" % (matched, size/1e6, t1-t0, size/1e6/(t1-t0), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3))
+if mismatch is not None:
+    print("mismatch at step %d, time %s" % (mismatch['expected'][0], mismatch['time']))
+print("peak RSS before the comparison: %.1f MB" % (rss/1e3))
+if args.keep is None:
+    os.remove(name)
+    os.rmdir(os.path.dirname(name))
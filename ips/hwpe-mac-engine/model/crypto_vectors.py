@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+#
+# crypto_vectors.py
+# Francesco Conti <fconti@iis.ee.ethz.ch>
+#
+# Copyright (C) 2018 ETH Zurich, University of Bologna
+# Copyright and related rights are licensed under the Solderpad Hardware
+# License, Version 0.51 (the "License"); you may not use this file except in
+# compliance with the License.  You may obtain a copy of the License at
+# http://solderpad.org/licenses/SHL-0.51. Unless required by applicable law
+# or agreed to in writing, software, hardware and materials distributed under
+# this License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# Generates test vectors of the crypto cores of rtl/ (aes_1cc.v, keccak.v and
+# md5.v) at regression scale, with batched NumPy models of the cores:
+#   python crypto_vectors.py aes -n 4000000 -o vectors/aes
+# writes vectors/aes.hex, one line per vector for $readmemh, and
+# vectors/aes.json, with the fields of each line. With --format bin, the
+# vectors are written as raw bytes to vectors/aes.bin instead. A vector is
+# the concatenation of the values of the ports of the core, first field in
+# the most significant bits:
+#   aes:    {e_input[127:0], g_input[127:0], o[127:0]}
+#   keccak: {in words of the message, first word first, out[511:0]}
+#   md5:    {data_i of the 4 loads, first load first, data_o[127:0]}
+# Vectors are generated in shards of --shard-size vectors, from the seed and
+# the index of the shard, by -j processes, so that the files do not depend on
+# the number of processes; with --split, each shard is written by its process
+# to its own file (PREFIX.<shard>.hex).
+#
+# The models follow the RTL, not the standards where they differ:
+#  - aes_1cc connects its 128-bit key to KeyExpansion, which has NK=8: the key
+#    is zero-extended to 256 bits and the first 11 round keys of the AES-256
+#    key schedule are used for the 10 rounds. Byte 0 of the state is in
+#    bits [7:0].
+#  - keccak is Keccak-512 (rate 576) with the original 0x01 padding; the
+#    message is sent 8 bytes per word, the first byte in in[63:56], and the
+#    last word (is_last) has byte_num = len % 8 bytes.
+#  - md5 compresses one 512-bit block from the initial state, with word i of
+#    the block in message[511-32*i:480-32*i], as loaded 128 bits at a time.
+# --check validates the models against the standards (FIPS-197, hashlib).
+#
+
+from __future__ import print_function
+from collections import OrderedDict
+from multiprocessing import Pool
+import argparse, hashlib, json, os, sys, time
+import numpy as np
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+# AES: S-box from the inverse in GF(2^8) and the affine map
+def aes_tables():
+    exp, log = [0]*510, [0]*256
+    x = 1
+    for i in range(255):
+        exp[i] = exp[i+255] = x
+        log[x] = i
+        x ^= (x << 1) ^ (0x11b if x & 0x80 else 0)
+    sbox = []
+    for a in range(256):
+        b = exp[255 - log[a]] if a else 0
+        s = b
+        for i in range(1, 5):
+            s ^= ((b << i) | (b >> (8-i))) & 0xff
+        sbox.append(s ^ 0x63)
+    xtime = [((a << 1) ^ (0x1b if a & 0x80 else 0)) & 0xff for a in range(256)]
+    return np.array(sbox, dtype=np.uint8), np.array(xtime, dtype=np.uint8)
+
+AES_SBOX, AES_XTIME = aes_tables()
+AES_SHIFT = np.array([(i + 4*(i % 4)) % 16 for i in range(16)])
+AES_RCON = np.array([0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36, 0x6c, 0xd8, 0xab, 0x4d], dtype=np.uint8)
+AES_1CC_NK = 8
+AES_1CC_NR = 10
+
+def aes_expand_key(key, nk, nr):
+    # round keys (N, nr+1, 16) of keys (N, 4*nk) as in KeyExpansion.v
+    w = [key[:, 4*i:4*i+4] for i in range(nk)]
+    for i in range(nk, 4*(nr+1)):
+        t = w[i-1]
+        if i % nk == 0:
+            t = AES_SBOX[np.roll(t, -1, axis=1)]
+            t[:, 0] ^= AES_RCON[i//nk - 1]
+        elif nk > 6 and i % nk == 4:
+            t = AES_SBOX[t]
+        w.append(w[i-nk] ^ t)
+    return np.concatenate(w[:4*(nr+1)], axis=1).reshape(-1, nr+1, 16)
+
+def aes_encrypt(msg, key, nk=AES_1CC_NK, nr=AES_1CC_NR):
+    # msg (N, 16) and key (N, 4*nk or less, zero-extended) bytes, in the
+    # order of the standard
+    if key.shape[1] < 4*nk:
+        key = np.concatenate((key, np.zeros((key.shape[0], 4*nk-key.shape[1]), dtype=np.uint8)), axis=1)
+    rk = aes_expand_key(key, nk, nr)
+    s = msg ^ rk[:, 0]
+    for r in range(1, nr+1):
+        s = AES_SBOX[s][:, AES_SHIFT]
+        if r < nr:
+            a = s.reshape(-1, 4, 4)
+            t = a[:, :, 0] ^ a[:, :, 1] ^ a[:, :, 2] ^ a[:, :, 3]
+            s = (a ^ t[:, :, None] ^ AES_XTIME[a ^ np.roll(a, -1, axis=2)]).reshape(-1, 16)
+        s ^= rk[:, r]
+    return s
+
+# Keccak-f[1600] on (25, N) lanes, lane x+5*y
+def keccak_tables():
+    rot = [0]*25
+    x, y = 1, 0
+    for t in range(24):
+        rot[x + 5*y] = ((t+1)*(t+2)//2) % 64
+        x, y = y, (2*x + 3*y) % 5
+    # b[y, 2x+3y] = rot(a[x, y])
+    src = [0]*25
+    for x in range(5):
+        for y in range(5):
+            src[y + 5*((2*x + 3*y) % 5)] = x + 5*y
+    rc = []
+    r = 1
+    for i in range(24):
+        c = 0
+        for j in range(7):
+            if r & 1:
+                c |= 1 << ((1 << j) - 1)
+            r = ((r << 1) ^ (0x71 if r & 0x80 else 0)) & 0xff
+        rc.append(c)
+    chi1 = [(x+1) % 5 + 5*y for y in range(5) for x in range(5)]
+    chi2 = [(x+2) % 5 + 5*y for y in range(5) for x in range(5)]
+    return (np.array(rot, dtype=np.uint64)[:, None], np.array(src), np.array(rc, dtype=np.uint64),
+            np.array(chi1), np.array(chi2))
+
+KECCAK_ROT, KECCAK_PI, KECCAK_RC, KECCAK_CHI1, KECCAK_CHI2 = keccak_tables()
+KECCAK_RATE = 72
+KECCAK_OUT = 64
+
+def keccak_f(a):
+    one = np.uint64(1)
+    for rc in KECCAK_RC:
+        c = a[0:5] ^ a[5:10] ^ a[10:15] ^ a[15:20] ^ a[20:25]
+        c1 = np.roll(c, -1, axis=0)
+        d = np.roll(c, 1, axis=0) ^ ((c1 << one) | (c1 >> np.uint64(63)))
+        a = a ^ np.tile(d, (5, 1))
+        a = (a << KECCAK_ROT) | (a >> ((np.uint64(64) - KECCAK_ROT) % np.uint64(64)))
+        b = a[KECCAK_PI]
+        a = b ^ (~b[KECCAK_CHI1] & b[KECCAK_CHI2])
+        a[0] ^= rc
+    return a
+
+def keccak_hash(msg, pad=0x01, rate=KECCAK_RATE, out=KECCAK_OUT):
+    # digests (N, out) of messages (N, L) of the same length
+    n, length = msg.shape
+    blocks = length // rate + 1
+    padded = np.zeros((n, blocks*rate), dtype=np.uint8)
+    padded[:, :length] = msg
+    padded[:, length] = pad
+    padded[:, -1] |= 0x80
+    lanes = padded.view('<u8').reshape(n, blocks, rate//8)
+    a = np.zeros((25, n), dtype=np.uint64)
+    for k in range(blocks):
+        a[:rate//8] ^= lanes[:, k].T
+        a = keccak_f(a)
+    return np.ascontiguousarray(a[:(out+7)//8].T).astype('<u8').view(np.uint8)[:, :out]
+
+# MD5 compression of one block from the initial state
+MD5_K = np.array([int(abs(np.sin(i+1)) * 2**32) & 0xffffffff for i in range(64)], dtype=np.uint32)
+MD5_S = [7, 12, 17, 22]*4 + [5, 9, 14, 20]*4 + [4, 11, 16, 23]*4 + [6, 10, 15, 21]*4
+MD5_G = [i for i in range(16)] + [(5*i+1) % 16 for i in range(16)] + [(3*i+5) % 16 for i in range(16)] + [(7*i) % 16 for i in range(16)]
+MD5_IV = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]
+
+def md5_compress(m):
+    # m (N, 16) uint32 words; returns (N, 4) uint32, A to D
+    a, b, c, d = [np.full(m.shape[0], v, dtype=np.uint32) for v in MD5_IV]
+    for i in range(64):
+        if i < 16:
+            f = (b & c) | (~b & d)
+        elif i < 32:
+            f = (b & d) | (c & ~d)
+        elif i < 48:
+            f = b ^ c ^ d
+        else:
+            f = c ^ (b | ~d)
+        x = a + f + m[:, MD5_G[i]] + MD5_K[i]
+        s = MD5_S[i]
+        a, b, c, d = d, b + ((x << np.uint32(s)) | (x >> np.uint32(32-s))), b, c
+    return np.stack((a + np.uint32(MD5_IV[0]), b + np.uint32(MD5_IV[1]), c + np.uint32(MD5_IV[2]), d + np.uint32(MD5_IV[3])), axis=1)
+
+# vectors: (N, bytes) arrays, the big-endian bytes of the port values
+def vectors_fields(core, length):
+    # (name, bits) of the fields, first field in the most significant bits
+    if core == 'aes':
+        return [('e_input', 128), ('g_input', 128), ('o', 128)]
+    if core == 'keccak':
+        return [('in', 64*(length//8 + 1)), ('out', 512)]
+    return [('data_i', 512), ('data_o', 128)]
+
+def vectors_generate(core, rng, n, length):
+    if core == 'aes':
+        msg = rng.randint(0, 256, size=(n, 16)).astype(np.uint8)
+        key = rng.randint(0, 256, size=(n, 16)).astype(np.uint8)
+        out = aes_encrypt(msg, key)
+        return np.concatenate((msg[:, ::-1], key[:, ::-1], out[:, ::-1]), axis=1)
+    if core == 'keccak':
+        msg = rng.randint(0, 256, size=(n, length)).astype(np.uint8)
+        words = np.zeros((n, 8*(length//8 + 1)), dtype=np.uint8)
+        words[:, :length] = msg
+        return np.concatenate((words, keccak_hash(msg)), axis=1)
+    block = rng.randint(0, 256, size=(n, 64)).astype(np.uint8)
+    out = md5_compress(block.view('>u4').astype(np.uint32))
+    return np.concatenate((block, out.astype('>u4').view(np.uint8)), axis=1)
+
+def vectors_format(vectors, fmt):
+    if fmt == 'bin':
+        return vectors.tobytes()
+    n, width = vectors.shape
+    line = np.empty((n, 2*width + 1), dtype=np.uint8)
+    line[:, 0:-1:2] = HEX_DIGITS[vectors >> 4]
+    line[:, 1:-1:2] = HEX_DIGITS[vectors & 0xf]
+    line[:, -1] = ord("\n")
+    return line.tobytes()
+
+def vectors_shard(job):
+    # Returns the formatted vectors of a shard, or writes them to their own
+    # file and returns its name.
+    core, seed, shard, shard_size, count, length, fmt, split = job
+    n = min(shard_size, count - shard*shard_size)
+    rng = np.random.RandomState([seed, shard])
+    data = vectors_format(vectors_generate(core, rng, n, length), fmt)
+    if split is None:
+        return data
+    name = "%s.%d.%s" % (split, shard, fmt)
+    with open(name, "wb") as f:
+        f.write(data)
+    return name
+
+def vectors_check():
+    # known answers of FIPS-197, and comparison with hashlib on random inputs
+    errors = []
+    pt = np.frombuffer(bytes(bytearray.fromhex("00112233445566778899aabbccddeeff")), dtype=np.uint8)[None]
+    key = np.arange(32, dtype=np.uint8)[None]
+    if aes_encrypt(pt, key[:, :16], nk=4, nr=10).tobytes() != bytes(bytearray.fromhex("69c4e0d86a7b0430d8cdb78070b4c55a")):
+        errors.append("AES-128")
+    if aes_encrypt(pt, key, nk=8, nr=14).tobytes() != bytes(bytearray.fromhex("8ea2b7ca516745bfeafc49904b496089")):
+        errors.append("AES-256")
+    if keccak_hash(np.zeros((1, 0), dtype=np.uint8)).tobytes() != bytes(bytearray.fromhex(
+            "0eab42de4c3ceb9235fc91acffe746b29c29a8c366b7c60e4e67c466f36a4304c00fa9caf9d87976ba469bcbe06713b435f091ef2769fb160cdab33d3670680e")):
+        errors.append("Keccak-512")
+    rng = np.random.RandomState(0)
+    for length in (0, 7, 8, 71, 72, 200):
+        msg = rng.randint(0, 256, size=(16, length)).astype(np.uint8)
+        ref = [hashlib.sha3_512(m.tobytes()).digest() for m in msg] if hasattr(hashlib, 'sha3_512') else None
+        if ref is not None and [d.tobytes() for d in keccak_hash(msg, pad=0x06)] != ref:
+            errors.append("SHA3-512 of %d bytes" % length)
+        if length > 55:
+            continue
+        # one padded block, words byte-swapped as md5.v expects them
+        padded = np.zeros((16, 64), dtype=np.uint8)
+        padded[:, :length] = msg
+        padded[:, length] = 0x80
+        padded[:, 56:64] = np.frombuffer(np.array([8*length], dtype='<u8').tobytes(), dtype=np.uint8)
+        out = md5_compress(padded.view('<u4').astype(np.uint32))
+        if [o.astype('<u4').tobytes() for o in out] != [hashlib.md5(m.tobytes()).digest() for m in msg]:
+            errors.append("MD5 of %d bytes" % length)
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate test vectors of the crypto cores.")
+    parser.add_argument("core", choices=['aes', 'keccak', 'md5'], help="core")
+    parser.add_argument("-n", "--count", type=int, default=1 << 20, help="number of vectors")
+    parser.add_argument("-o", "--output", default=None, help="prefix of the output files (default: the core)")
+    parser.add_argument("--format", choices=['hex', 'bin'], default='hex', help="$readmemh lines or raw bytes")
+    parser.add_argument("--len", type=int, default=64, help="length of the keccak messages in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--shard-size", type=int, default=1 << 16, help="vectors per shard")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes (default: all CPUs)")
+    parser.add_argument("--split", action="store_true", help="write each shard to its own file")
+    parser.add_argument("--check", action="store_true", help="check the models against the standards first")
+    args = parser.parse_args()
+
+    if args.check:
+        errors = vectors_check()
+        if len(errors) > 0:
+            print("ERROR: the models differ from %s." % ", ".join(errors))
+            sys.exit(1)
+        print("models identical to FIPS-197, Keccak-512, SHA3-512 and MD5")
+    if args.count < 1 or args.shard_size < 1 or args.len < 0:
+        print("ERROR: count, shard size and len must be positive.")
+        sys.exit(1)
+
+    output = args.output or args.core
+    if os.path.dirname(output) != "" and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    fields = vectors_fields(args.core, args.len)
+    nb_shards = (args.count + args.shard_size - 1) // args.shard_size
+    jobs = [(args.core, args.seed, s, args.shard_size, args.count, args.len, args.format, output if args.split else None) for s in range(nb_shards)]
+
+    t0 = time.time()
+    pool = None if args.jobs == 1 or nb_shards == 1 else Pool(args.jobs)
+    try:
+        results = pool.imap(vectors_shard, jobs) if pool is not None else (vectors_shard(j) for j in jobs)
+        if args.split:
+            files = list(results)
+        else:
+            files = ["%s.%s" % (output, args.format)]
+            with open(files[0], "wb") as f:
+                for data in results:
+                    f.write(data)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    t1 = time.time()
+
+    msb = sum(w for n, w in fields)
+    layout = []
+    for n, w in fields:
+        layout.append(OrderedDict([('name', n), ('msb', msb-1), ('lsb', msb-w)]))
+        msb -= w
+    manifest = OrderedDict([
+        ('core',       args.core),
+        ('count',      args.count),
+        ('seed',       args.seed),
+        ('shard_size', args.shard_size),
+        ('format',     args.format),
+        ('bits',       sum(w for n, w in fields)),
+        ('fields',     layout),
+        ('files',      [os.path.basename(f) for f in files])
+    ])
+    if args.core == 'keccak':
+        manifest['len'] = args.len
+        manifest['byte_num'] = args.len % 8
+    with open(output + ".json", "w") as f:
+        f.write(json.dumps(manifest, indent=4))
+    print("%d %s vectors of %d bits in %.2f s (%.0f vectors/s), written to %s" % (args.count, args.core, manifest['bits'], t1-t0, args.count/(t1-t0), files[0] if len(files) == 1 else "%d files" % len(files)))
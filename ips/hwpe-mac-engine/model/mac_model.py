@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+# mac_model.py
+# Francesco Conti <fconti@iis.ee.ethz.ch>
+#
+# Copyright (C) 2018 ETH Zurich, University of Bologna
+# Copyright and related rights are licensed under the Solderpad Hardware
+# License, Version 0.51 (the "License"); you may not use this file except in
+# compliance with the License.  You may obtain a copy of the License at
+# http://solderpad.org/licenses/SHL-0.51. Unless required by applicable law
+# or agreed to in writing, software, hardware and materials distributed under
+# this License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# Golden model of the datapath of mac_engine, computing many jobs at once
+# with NumPy, and generator of the memory images of their stimuli and
+# expected results:
+#   python mac_model.py --mode scalar_prod --len 64 --nb-iter 16 --shift 8 --jobs 1000 -o vectors
+# writes vectors/jobs.json (the register file of the jobs) and, for each job,
+# vectors/job<N>/stim.txt (a, b, c) and vectors/job<N>/expected.txt (d), in
+# the address_data format of vectors/stim.txt in tb_pulp (--format stim), or
+# as $readmemh images with @address lines (--format hex); --format npz writes
+# the memories of all jobs to vectors/jobs.npz instead.
+#
+# As in mac_engine.sv:
+#  - simple_mult: r_mult holds the 64-bit product a*b, and d = r_mult >>> shift
+#    truncated to 32 bits, for len elements per iteration.
+#  - scalar_prod: r_acc starts from c <<< shift (computed on 32 bits, then
+#    sign-extended), accumulates the 64-bit products of len elements on
+#    64+$clog2(MAC_CNT_LEN) bits, and d = r_acc >>> shift truncated to 32
+#    bits. As shift < 32, d only depends on the bits of r_acc below 64, so the
+#    accumulation is done modulo 2^64.
+# Iteration k of a job reads and writes at the offsets held by the microcode
+# registers (a, b, c, d) at the beginning of its iteration k, from the trace
+# of the microcode (by default ucode/code.yml, with nb_iter, iter_stride and
+# one_stride=4 in the read-only registers as in mac_ctrl).
+#
+
+from __future__ import print_function
+from collections import OrderedDict
+import argparse, json, os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ucode import UCODE_ADDR_WIDTH, UCODE_DEFAULT, ucode_load, ucode_trace
+
+MAC_CNT_LEN = 1024
+MAC_SHIFT_WIDTH = 5
+MAC_NB_ITER_MAX = (1 << 12) - 1 # static_reg_nb_iter[11:0] is the range of the microcode loop
+
+# read-only registers of the microcode in mac_ctrl
+MAC_UCODE_NBITER     = 4
+MAC_UCODE_ITERSTRIDE = 5
+MAC_UCODE_ONESTRIDE  = 6
+
+def mac_simple_mult(a, b, shift):
+    # d for a, b of shape (..., len) and shift broadcastable to (...)
+    shift = np.asarray(shift, dtype=np.int64)[..., None]
+    return ((a.astype(np.int64) * b.astype(np.int64)) >> shift).astype(np.int32)
+
+def mac_scalar_prod(a, b, c, shift):
+    # d for a, b of shape (..., len), c of shape (...) and shift broadcastable
+    # to (...)
+    shift = np.asarray(shift, dtype=np.int64)
+    c_shifted = (c.astype(np.int64) << shift).astype(np.int32).astype(np.int64)
+    acc = c_shifted.astype(np.uint64) + (a.astype(np.int64) * b.astype(np.int64)).astype(np.uint64).sum(axis=-1, dtype=np.uint64)
+    return (acc >> shift.astype(np.uint64)).astype(np.uint32).view(np.int32)
+
+def mac_reference(mode, a, b, c, shift):
+    # one job iteration, with Python integers at the widths of mac_engine.sv
+    def signed(x, width):
+        x &= (1 << width) - 1
+        return x - (1 << width) if x >> (width-1) else x
+    if mode == 'simple_mult':
+        return [signed(signed(a[i]*b[i], 64) >> shift, 32) for i in range(len(a))]
+    acc = signed(c << shift, 32)
+    for i in range(len(a)):
+        acc = signed(acc + signed(a[i]*b[i], 64), 64 + int(np.log2(MAC_CNT_LEN)))
+    return [signed(acc >> shift, 32)]
+
+def mac_offsets(code, loops_ops, nb_iter, stride):
+    # byte offsets of a, b, c, d at the beginning of each iteration
+    registers = [0]*(1 << UCODE_ADDR_WIDTH)
+    registers[MAC_UCODE_NBITER]     = nb_iter
+    registers[MAC_UCODE_ITERSTRIDE] = stride
+    registers[MAC_UCODE_ONESTRIDE]  = 4
+    trace = ucode_trace(code, loops_ops, [nb_iter], registers)
+    first = np.nonzero(np.diff(np.concatenate(([-1], trace['iteration']))))[0]
+    return trace['registers'][first][:nb_iter]
+
+def mac_layout(mode, length, nb_iter, offsets, base=None):
+    # base address and size in words of the a, b, c, d buffers
+    out_len = length if mode == 'simple_mult' else 1
+    sizes = []
+    for i,n in enumerate((length, length, 1, out_len)):
+        if offsets[:,i].min() < 0 or offsets[:,i].max() % 4 != 0:
+            print("ERROR: the offsets of buffer %s must be positive multiples of 4." % "abcd"[i])
+            sys.exit(1)
+        sizes.append(int(offsets[:,i].max()) // 4 + n)
+    if base is None:
+        base = [0x1c010000]
+        for s in sizes[:-1]:
+            base.append(base[-1] + (s*4 + 15) // 16 * 16)
+    return base, sizes
+
+def mac_run(mode, length, shift, offsets, a_mem, b_mem, c_mem, d_size):
+    # Runs all jobs on their memories (jobs x words, int32) and returns the
+    # d memories; d words never written are 0.
+    jobs, nb_iter = a_mem.shape[0], offsets.shape[0]
+    words = offsets // 4
+    idx = np.arange(length)
+    a = a_mem[:, words[:,0,None] + idx]
+    b = b_mem[:, words[:,1,None] + idx]
+    shift = np.broadcast_to(np.asarray(shift)[..., None], (jobs, 1))
+    d_mem = np.zeros((jobs, d_size), dtype=np.int32)
+    if mode == 'simple_mult':
+        d = mac_simple_mult(a, b, shift)
+        addr = (words[:,3,None] + idx).reshape(-1)
+    else:
+        c = c_mem[:, words[:,2]]
+        d = mac_scalar_prod(a, b, c, shift).reshape(jobs, nb_iter, 1)
+        addr = words[:,3]
+    # later iterations overwrite the words written by earlier ones
+    last = np.full(d_size, -1, dtype=np.int64)
+    np.maximum.at(last, addr, np.arange(len(addr)))
+    written = np.nonzero(last >= 0)[0]
+    d_mem[:, written] = d.reshape(jobs, -1)[:, last[written]]
+    return d_mem
+
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+def mem_hex(values, digits):
+    # (n, digits) array of the hexadecimal characters of values
+    values = np.asarray(values).astype(np.uint64)
+    shifts = np.arange(4*(digits-1), -1, -4, dtype=np.uint64)
+    return HEX_DIGITS[(values[..., None] >> shifts) & np.uint64(0xf)]
+
+def mem_format(fmt, base, words):
+    # lines of a memory image of words (jobs x n) at address base, as a
+    # (jobs, bytes) array: address_data lines for stim, $readmemh otherwise
+    jobs, n = words.shape
+    data = mem_hex(words.view(np.uint32), 8)
+    if fmt == 'stim':
+        addr = mem_hex(base + 4*np.arange(n), 8)
+        line = np.empty((jobs, n, 26), dtype=np.uint8)
+        line[..., 0:8] = addr
+        line[..., 8] = ord("_")
+        line[..., 9:17] = ord("0")
+        line[..., 17:25] = data
+        line[..., 25] = ord("\n")
+        return line.reshape(jobs, -1)
+    head = np.frombuffer(b"@" + mem_hex([base // 4], 8)[0].tobytes() + b"\n", dtype=np.uint8)
+    line = np.empty((jobs, n, 9), dtype=np.uint8)
+    line[..., 0:8] = data
+    line[..., 8] = ord("\n")
+    return np.concatenate((np.broadcast_to(head, (jobs, len(head))), line.reshape(jobs, -1)), axis=1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate the stimuli and expected results of mac_engine jobs.")
+    parser.add_argument("--mode", choices=['simple_mult', 'scalar_prod'], default='scalar_prod', help="datapath mode")
+    parser.add_argument("--len", type=int, default=64, help="elements per iteration (1-%d)" % MAC_CNT_LEN)
+    parser.add_argument("--nb-iter", type=int, default=16, help="iterations per job (1-%d)" % MAC_NB_ITER_MAX)
+    parser.add_argument("--stride", type=int, default=None, help="iteration stride of a and b in bytes (default: 4*len)")
+    parser.add_argument("--shift", type=int, default=0, help="normalization shift (0-%d)" % ((1 << MAC_SHIFT_WIDTH)-1))
+    parser.add_argument("--bits", type=int, default=16, help="inputs are signed integers of BITS bits")
+    parser.add_argument("--jobs", type=int, default=1, help="number of jobs")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--code", default=UCODE_DEFAULT, help="microcode of the jobs (default: ucode/code.yml)")
+    parser.add_argument("-o", "--output", default="vectors", help="output directory (default: vectors)")
+    parser.add_argument("--format", choices=['stim', 'hex', 'npz'], default='stim', help="format of the memory images")
+    parser.add_argument("--check", type=int, default=0, metavar="N", help="check the first N jobs against a scalar model")
+    args = parser.parse_args()
+
+    if args.len < 1 or args.len > MAC_CNT_LEN or args.nb_iter < 1 or args.nb_iter > MAC_NB_ITER_MAX or args.shift < 0 or args.shift >= 1 << MAC_SHIFT_WIDTH or args.bits < 1 or args.bits > 32:
+        print("ERROR: len, nb-iter, shift or bits out of range.")
+        sys.exit(1)
+    stride = args.stride if args.stride is not None else 4*args.len
+
+    t0 = time.time()
+    loops_ops,code = ucode_load(args.code)
+    offsets = mac_offsets(code, loops_ops, args.nb_iter, stride)
+    base, sizes = mac_layout(args.mode, args.len, args.nb_iter, offsets)
+    rng = np.random.RandomState(args.seed)
+    lo, hi = -(1 << (args.bits-1)), 1 << (args.bits-1)
+    a_mem = rng.randint(lo, hi, size=(args.jobs, sizes[0]), dtype=np.int64).astype(np.int32)
+    b_mem = rng.randint(lo, hi, size=(args.jobs, sizes[1]), dtype=np.int64).astype(np.int32)
+    c_mem = rng.randint(lo, hi, size=(args.jobs, sizes[2]), dtype=np.int64).astype(np.int32)
+    d_mem = mac_run(args.mode, args.len, args.shift, offsets, a_mem, b_mem, c_mem, sizes[3])
+    t1 = time.time()
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    registers = OrderedDict([
+        ('a_addr',           base[0]),
+        ('b_addr',           base[1]),
+        ('c_addr',           base[2]),
+        ('d_addr',           base[3]),
+        ('nb_iter',          args.nb_iter - 1),
+        ('len_iter',         args.len - 1),
+        ('shift_simplemul',  (args.shift << 16) | (args.mode == 'simple_mult')),
+        ('shift_vectstride', stride)
+    ])
+    with open(os.path.join(args.output, "jobs.json"), "w") as f:
+        f.write(json.dumps(OrderedDict([('mode', args.mode), ('jobs', args.jobs), ('seed', args.seed), ('registers', registers), ('sizes', sizes)]), indent=4))
+    if args.format == 'npz':
+        np.savez(os.path.join(args.output, "jobs.npz"), a=a_mem, b=b_mem, c=c_mem, d=d_mem, base=np.array(base))
+    else:
+        stim = np.concatenate([mem_format(args.format, base[i], m) for i,m in enumerate((a_mem, b_mem, c_mem))], axis=1)
+        expected = mem_format(args.format, base[3], d_mem)
+        for j in range(args.jobs):
+            path = os.path.join(args.output, "job%06d" % j)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            with open(os.path.join(path, "stim.txt"), "wb") as f:
+                f.write(stim[j].tobytes())
+            with open(os.path.join(path, "expected.txt"), "wb") as f:
+                f.write(expected[j].tobytes())
+    t2 = time.time()
+    print("%d jobs, %d MACs computed in %.3f s, written in %.3f s" % (args.jobs, args.jobs*args.nb_iter*args.len, t1-t0, t2-t1))
+
+    if args.check > 0:
+        words = offsets // 4
+        for j in range(min(args.check, args.jobs)):
+            d = [0]*sizes[3]
+            for k in range(args.nb_iter):
+                a = [int(x) for x in a_mem[j, words[k,0]:words[k,0]+args.len]]
+                b = [int(x) for x in b_mem[j, words[k,1]:words[k,1]+args.len]]
+                out = mac_reference(args.mode, a, b, int(c_mem[j, words[k,2]]), args.shift)
+                d[words[k,3]:words[k,3]+len(out)] = out
+            if d != d_mem[j].tolist():
+                print("ERROR: job %d differs from the scalar model." % j)
+                sys.exit(1)
+        print("%d jobs identical to the scalar model" % min(args.check, args.jobs))
@@ -0,0 +1,53 @@
+#
+# __init__.py
+# Francesco Conti <fconti@iis.ee.ethz.ch>
+#
+# Copyright (C) 2018 ETH Zurich, University of Bologna
+# Copyright and related rights are licensed under the Solderpad Hardware
+# License, Version 0.51 (the "License"); you may not use this file except in
+# compliance with the License.  You may obtain a copy of the License at
+# http://solderpad.org/licenses/SHL-0.51. Unless required by applicable law
+# or agreed to in writing, software, hardware and materials distributed under
+# this License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# The microcode tools as a package, with ips/hwpe-mac-engine in the path:
+#   import ucode
+#   loops_ops, code = ucode.ucode_load(ucode.UCODE_DEFAULT)
+#   flat  = ucode.ucode_flat(code, loops_ops)
+#   cost  = ucode.ucode_cycles(code, loops_ops, [16])
+#   trace = ucode.ucode_trace(code, loops_ops, [16], registers)
+# The functions below are the stable API; the other functions of the modules
+# (ucode.ucode_batch, ucode.ucode_vcd, ...) are the internals of their
+# command-line tools, which still run as scripts from this directory.
+#
+
+__all__ = [
+    # widths of the microcode and of the hwpe_ctrl_ucode sequencer
+    "NB_LOOPS", "NB_REG", "REG_WIDTH",
+    "UCODE_LENGTH", "UCODE_ADDR_WIDTH", "UCODE_NB_OPS_WIDTH", "UCODE_OP_WIDTH",
+    "UCODE_LOOP_WIDTH", "UCODE_CODE_WIDTH", "UCODE_LOOPS_WIDTH", "UCODE_FLAT_WIDTH",
+    "UCODE_DEFAULT",
+    # load
+    "ucode_load", "ucode_parse",
+    # compile
+    "ucode_pack", "ucode_bytecode", "ucode_flat",
+    # simulate
+    "ucode_get_loops", "ucode_state_machine", "ucode_execute", "ucode_run",
+    "ucode_cycles", "ucode_loop_iterations",
+    # trace
+    "ucode_trace", "ucode_trace_chunks", "ucode_iteration_count", "ucode_iteration_registers",
+    # analyze
+    "ucode_range", "ucode_range_traced"
+]
+
+from .ucode_common import (NB_LOOPS, NB_REG, REG_WIDTH,
+    UCODE_LENGTH, UCODE_ADDR_WIDTH, UCODE_NB_OPS_WIDTH, UCODE_OP_WIDTH,
+    UCODE_LOOP_WIDTH, UCODE_CODE_WIDTH, UCODE_LOOPS_WIDTH, UCODE_FLAT_WIDTH,
+    UCODE_DEFAULT,
+    ucode_load, ucode_parse, ucode_pack, ucode_bytecode, ucode_flat,
+    ucode_get_loops, ucode_state_machine, ucode_execute, ucode_run,
+    ucode_cycles, ucode_loop_iterations)
+from .ucode_trace import ucode_trace, ucode_trace_chunks, ucode_iteration_count, ucode_iteration_registers
+from .ucode_range import ucode_range, ucode_range_traced
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# ucode_batch.py
+# Francesco Conti <fconti@iis.ee.ethz.ch>
+#
+# Copyright (C) 2018 ETH Zurich, University of Bologna
+# Copyright and related rights are licensed under the Solderpad Hardware
+# License, Version 0.51 (the "License"); you may not use this file except in
+# compliance with the License.  You may obtain a copy of the License at
+# http://solderpad.org/licenses/SHL-0.51. Unless required by applicable law
+# or agreed to in writing, software, hardware and materials distributed under
+# this License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# Compiles many microcode programs in parallel and writes all of them, in one
+# pass, as a SystemVerilog package, a C header and a JSON file:
+#   python ucode_batch.py code.yml variants/*.yml -o build/ucode
+# writes build/ucode_pkg.sv, build/ucode.h and build/ucode.json. Each program
+# is named after its path, without the directory common to all of them and
+# the extension (e.g. variants/conv3x3.yml -> conv3x3), and provides
+#   SV: UCODE_<NAME>_CODE [175:0], UCODE_<NAME>_LOOPS [47:0] and
+#       UCODE_<NAME> [223:0], the {loops, code} value of ucode_flat in mac_ctrl
+#   C:  ucode_<name>[7], the 32-bit words of ucode_flat from the least
+#       significant one, as written to the generic parameters of the register
+#       file
+# Compiled programs are cached by the hash of their file in UCODE_CACHE_DIR
+# (by default ~/.cache/ucode), so that unchanged programs are not parsed again.
+#
+
+from __future__ import print_function
+try:
+    from .ucode_common import *
+except (ImportError, ValueError):
+    # run as a script
+    from ucode_common import *
+from multiprocessing import Pool
+import argparse, hashlib, json, os, re, sys, time
+
+UCODE_BATCH_VERSION = 1
+UCODE_NB_WORDS = (UCODE_FLAT_WIDTH + 31) // 32
+
+def batch_compile_file(path):
+    # the program in the format of the JSON output
+    loops_ops,code = ucode_load(path)
+    packed = ucode_pack(code, loops_ops)
+    flat = (packed['loops'] << UCODE_CODE_WIDTH) | packed['code']
+    return OrderedDict([
+        ('loops_ops', loops_ops),
+        ('code',      "%0*x" % (UCODE_CODE_WIDTH//4,  packed['code'])),
+        ('loops',     "%0*x" % (UCODE_LOOPS_WIDTH//4, packed['loops'])),
+        ('words',     ["%08x" % ((flat >> 32*i) & 0xffffffff) for i in range(UCODE_NB_WORDS)])
+    ])
+
+def batch_compile(job):
+    # Returns (record, cached) for a (path, cache_dir) job; the record is an
+    # error message if the program cannot be compiled.
+    path, cache_dir = job
+    try:
+        with open(path, "rb") as f:
+            sha = hashlib.sha1(("%d\n" % UCODE_BATCH_VERSION).encode('utf-8') + f.read())
+    except IOError as e:
+        return str(e), False
+    cached = None if cache_dir is None else os.path.join(cache_dir, "%s.json" % sha.hexdigest())
+    if cached is not None and os.path.isfile(cached):
+        with open(cached, "r") as f:
+            return json.loads(f.read(), object_pairs_hook=OrderedDict), True
+    try:
+        record = batch_compile_file(path)
+    except (ValueError, TypeError, KeyError, yaml.YAMLError) as e:
+        if isinstance(e, KeyError):
+            return "missing %s" % e, False
+        return str(e), False
+    if cached is not None:
+        # written to a temporary file first, for concurrent builds sharing the cache
+        tmp = "%s.%d.tmp" % (cached, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(json.dumps(record))
+        os.rename(tmp, cached)
+    return record, False
+
+def batch_names(paths):
+    # names from the paths without their common directory and extension
+    paths = [os.path.splitext(os.path.abspath(p))[0].split(os.sep) for p in paths]
+    common = len(os.path.commonprefix([p[:-1] for p in paths]))
+    return [re.sub(r'[^0-9A-Za-z_]', '_', "_".join(p[common:])).lower() for p in paths]
+
+def batch_write_sv(name, package, programs, source):
+    with open(name, "w") as f:
+        f.write("//\n// generated by ucode_batch.py from %d microcode programs\n//\n\n" % len(programs))
+        f.write("package %s;\n\n" % package)
+        for (n, path), record in zip(source, programs):
+            f.write("  // %s\n" % path)
+            f.write("  localparam logic [%d:0] UCODE_%s_CODE = %d'h%s;\n" % (UCODE_CODE_WIDTH-1, n.upper(), UCODE_CODE_WIDTH, record['code']))
+            f.write("  localparam logic [%d:0] UCODE_%s_LOOPS = %d'h%s;\n" % (UCODE_LOOPS_WIDTH-1, n.upper(), UCODE_LOOPS_WIDTH, record['loops']))
+            f.write("  localparam logic [%d:0] UCODE_%s = {UCODE_%s_LOOPS, UCODE_%s_CODE};\n\n" % (UCODE_FLAT_WIDTH-1, n.upper(), n.upper(), n.upper()))
+        f.write("endpackage // %s\n" % package)
+
+def batch_write_c(name, guard, programs, source):
+    with open(name, "w") as f:
+        f.write("/*\n * generated by ucode_batch.py from %d microcode programs\n */\n\n" % len(programs))
+        f.write("#ifndef __%s__\n#define __%s__\n\n#include <stdint.h>\n\n" % (guard, guard))
+        f.write("#define UCODE_NB_WORDS %d\n\n" % UCODE_NB_WORDS)
+        for (n, path), record in zip(source, programs):
+            f.write("/* %s */\n" % path)
+            f.write("static const uint32_t ucode_%s[UCODE_NB_WORDS] = {\n" % n)
+            f.write("  %s\n};\n\n" % ", ".join("0x%s" % w for w in record['words']))
+        f.write("#endif /* __%s__ */\n" % guard)
+
+def batch_write_json(name, programs, source):
+    out = OrderedDict()
+    for (n, path), record in zip(source, programs):
+        out[n] = OrderedDict([('path', path)] + list(record.items()))
+    with open(name, "w") as f:
+        f.write(json.dumps(out, indent=4))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compile many microcode programs to a SystemVerilog package, a C header and a JSON file.")
+    parser.add_argument("code", nargs="+", help="microcode programs")
+    parser.add_argument("-o", "--output", default="ucode", help="prefix of the output files (default: ucode)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes (default: all CPUs)")
+    parser.add_argument("--cache-dir", default=os.environ.get('UCODE_CACHE_DIR', os.path.join(os.path.expanduser("~"), ".cache", "ucode")), help="cache of compiled programs (default: $UCODE_CACHE_DIR or ~/.cache/ucode)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the cache")
+    args = parser.parse_args()
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    if cache_dir is not None and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    names = batch_names(args.code)
+    duplicates = sorted(set(n for n in names if names.count(n) > 1))
+    if len(duplicates) > 0:
+        print("ERROR: more than one program named %s." % ", ".join(duplicates))
+        sys.exit(1)
+
+    t0 = time.time()
+    jobs = [(p, cache_dir) for p in args.code]
+    if args.jobs == 1 or len(jobs) == 1:
+        results = [batch_compile(j) for j in jobs]
+    else:
+        pool = Pool(args.jobs)
+        try:
+            results = pool.map(batch_compile, jobs, chunksize=max(1, len(jobs)//64))
+        finally:
+            pool.close()
+            pool.join()
+    t1 = time.time()
+
+    errors = [(p, r) for p, (r, cached) in zip(args.code, results) if not isinstance(r, dict)]
+    for p, r in errors:
+        print("ERROR: %s: %s." % (p, r))
+    if len(errors) > 0:
+        sys.exit(1)
+
+    programs = [r for r, cached in results]
+    source = list(zip(names, args.code))
+    base = os.path.basename(args.output)
+    if os.path.dirname(args.output) != "" and not os.path.isdir(os.path.dirname(args.output)):
+        os.makedirs(os.path.dirname(args.output))
+    batch_write_sv(args.output + "_pkg.sv", re.sub(r'[^0-9A-Za-z_]', '_', base) + "_pkg", programs, source)
+    batch_write_c(args.output + ".h", re.sub(r'[^0-9A-Za-z_]', '_', base).upper() + "_H", programs, source)
+    batch_write_json(args.output + ".json", programs, source)
+    print("compiled %d programs (%d cached) in %.3f s" % (len(programs), sum(cached for r, cached in results), t1-t0))
+    print("written %s_pkg.sv, %s.h, %s.json" % (args.output, args.output, args.output))
@@ -14,15 +14,32 @@
 # specific language governing permissions and limitations under the License.
 #
 
+from __future__ import print_function
 from bitstring import *
-import yaml
+import os, yaml
 
 try:
     from collections import OrderedDict
 except ImportError:
     from ordereddict import OrderedDict
 
-NB_LOOPS = 6
+NB_LOOPS  = 6
+NB_REG    = 4
+REG_WIDTH = 32
+
+# fields of the ucode_t structure of hwpe_ctrl_package
+UCODE_LENGTH       = 16
+UCODE_ADDR_WIDTH   = 5
+UCODE_NB_OPS_WIDTH = 3
+UCODE_CNT_WIDTH    = 12 # range of the loops
+UCODE_OP_WIDTH     = 1 + 2*UCODE_ADDR_WIDTH
+UCODE_LOOP_WIDTH   = UCODE_ADDR_WIDTH + UCODE_NB_OPS_WIDTH
+UCODE_CODE_WIDTH   = UCODE_LENGTH * UCODE_OP_WIDTH
+UCODE_LOOPS_WIDTH  = NB_LOOPS * UCODE_LOOP_WIDTH
+UCODE_FLAT_WIDTH   = UCODE_LOOPS_WIDTH + UCODE_CODE_WIDTH # {loops, code}, as in mac_ctrl
+
+# program of mac_ctrl, default of the command-line tools
+UCODE_DEFAULT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "code.yml")
 
 def yaml_ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
     class OrderedLoader(Loader):
@@ -47,7 +64,7 @@ def ucode_state_machine(loops, curr_state, verbose=False):
     # if next operation is within the current loop, update address
     if curr_idx[curr_loop] < loops[curr_loop]['range'] - 1 and curr_op < loops[curr_loop]['nb_ops'] - 1:
         if verbose:
-            print "@%d %s UPDATE CURRENT LOOP                      " % (curr_addr, str(curr_state[3][::-1]))
+            print("@%d %s UPDATE CURRENT LOOP                      " % (curr_addr, str(curr_state[3][::-1])))
         next_addr = curr_addr + 1
         next_op   = curr_op + 1
         busy = True
@@ -55,9 +72,9 @@ def ucode_state_machine(loops, curr_state, verbose=False):
     # if there is a lower level loop, go to it
     elif curr_idx[curr_loop] < loops[curr_loop]['range'] - 1 and curr_loop > 0: 
         if verbose:
-            print "@%d %s ITERATE CURRENT LOOP & GOTO LOOP 0" % (curr_addr, str(curr_state[3][::-1]))
+            print("@%d %s ITERATE CURRENT LOOP & GOTO LOOP 0" % (curr_addr, str(curr_state[3][::-1])))
         next_loop = 0
-        for j in xrange(0,curr_loop):
+        for j in range(0,curr_loop):
             next_idx[j] = 0
         next_idx[curr_loop] = curr_idx[curr_loop] + 1
         next_addr = loops[0]['ucode_addr']
@@ -67,7 +84,7 @@ def ucode_state_machine(loops, curr_state, verbose=False):
     # if we are still within the current loop range, go back to start loop address
     elif curr_idx[curr_loop] < loops[curr_loop]['range'] - 1: 
         if verbose:
-            print "@%d %s ITERATE CURRENT LOOP                     " % (curr_addr, str(curr_state[3][::-1]))
+            print("@%d %s ITERATE CURRENT LOOP                     " % (curr_addr, str(curr_state[3][::-1])))
         next_addr = loops[curr_loop]['ucode_addr']
         next_op   = 0
         next_idx[curr_loop] = curr_idx[curr_loop] + 1
@@ -76,7 +93,7 @@ def ucode_state_machine(loops, curr_state, verbose=False):
     # if not, go to next loop
     elif curr_loop < NB_LOOPS-1:
         if verbose:
-            print "@%d %s GOTO NEXT LOOP                           " % (curr_addr, str(curr_state[3][::-1]))
+            print("@%d %s GOTO NEXT LOOP                           " % (curr_addr, str(curr_state[3][::-1])))
         next_loop = curr_loop + 1
         next_addr = loops[curr_loop+1]['ucode_addr']
         next_op   = 0
@@ -84,13 +101,13 @@ def ucode_state_machine(loops, curr_state, verbose=False):
         execute = False
     else:
         if verbose:
-            print "@%d %s TERMINATION                              " % (curr_addr, str(curr_state[3][::-1]))
+            print("@%d %s TERMINATION                              " % (curr_addr, str(curr_state[3][::-1])))
         end = True
         next_loop = 0
         next_addr = 0
         next_op   = 0
         next_idx  = []
-        for j in xrange(NB_LOOPS):
+        for j in range(NB_LOOPS):
             next_idx.append(0)
         busy = False
         execute = False
@@ -106,40 +123,75 @@ def ucode_execute(state, code, registers):
         new_registers[code[addr]['a']] = registers[code[addr]['b']]
     return new_registers
 
+def ucode_run(loops, code, registers, verbose=False):
+    # reference step-by-step driver: returns the trace of all steps until
+    # termination, as (addr, loop, op, idx, registers, execute, busy, end)
+    # tuples, where idx and registers are taken before the step, and the
+    # final registers
+    state = (0, 0, 0, [0]*NB_LOOPS)
+    trace = []
+    while True:
+        addr, loop, op, idx = state
+        # the state machine updates the index list in place
+        step = (addr, loop, op, idx[:], registers[:])
+        execute,end,busy,next_state = ucode_state_machine(loops, state, verbose=verbose)
+        trace.append(step + (execute, busy, end))
+        if execute:
+            registers = ucode_execute(state, code, registers)
+        state = next_state
+        if end:
+            break
+    return trace, registers
+
 def ucode_print_idx(state, registers):
-    print "loop:%d W:%d x:%d y:%d" % (state[1], registers[0], registers[1], registers[2])
+    print("loop:%d W:%d x:%d y:%d" % (state[1], registers[0], registers[1], registers[2]))
 
-def ucode_bytecode(code, loops_ops):
-    bytecode = {}
-    bytecode['code'] = BitArray()
-    for c in code[::-1]:
-        if c['op_sel'] == 1:
-            b = BitArray(uint=1, length=1)
-        else:
-            b = BitArray(uint=0, length=1)
-        a_b = BitArray(uint=c['a'], length=5)
-        b_b = BitArray(uint=c['b'], length=5)
-        b.append(a_b)
-        b.append(b_b)
-        bytecode['code'].append(b)
-    if bytecode['code'].length < 176:
-        bytecode['code'].prepend(BitArray(uint=0, length=176-bytecode['code'].length))
-    bytecode['loops'] = BitArray()
+def ucode_pack(code, loops_ops):
+    # Returns the code and loops fields of the microcode as integers, with
+    # the first operation / loop in the least significant bits. Raises
+    # ValueError if the program does not fit in the fields.
+    if len(code) > UCODE_LENGTH:
+        raise ValueError("%d operations, at most %d are supported" % (len(code), UCODE_LENGTH))
+    if len(loops_ops) > NB_LOOPS:
+        raise ValueError("%d loops, at most %d are supported" % (len(loops_ops), NB_LOOPS))
+    if sum(loops_ops) != len(code):
+        raise ValueError("the loops have %d operations, the code %d" % (sum(loops_ops), len(code)))
+    packed = {'code': 0, 'loops': 0}
+    for i,c in enumerate(code):
+        for f,w in (('op_sel', 1), ('a', UCODE_ADDR_WIDTH), ('b', UCODE_ADDR_WIDTH)):
+            if not isinstance(c[f], int) or c[f] < 0 or c[f] >= 1 << w:
+                raise ValueError("operation %d: %s=%r does not fit in %d bits" % (i, f, c[f], w))
+        op = (c['op_sel'] << 2*UCODE_ADDR_WIDTH) | (c['a'] << UCODE_ADDR_WIDTH) | c['b']
+        packed['code'] |= op << (i*UCODE_OP_WIDTH)
     a = 0
-    loops_addr = []
-    for o in loops_ops:
-        loops_addr.append(a)
+    for l,o in enumerate(loops_ops):
+        if o < 0 or o >= 1 << UCODE_NB_OPS_WIDTH:
+            raise ValueError("loop %d: %d operations do not fit in %d bits" % (l, o, UCODE_NB_OPS_WIDTH))
+        packed['loops'] |= ((a << UCODE_NB_OPS_WIDTH) | o) << (l*UCODE_LOOP_WIDTH)
         a += o
-    for o,a in zip(loops_ops[::-1], loops_addr[::-1]):
-        a_b = BitArray(uint=a, length=5)
-        o_b = BitArray(uint=o, length=3)
-        bytecode['loops'].append(a_b)
-        bytecode['loops'].append(o_b)
+    return packed
+
+def ucode_bytecode(code, loops_ops):
+    packed = ucode_pack(code, loops_ops)
+    bytecode = {}
+    bytecode['code']  = BitArray(uint=packed['code'], length=UCODE_CODE_WIDTH)
+    bytecode['loops'] = BitArray(uint=packed['loops'], length=UCODE_LOOP_WIDTH*len(loops_ops))
     return bytecode
 
+def ucode_flat(code, loops_ops):
+    # the {loops, code} value of ucode_flat in mac_ctrl, as an integer
+    packed = ucode_pack(code, loops_ops)
+    return (packed['loops'] << UCODE_CODE_WIDTH) | packed['code']
+
 def ucode_load(name):
+    # name is a path or an open stream
+    if hasattr(name, 'read'):
+        return ucode_parse(yaml_ordered_load(name, yaml.SafeLoader))
     with open(name) as f:
-        code_p = yaml_ordered_load(f, yaml.SafeLoader)
+        return ucode_parse(yaml_ordered_load(f, yaml.SafeLoader))
+
+def ucode_parse(code_p):
+    # program from its mapping of mnemonics and code, as in code.yml
     mnem_p = code_p['mnemonics']
     code_p = code_p['code']
     # code_p is a dictionary of loops
@@ -166,6 +218,90 @@ def ucode_load(name):
         code.append(cn)
     return loops_ops,code
 
+def ucode_pad_loops(loops_ops, loops_range):
+    # unused loops have no operations and a range of 1
+    loops_ops   = list(loops_ops)   + [0]*(NB_LOOPS-len(loops_ops))
+    loops_range = list(loops_range) + [1]*(NB_LOOPS-len(loops_range))
+    return loops_ops, loops_range
+
+def ucode_loop_iterations(loops_range, iteration=None):
+    # number of increments of the loop indices carried up to each loop among
+    # the first `iteration` ones (by default, all of them), in closed form:
+    # the increments carried up to loop L or beyond are the multiples of the
+    # product of the ranges of loops 0..L-1
+    ranges = [max(r, 1) for r in ucode_pad_loops([], loops_range)[1]]
+    if iteration is None:
+        iteration = 1
+        for r in ranges:
+            iteration *= r
+        iteration -= 1
+    counts = []
+    stride = 1
+    for r in ranges:
+        counts.append(iteration // stride - iteration // (stride * r))
+        stride *= r
+    return counts
+
+def ucode_cycles(code, loops_ops, loops_range):
+    # cost of a microcode program, in closed form (see ucode_state_machine):
+    #  - 'cycles':     all steps, including termination
+    #  - 'iterations': updates of the loop indices
+    #  - 'execute':    steps executing an operation
+    #  - 'busy':       busy steps
+    #  - 'stall':      busy steps not executing (GOTO NEXT LOOP)
+    #  - 'updates':    writes to each register, by register
+    # An increment carried up to loop L costs L GOTO NEXT LOOP steps, then
+    # executes the operations of loop L (a single one if the loop has none),
+    # all of them busy but the last one; termination costs NB_LOOPS steps.
+    loops_ops, loops_range = ucode_pad_loops(loops_ops, loops_range)
+    counts = ucode_loop_iterations(loops_range)
+    cost = OrderedDict([
+        ('cycles',     NB_LOOPS),
+        ('iterations', sum(counts)),
+        ('execute',    0),
+        ('busy',       NB_LOOPS-1),
+        ('stall',      NB_LOOPS-1),
+        ('updates',    OrderedDict())
+    ])
+    addr = 0
+    for l,(o,n) in enumerate(zip(loops_ops, counts)):
+        nb_exec = max(o, 1)
+        cost['cycles']  += n * (l + nb_exec)
+        cost['execute'] += n * nb_exec
+        cost['busy']    += n * (l + nb_exec - 1)
+        cost['stall']   += n * l
+        for a in range(addr, addr+nb_exec):
+            # outside of the code, the RTL executes zeroed entries (mv 0,0)
+            r = code[a]['a'] if a < len(code) else 0
+            if n > 0:
+                cost['updates'][r] = cost['updates'].get(r, 0) + n
+        addr += o
+    cost['updates'] = OrderedDict(sorted(cost['updates'].items()))
+    return cost
+
+def ucode_cycles_reference(code, loops_ops, loops_range):
+    # same as ucode_cycles, counted by stepping
+    loops_ops, loops_range = ucode_pad_loops(loops_ops, loops_range)
+    loops = ucode_get_loops(loops_ops, loops_range)
+    # the RTL code memory is zeroed after the program
+    code = code + [{'op_sel': 0, 'a': 0, 'b': 0}]*(sum(loops_ops)+1)
+    registers = [0]*(max([c['a'] for c in code] + [c['b'] for c in code])+1)
+    trace, registers = ucode_run(loops, code, registers)
+    cost = OrderedDict([
+        ('cycles',     len(trace)),
+        ('iterations', len([s for s in trace if not s[6] and not s[7]])),
+        ('execute',    len([s for s in trace if s[5]])),
+        ('busy',       len([s for s in trace if s[6]])),
+        ('stall',      len([s for s in trace if s[6] and not s[5]])),
+        ('updates',    OrderedDict())
+    ])
+    for s in trace:
+        if s[5]:
+            r = code[s[0]]['a']
+            cost['updates'][r] = cost['updates'].get(r, 0) + 1
+    cost['updates'] = OrderedDict(sorted(cost['updates'].items()))
+    return cost
+
 def ucode_get_loops(loops_ops, loops_range):
     loops = []
     a = 0
@@ -179,7 +315,7 @@ def ucode_get_loops(loops_ops, loops_range):
     return loops
 
 # state = (0,0,0,[0,0,0,0])
-# for i in xrange(0,50):
+# for i in range(0,50):
 #     ucode_execute(state, code, registers)
 #     ucode_print_idx(i, state, registers)
 #     end,state = ucode_state_machine(loops, state, verbose=True)
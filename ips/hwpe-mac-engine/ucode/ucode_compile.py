@@ -13,11 +13,50 @@
 # CONDITIONS OF ANY KIND, either express or implied. See the License for the
 # specific language governing permissions and limitations under the License.
 #
+# Prints the bytecode of a microcode program and, given the loop ranges, its
+# cost in cycles:
+#   python ucode_compile.py
+#   python ucode_compile.py code.yml --range 16 --check
+#
+
+from __future__ import print_function
+try:
+    from .ucode_common import *
+except (ImportError, ValueError):
+    # run as a script
+    from ucode_common import *
+import argparse, sys
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compile a microcode program.")
+    parser.add_argument("code", nargs="?", default=UCODE_DEFAULT, help="microcode (default: code.yml of mac_ctrl)")
+    parser.add_argument("--range", type=int, nargs="+", default=None, help="range of each loop, from loop 0, to print the cost of the program")
+    parser.add_argument("--check", action="store_true", help="check the cost against the step-by-step model")
+    args = parser.parse_args()
 
-from ucode_common import *
+    loops_ops,code = ucode_load(args.code)
 
-loops_ops,code = ucode_load("code.yml")
+    bytecode = ucode_bytecode(code, loops_ops)
+    print("ucode bytecode: %d'h%s" % (len(bytecode['code']), str(bytecode['code'].hex)))
+    print("ucode loops:    %d'h%s" % (len(bytecode['loops']), str(bytecode['loops'].hex)))
 
-bytecode = ucode_bytecode(code, loops_ops)
-print "ucode bytecode: %d'h%s" % (bytecode['code'].length, str(bytecode['code'].hex))
-print "ucode loops:    %d'h%s" % (bytecode['loops'].length, str(bytecode['loops'].hex))
+    if args.range is not None:
+        if len(loops_ops) > NB_LOOPS or len(args.range) > NB_LOOPS:
+            print("ERROR: at most %d loops are supported." % NB_LOOPS)
+            sys.exit(1)
+        with open(args.code) as f:
+            mnem = yaml_ordered_load(f, yaml.SafeLoader)['mnemonics']
+        names = dict((v,k) for k,v in mnem.items())
+        cost = ucode_cycles(code, loops_ops, args.range)
+        print("cycles:         %d" % cost['cycles'])
+        print("iterations:     %d" % cost['iterations'])
+        print("execute:        %d" % cost['execute'])
+        print("busy:           %d" % cost['busy'])
+        print("stall:          %d" % cost['stall'])
+        for r,n in cost['updates'].items():
+            print("updates %-7s %d" % (names.get(r, str(r)) + ":", n))
+        if args.check:
+            if ucode_cycles_reference(code, loops_ops, args.range) != cost:
+                print("ERROR: the cost differs from the step-by-step model.")
+                sys.exit(1)
+            print("identical to the step-by-step model")
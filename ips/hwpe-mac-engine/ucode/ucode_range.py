@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+#
+# ucode_range.py
+# Francesco Conti <fconti@iis.ee.ethz.ch>
+#
+# Copyright (C) 2018 ETH Zurich, University of Bologna
+# Copyright and related rights are licensed under the Solderpad Hardware
+# License, Version 0.51 (the "License"); you may not use this file except in
+# compliance with the License.  You may obtain a copy of the License at
+# http://solderpad.org/licenses/SHL-0.51. Unless required by applicable law
+# or agreed to in writing, software, hardware and materials distributed under
+# this License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# Computes statically the minimum and maximum value reached by each register
+# written by a microcode program, and checks them against the register width
+# and the buffers addressed by the registers:
+#   python ucode_range.py code.yml --range 16 --reg iter_stride=64 --reg one_stride=4 \
+#     --buffer a=1024:64 --buffer b=1024:64 --buffer c=64 --buffer d=64
+# where a buffer NAME=SIZE[:EXTENT] is SIZE bytes, accessed EXTENT bytes (by
+# default, one 32-bit word) from the offset in register NAME. Exits with 1 if
+# a register overflows (registers are unsigned, or signed with --signed) or an
+# access is out of bounds.
+#
+# In the usual programs, each register is only added constants (read-only
+# registers or registers never written) or moved one, so the operations of
+# loop L make it x+t or s. A loop nest is a mixed-radix counter, and the state
+# of iteration (d0, ..., dN) is reached by applying d = dN times the map of
+# loop N (a sweep of the inner loops, then its operations), ..., and d0 times
+# the one of loop 0. Over d in 0..range-1, x+t covers [x+min(0,d*t),
+# x+max(0,d*t)] and s adds one value, so the interval of the register is
+# exact and computed from the outermost loop in, in microseconds. Programs
+# where written registers read each other are traced instead (exact, but in
+# time proportional to the number of steps).
+#
+
+from __future__ import print_function
+try:
+    from .ucode_common import *
+except (ImportError, ValueError):
+    # run as a script
+    from ucode_common import *
+import argparse, sys, time
+
+def range_then(f, g):
+    # map f, then g; maps are ('add', t) or ('set', s)
+    if g[0] == 'set':
+        return g
+    return (f[0], f[1] + g[1])
+
+def range_power(f, d):
+    if d == 0:
+        return ('add', 0)
+    if f[0] == 'set':
+        return f
+    return ('add', d * f[1])
+
+def range_apply(f, lo, hi, interval):
+    # interval of f^d(x) for x in interval and d in lo..hi
+    if hi == 0:
+        return interval
+    if f[0] == 'add':
+        return (interval[0] + min(lo*f[1], hi*f[1]), interval[1] + max(lo*f[1], hi*f[1]))
+    if lo >= 1:
+        return (f[1], f[1])
+    return (min(interval[0], f[1]), max(interval[1], f[1]))
+
+def range_hull(maps, digits, value):
+    # interval of the register over the iterations with loop indices in the
+    # given (lo, hi) ranges, outermost loop first
+    interval = (value, value)
+    for L in reversed(range(NB_LOOPS)):
+        interval = range_apply(maps[L], digits[L][0], digits[L][1], interval)
+    return interval
+
+def range_code(code, loops_ops, loops_range):
+    # addresses executed by each loop (None for the loops never incremented)
+    # and the registers they write; zeroed entries beyond the code are no-ops
+    loops_ops, loops_range = ucode_pad_loops(loops_ops, loops_range)
+    rng = [max(r, 1) for r in loops_range]
+    executed = []
+    a = 0
+    for L in range(NB_LOOPS):
+        addrs = [i for i in range(a, a+max(loops_ops[L], 1)) if i < len(code)]
+        executed.append(addrs if rng[L] > 1 else None)
+        a += loops_ops[L]
+    written = sorted(set(code[i]['a'] for addrs in executed if addrs is not None for i in addrs))
+    return rng, executed, written
+
+def ucode_range(code, loops_ops, loops_range, registers):
+    # Returns an OrderedDict with, for each written register, its 'min' and
+    # 'max' value and its map in each loop ('levels'), None if written
+    # registers read each other (see ucode_range_traced).
+    rng, executed, written = range_code(code, loops_ops, loops_range)
+    result = OrderedDict()
+    for r in written:
+        # map of the operations of each loop, and prefixes ending in a write
+        ops = []
+        prefixes = []
+        for L in range(NB_LOOPS):
+            f = ('add', 0)
+            p = []
+            for i in (executed[L] or []):
+                c = code[i]
+                if c['a'] != r:
+                    continue
+                if c['b'] == r:
+                    if c['op_sel']:
+                        return None
+                    continue
+                if c['b'] in written:
+                    return None
+                f = range_then(f, ('add', registers[c['b']]) if c['op_sel'] else ('set', registers[c['b']]))
+                p.append(f)
+            ops.append(f)
+            prefixes.append(p[:-1])
+        # map of an increment of loop L: a sweep of the inner loops, from all
+        # indices at 0 to all at the end of their range, then the operations
+        maps = []
+        sweep = ('add', 0)
+        for L in range(NB_LOOPS):
+            maps.append(range_then(sweep, ops[L]))
+            sweep = range_then(range_power(maps[L], rng[L]-1), sweep)
+        full = [(0, rng[L]-1) for L in range(NB_LOOPS)]
+        lo, hi = range_hull(maps, full, registers[r])
+        # partial updates, within an increment of loop L
+        for L in range(NB_LOOPS):
+            if len(prefixes[L]) == 0:
+                continue
+            # the iterations before an increment of loop L, with the inner
+            # indices at the end of their range
+            digits = [(rng[j]-1, rng[j]-1) for j in range(L)] + [(0, rng[L]-2)] + full[L+1:]
+            before = range_hull(maps, digits, registers[r])
+            for f in prefixes[L]:
+                plo, phi = range_apply(f, 1, 1, before)
+                lo, hi = min(lo, plo), max(hi, phi)
+        result[r] = OrderedDict([('min', lo), ('max', hi), ('levels', ops)])
+    return result
+
+def ucode_range_traced(code, loops_ops, loops_range, registers, chunk_size=1<<20):
+    # same as ucode_range (without 'levels'), from the trace of all steps
+    try:
+        from .ucode_trace import ucode_trace_chunks
+    except (ImportError, ValueError):
+        from ucode_trace import ucode_trace_chunks
+    rng, executed, written = range_code(code, loops_ops, loops_range)
+    nb_reg = max(written) + 1 if len(written) > 0 else 1
+    registers = list(registers) + [0]*(nb_reg-len(registers))
+    lo = dict((r, registers[r]) for r in written)
+    hi = dict((r, registers[r]) for r in written)
+    for chunk in ucode_trace_chunks(code, loops_ops, loops_range, registers, chunk_size=chunk_size, nb_reg=nb_reg):
+        for r in written:
+            lo[r] = min(lo[r], int(chunk['registers'][:,r].min()))
+            hi[r] = max(hi[r], int(chunk['registers'][:,r].max()))
+    result = OrderedDict()
+    for r in written:
+        result[r] = OrderedDict([('min', lo[r]), ('max', hi[r])])
+    return result
+
+def range_register(name, mnem):
+    try:
+        return mnem[name]
+    except KeyError:
+        return int(name, 0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the range of the registers of a microcode program.")
+    parser.add_argument("code", nargs="?", default=UCODE_DEFAULT, help="microcode (default: code.yml of mac_ctrl)")
+    parser.add_argument("--range", type=int, nargs="+", default=[1], help="range of each loop, from loop 0")
+    parser.add_argument("--reg", action="append", default=[], metavar="REG=VALUE", help="initial value of a register, by mnemonic or index (default: 0)")
+    parser.add_argument("--buffer", action="append", default=[], metavar="REG=SIZE[:EXTENT]", help="size of the buffer addressed by a register, in bytes, and extent of each access (default: 4)")
+    parser.add_argument("--reg-width", type=int, default=REG_WIDTH, help="width of the registers (default: %d)" % REG_WIDTH)
+    parser.add_argument("--signed", action="store_true", help="registers hold signed values (default: unsigned, as address offsets)")
+    parser.add_argument("--check", action="store_true", help="compare with the trace of all steps")
+    args = parser.parse_args()
+
+    loops_ops,code = ucode_load(args.code)
+    if len(loops_ops) > NB_LOOPS or len(args.range) > NB_LOOPS:
+        print("ERROR: at most %d loops are supported." % NB_LOOPS)
+        sys.exit(1)
+    with open(args.code) as f:
+        mnem = yaml_ordered_load(f, yaml.SafeLoader).get('mnemonics') or {}
+    names = dict((v,k) for k,v in mnem.items())
+    registers = [0]*(1 << UCODE_ADDR_WIDTH)
+    for r in args.reg:
+        name,value = r.split("=", 1)
+        registers[range_register(name, mnem)] = int(value, 0)
+    buffers = OrderedDict()
+    for b in args.buffer:
+        name,size = b.split("=", 1)
+        size,extent = (size.split(":", 1) + ["4"])[:2]
+        buffers[range_register(name, mnem)] = (int(size, 0), int(extent, 0))
+
+    t0 = time.time()
+    result = ucode_range(code, loops_ops, args.range, registers)
+    t1 = time.time()
+    if result is None:
+        print("registers read each other: tracing all steps")
+        result = ucode_range_traced(code, loops_ops, args.range, registers)
+        t1 = time.time()
+    print("analyzed in %.1f us" % ((t1-t0)*1e6))
+
+    if args.signed:
+        reg_min, reg_max = -(1 << (args.reg_width-1)), (1 << (args.reg_width-1)) - 1
+    else:
+        reg_min, reg_max = 0, (1 << args.reg_width) - 1
+    errors = 0
+    for r,v in result.items():
+        line = "%-12s [%d, %d]" % (names.get(r, str(r)) + ":", v['min'], v['max'])
+        if 'levels' in v:
+            line += "  " + " ".join("L%d:%s%d" % (L, "+" if f[0] == 'add' else "=", f[1]) for L,f in enumerate(v['levels']) if f != ('add', 0))
+        print(line)
+        if v['min'] < reg_min or v['max'] > reg_max:
+            print("ERROR: register %s overflows the %d-bit %s range [%d, %d]." % (names.get(r, str(r)), args.reg_width, "signed" if args.signed else "unsigned", reg_min, reg_max))
+            errors += 1
+    for r,(size,extent) in buffers.items():
+        v = result.get(r, OrderedDict([('min', registers[r]), ('max', registers[r])]))
+        if v['min'] < 0 or v['max'] + extent > size:
+            print("ERROR: accesses of %d bytes from register %s in [%d, %d] are out of the %d bytes of its buffer." % (extent, names.get(r, str(r)), v['min'], v['max'], size))
+            errors += 1
+    if args.check:
+        ref = ucode_range_traced(code, loops_ops, args.range, registers)
+        for r in ref:
+            if ref[r]['min'] != result[r]['min'] or ref[r]['max'] != result[r]['max']:
+                print("ERROR: the range of register %s differs from the trace: [%d, %d]." % (names.get(r, str(r)), ref[r]['min'], ref[r]['max']))
+                sys.exit(1)
+        print("identical to the trace")
+    if errors > 0:
+        sys.exit(1)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+#
+# ucode_trace.py
+# Francesco Conti <fconti@iis.ee.ethz.ch>
+#
+# Copyright (C) 2018 ETH Zurich, University of Bologna
+# Copyright and related rights are licensed under the Solderpad Hardware
+# License, Version 0.51 (the "License"); you may not use this file except in
+# compliance with the License.  You may obtain a copy of the License at
+# http://solderpad.org/licenses/SHL-0.51. Unless required by applicable law
+# or agreed to in writing, software, hardware and materials distributed under
+# this License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# Computes the complete step trace of the hwpe_ctrl_ucode sequencer with
+# NumPy, bit-exact with the step-by-step model of ucode_common.py:
+#   python ucode_trace.py code.yml --range 16 --reg 5=64 --reg 6=4 -o trace.npz
+#   python ucode_trace.py code.yml --range 16 --reg 5=64 --reg 6=4 --check
+# With --chunk, the trace is streamed in chunks with bounded memory (one .npz
+# file per chunk); --first and --last select a range of iterations.
+#
+
+from __future__ import print_function
+try:
+    from .ucode_common import *
+except (ImportError, ValueError):
+    # run as a script
+    from ucode_common import *
+import numpy as np
+import argparse, sys, time
+
+def ucode_trace_loops(loops_ops, loops_range):
+    # operations, ranges (at least 1) and start address of all loops
+    loops_ops, loops_range = ucode_pad_loops(loops_ops, loops_range)
+    ops   = np.array(loops_ops, dtype=np.int64)
+    rng   = np.maximum(np.array(loops_range, dtype=np.int64), 1)
+    addr0 = np.concatenate(([0], np.cumsum(ops)[:-1]))
+    return ops, rng, addr0
+
+def ucode_trace_digits(rng, state):
+    # loop indices of each state of the counter
+    digits = np.empty((len(state), NB_LOOPS), dtype=np.int64)
+    stride = 1
+    for j in range(NB_LOOPS):
+        digits[:,j] = (state // stride) % rng[j]
+        stride *= rng[j]
+    return digits
+
+def ucode_trace_steps(loops_ops, loops_range, first=0, last=None):
+    # Returns the control fields of the steps of iterations first..last-1:
+    # 'iteration', 'addr', 'loop', 'op', 'idx', 'execute', 'busy', 'end'.
+    #
+    # The loop nest is a mixed-radix counter over the loop ranges, and an
+    # iteration is one increment of the counter. An iteration carried up to
+    # loop L costs L non-executing GOTO NEXT LOOP steps followed by the
+    # operations of loop L (one step if the loop has no operations). The last
+    # iteration, with all indices at the end of their range, is termination
+    # and costs NB_LOOPS steps.
+    ops, rng, addr0 = ucode_trace_loops(loops_ops, loops_range)
+    nb_exec = np.maximum(ops, 1)
+    nb_iter = int(np.prod(rng))
+    if last is None or last > nb_iter:
+        last = nb_iter
+    state = np.arange(first, min(last, nb_iter-1), dtype=np.int64)
+    digits = ucode_trace_digits(rng, state)
+    level = np.zeros(len(state), dtype=np.int64)
+    carry = np.ones(len(state), dtype=bool)
+    for j in range(NB_LOOPS):
+        carry &= digits[:,j] == rng[j]-1
+        level += carry
+    length = level + nb_exec[level]
+    start = np.cumsum(length) - length
+    tick = np.repeat(np.arange(len(state)), length)
+    lvl  = level[tick]
+    off  = np.arange(len(tick)) - start[tick]
+    goto = off < lvl
+    loop = np.where(goto, off, lvl)
+    op   = np.where(goto, 0, off-lvl)
+    steps = {
+        'iteration' : state[tick],
+        'loop'      : loop,
+        'op'        : op,
+        'idx'       : digits[tick],
+        'execute'   : ~goto,
+        'busy'      : goto | (op < nb_exec[lvl]-1),
+        'end'       : np.zeros(len(tick), dtype=bool)
+    }
+    if last == nb_iter:
+        # termination: GOTO NEXT LOOP through all loops, then TERMINATION
+        term = np.arange(NB_LOOPS)
+        steps['iteration'] = np.concatenate((steps['iteration'], np.full(NB_LOOPS, nb_iter-1, dtype=np.int64)))
+        steps['loop']      = np.concatenate((steps['loop'], term))
+        steps['op']        = np.concatenate((steps['op'], np.zeros(NB_LOOPS, dtype=np.int64)))
+        steps['idx']       = np.concatenate((steps['idx'], np.tile(rng-1, (NB_LOOPS,1))))
+        steps['execute']   = np.concatenate((steps['execute'], np.zeros(NB_LOOPS, dtype=bool)))
+        steps['busy']      = np.concatenate((steps['busy'], term < NB_LOOPS-1))
+        steps['end']       = np.concatenate((steps['end'], term == NB_LOOPS-1))
+    steps['addr'] = addr0[steps['loop']] + steps['op']
+    return steps
+
+def ucode_trace(code, loops_ops, loops_range, registers, nb_reg=NB_REG, first=0, last=None):
+    # Returns a dictionary of arrays with one row per step, as ucode_run:
+    # 'addr', 'loop', 'op', 'idx' (steps x NB_LOOPS), 'registers' (steps x
+    # nb_reg, taken before the step), 'execute', 'busy', 'end', and the
+    # 'iteration' of each step; plus the list of 'final_registers'. Register
+    # values must fit in 64 bits; ValueError if fewer than nb_reg registers
+    # are given.
+    # With first and last, only iterations first..last-1 are traced, starting
+    # from the registers given, which must be the ones at iteration first (see
+    # ucode_iteration_registers).
+    if len(registers) < nb_reg:
+        raise ValueError("%d registers given, at least %d expected" % (len(registers), nb_reg))
+    trace = ucode_trace_steps(loops_ops, loops_range, first, last)
+    regs, final = ucode_trace_registers(code, trace['addr'], trace['execute'], registers)
+    trace['registers'] = np.empty((len(trace['addr']), nb_reg), dtype=np.int64)
+    for r in range(nb_reg):
+        trace['registers'][:,r] = regs[r] if r in regs else registers[r]
+    trace['final_registers'] = final
+    return trace
+
+def ucode_iteration_count(loops_range):
+    return int(np.prod(ucode_trace_loops([], loops_range)[1]))
+
+def ucode_iteration_step(loops_ops, loops_range, iteration):
+    # index of the first step of an iteration, in closed form
+    ops = ucode_trace_loops(loops_ops, loops_range)[0]
+    counts = ucode_loop_iterations(loops_range, iteration)
+    return sum(n * (l + max(int(o), 1)) for l,(o,n) in enumerate(zip(ops, counts)))
+
+def ucode_iteration_registers(code, loops_ops, loops_range, registers, iteration):
+    # Registers at the beginning of an iteration, in closed form. Each loop
+    # applies a linear map to the register file. A full sweep of loops 0..L
+    # is a sweep of loops 0..L-1 followed by range-1 times the map of loop L
+    # and another sweep of loops 0..L-1. Iteration k is reached by as many
+    # (sweep of loops 0..L-1, map of loop L) pairs as the index of loop L in
+    # iteration k, from the outermost loop.
+    ops, rng, addr0 = ucode_trace_loops(loops_ops, loops_range)
+    nb_exec = np.maximum(ops, 1)
+    n = len(registers)
+    identity = np.identity(n, dtype=np.int64)
+    maps = []
+    for L in range(NB_LOOPS):
+        m = identity
+        for addr in range(addr0[L], addr0[L]+nb_exec[L]):
+            # addresses outside of the code are no-ops, as in the RTL
+            if addr >= len(code):
+                continue
+            c = code[addr]
+            op = identity.copy()
+            op[c['a']] = identity[c['b']] + (identity[c['a']] if c['op_sel'] else 0)
+            m = np.dot(op, m)
+        maps.append(m)
+    sweeps = []
+    sweep = identity
+    for L in range(NB_LOOPS):
+        sweeps.append(sweep)
+        sweep = np.dot(sweep, np.linalg.matrix_power(np.dot(maps[L], sweep), int(rng[L])-1))
+    digits = ucode_trace_digits(rng, np.array([iteration], dtype=np.int64))[0]
+    values = np.array(registers, dtype=np.int64)
+    for L in range(NB_LOOPS-1, -1, -1):
+        values = np.dot(np.linalg.matrix_power(np.dot(maps[L], sweeps[L]), int(digits[L])), values)
+    return [int(v) for v in values]
+
+def ucode_trace_chunks(code, loops_ops, loops_range, registers, chunk_size=1<<20, first=0, last=None, nb_reg=NB_REG):
+    # Generator of the trace of iterations first..last-1 (by default, all of
+    # them) in chunks of chunk_size steps (the last one may be shorter), as
+    # dictionaries like the ones of ucode_trace plus 'first_step', the index of
+    # the first step of the chunk. Memory is bounded by the chunk size; the
+    # state at iteration first is computed in closed form, so that disjoint
+    # ranges of iterations can be traced independently, e.g. in parallel.
+    nb_iter = ucode_iteration_count(loops_range)
+    if last is None or last > nb_iter:
+        last = nb_iter
+    ops = ucode_trace_loops(loops_ops, loops_range)[0]
+    # an iteration costs at most NB_LOOPS steps
+    block = max(1, chunk_size // (NB_LOOPS + int(max(ops.max(), 1))))
+    step = ucode_iteration_step(loops_ops, loops_range, first)
+    registers = ucode_iteration_registers(code, loops_ops, loops_range, registers, first)
+    pending = []
+    nb_pending = 0
+    for k in range(first, last, block):
+        trace = ucode_trace(code, loops_ops, loops_range, registers, nb_reg=nb_reg, first=k, last=min(k+block, last))
+        registers = trace.pop('final_registers')
+        pending.append(trace)
+        nb_pending += len(trace['addr'])
+        while nb_pending >= chunk_size or (k+block >= last and nb_pending > 0):
+            if len(pending) > 1:
+                pending = [dict((f, np.concatenate([p[f] for p in pending])) for f in pending[0].keys())]
+            chunk = dict((f, v[:chunk_size]) for f,v in pending[0].items())
+            pending = [dict((f, v[chunk_size:]) for f,v in pending[0].items())]
+            nb_pending -= len(chunk['addr'])
+            chunk['first_step'] = step
+            step += len(chunk['addr'])
+            yield chunk
+
+def ucode_trace_registers(code, addr, execute, registers):
+    # Returns the values of the written registers before each step, by
+    # register, and the final registers. Each register is computed in one
+    # shot as a cumulative sum of its increments, restarted at each move, once
+    # the registers it reads are known; registers depending on each other in a
+    # cycle (or doubling themselves) are computed by stepping.
+    # addresses outside of the code read zeroed entries, i.e. no-ops, as in the RTL
+    size = max(len(code), int(addr.max())+1)
+    code_a   = np.zeros(size, dtype=np.int64)
+    code_b   = np.zeros(size, dtype=np.int64)
+    code_sel = np.zeros(size, dtype=bool)
+    for i,c in enumerate(code):
+        code_a[i], code_b[i], code_sel[i] = c['a'], c['b'], c['op_sel']
+    steps = np.nonzero(execute)[0]
+    wa  = code_a[addr[steps]]
+    wb  = code_b[addr[steps]]
+    sel = code_sel[addr[steps]]
+    # dependencies between registers, from the executed code entries
+    used = np.zeros(size, dtype=bool)
+    used[addr[steps]] = True
+    used = np.nonzero(used)[0]
+    written = sorted(set(int(r) for r in code_a[used]))
+    deps = {}
+    for r in written:
+        entries = used[code_a[used] == r]
+        if np.any(code_sel[entries] & (code_b[entries] == r)):
+            deps = None
+            break
+        deps[r] = set(int(b) for b in code_b[entries]) & set(written) - set([r])
+    order = []
+    while deps is not None and len(order) < len(written):
+        ready = [r for r in written if r not in order and deps[r] <= set(order)]
+        if len(ready) == 0:
+            deps = None
+            break
+        order.extend(ready)
+    if deps is None:
+        # stepping fallback, without copying the register file at each step
+        values = list(registers)
+        after = np.empty(len(steps), dtype=np.int64)
+        for i in range(len(steps)):
+            a, b = wa[i], wb[i]
+            values[a] = values[a] + values[b] if sel[i] else values[b]
+            after[i] = values[a]
+        order = written
+    regs = {}
+    final = list(registers)
+    for r in order:
+        mask = wa == r
+        if deps is not None:
+            b = wb[mask]
+            read = np.array(registers, dtype=np.int64)[b]
+            for x in deps[r]:
+                read[b == x] = regs[x][steps[mask][b == x]]
+            # moves restart the sum, moving a register on itself is a no-op
+            move = ~sel[mask] & (b != r)
+            inc = np.where(move | (b == r), 0, read)
+            csum = np.cumsum(inc)
+            segment = np.cumsum(move)
+            base = np.concatenate(([registers[r]], read[move]))
+            offs = np.concatenate(([0], csum[move]))
+            values_r = base[segment] + csum - offs[segment]
+        else:
+            values_r = after[mask]
+        # value before each step: the one after the last write before it
+        writes = np.zeros(len(addr), dtype=np.int64)
+        writes[steps[mask]] = 1
+        before = np.cumsum(writes) - writes
+        regs[r] = np.concatenate(([registers[r]], values_r))[before]
+        if len(values_r) > 0:
+            final[r] = int(values_r[-1])
+    return regs, final
+
+def ucode_trace_reference(code, loops_ops, loops_range, registers, nb_reg=NB_REG):
+    # same as ucode_trace, computed by the step-by-step model
+    loops_ops, loops_range = ucode_pad_loops(loops_ops, loops_range)
+    loops = ucode_get_loops(loops_ops, loops_range)
+    # the RTL code memory is zeroed after the program
+    code = list(code) + [{'op_sel': 0, 'a': 0, 'b': 0}]*(sum(loops_ops)+1)
+    steps, final = ucode_run(loops, code, list(registers))
+    trace = {}
+    for i,k in enumerate(('addr', 'loop', 'op', 'idx', 'registers', 'execute', 'busy', 'end')):
+        trace[k] = np.array([s[i] for s in steps])
+    trace['registers'] = trace['registers'][:,:nb_reg]
+    trace['final_registers'] = final
+    return trace
+
+def ucode_trace_compare(trace, ref):
+    # returns the name of the first field that differs, None if the traces are identical
+    for k in ('addr', 'loop', 'op', 'idx', 'registers', 'execute', 'busy', 'end'):
+        if trace[k].shape != ref[k].shape or not np.array_equal(trace[k], ref[k]):
+            return k
+    if 'final_registers' in trace and list(trace['final_registers']) != list(ref['final_registers']):
+        return 'final_registers'
+    return None
+
+def ucode_trace_iterations(trace):
+    # registers after each update of the indices, i.e. after each step where
+    # the sequencer stops being busy (the end of an iteration), except termination
+    last = np.nonzero(~trace['busy'] & ~trace['end'])[0]
+    return trace['registers'][last+1]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the step trace of a microcode program.")
+    parser.add_argument("code", nargs="?", default=UCODE_DEFAULT, help="microcode (default: code.yml of mac_ctrl)")
+    parser.add_argument("--range", type=int, nargs="+", default=[1], help="range of each loop, from loop 0")
+    parser.add_argument("--reg", action="append", default=[], metavar="IDX=VALUE", help="initial value of a register (default: 0)")
+    parser.add_argument("--nb-regs", type=int, default=32, help="size of the register file")
+    parser.add_argument("-o", "--output", default=None, help="write the trace to a .npz file (to OUTPUT.<chunk>.npz with --chunk)")
+    parser.add_argument("--chunk", type=int, default=0, help="stream the trace in chunks of CHUNK steps")
+    parser.add_argument("--first", type=int, default=0, help="first iteration to trace")
+    parser.add_argument("--last", type=int, default=None, help="iteration where to stop tracing (default: all)")
+    parser.add_argument("--check", action="store_true", help="compare with the step-by-step model")
+    args = parser.parse_args()
+
+    loops_ops,code = ucode_load(args.code)
+    if len(loops_ops) > NB_LOOPS or len(args.range) > NB_LOOPS:
+        print("ERROR: at most %d loops are supported." % NB_LOOPS)
+        sys.exit(1)
+    if args.nb_regs < NB_REG:
+        print("ERROR: %d registers given, at least %d expected." % (args.nb_regs, NB_REG))
+        sys.exit(1)
+    registers = [0]*args.nb_regs
+    for r in args.reg:
+        idx,value = r.split("=", 1)
+        registers[int(idx)] = int(value, 0)
+
+    if args.check:
+        ref = ucode_trace_reference(code, loops_ops, args.range, registers)
+        last = args.last if args.last is not None else ucode_iteration_count(args.range)
+        first_ref = ucode_iteration_step(loops_ops, args.range, args.first)
+        last_ref  = ucode_iteration_step(loops_ops, args.range, last) if last < ucode_iteration_count(args.range) else len(ref['addr'])
+        ref = dict((k, v[first_ref:last_ref]) for k,v in ref.items() if k != 'final_registers')
+    t0 = time.time()
+    if args.chunk > 0:
+        chunks = ucode_trace_chunks(code, loops_ops, args.range, registers, chunk_size=args.chunk, first=args.first, last=args.last)
+    else:
+        start = ucode_iteration_registers(code, loops_ops, args.range, registers, args.first)
+        trace = ucode_trace(code, loops_ops, args.range, start, first=args.first, last=args.last)
+        print("final registers: %s" % str(trace.pop('final_registers')[:NB_REG]))
+        trace['first_step'] = ucode_iteration_step(loops_ops, args.range, args.first)
+        chunks = [trace]
+    nb_steps = 0
+    nb_exec = 0
+    for i,chunk in enumerate(chunks):
+        nb_steps += len(chunk['addr'])
+        nb_exec += np.count_nonzero(chunk['execute'])
+        if args.output is not None:
+            np.savez(args.output if args.chunk == 0 else "%s.%06d.npz" % (args.output, i), **chunk)
+        if args.check:
+            # the step-by-step model does not number iterations
+            offs = chunk['first_step'] - first_ref
+            mismatch = ucode_trace_compare(chunk, dict((k, v[offs:offs+len(chunk['addr'])]) for k,v in ref.items()))
+            if mismatch is not None:
+                print("ERROR: the trace differs from the step-by-step model in '%s' (chunk %d)." % (mismatch, i))
+                sys.exit(1)
+    t1 = time.time()
+    print("%d steps (%d executing) in %.3f s" % (nb_steps, nb_exec, t1-t0))
+    if args.check:
+        if nb_steps != len(ref['addr']):
+            print("ERROR: %d steps traced, %d in the step-by-step model." % (nb_steps, len(ref['addr'])))
+            sys.exit(1)
+        print("identical to the step-by-step model")
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+# ucode_tune.py
+# Francesco Conti <fconti@iis.ee.ethz.ch>
+#
+# Copyright (C) 2018 ETH Zurich, University of Bologna
+# Copyright and related rights are licensed under the Solderpad Hardware
+# License, Version 0.51 (the "License"); you may not use this file except in
+# compliance with the License.  You may obtain a copy of the License at
+# http://solderpad.org/licenses/SHL-0.51. Unless required by applicable law
+# or agreed to in writing, software, hardware and materials distributed under
+# this License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# Searches the loop order of a microcode program that minimizes the cycles of
+# the hwpe_ctrl_ucode sequencer, and writes the best one as a code.yml:
+#   python ucode_tune.py space.yml -o code.yml
+# The iteration space lists the writable registers and, for each loop, its
+# range and the stride of each register along it, e.g.
+#   registers: { W: 0, x: 1, y: 2 }
+#   loops:
+#     jj: { range: 8,  stride: { W: 4,    x: 4 } }
+#     k:  { range: 3,  stride: { x: 32 } }
+#     m:  { range: 16, stride: { x: 32, y: 32, W: 1024 } }
+#     n:  { range: 16, stride: { x: 576, y: 512 } }
+# and optionally the read-only registers available for constants
+# (`ro_registers`, by default all of them) and loops pinned to a level, from
+# the innermost (e.g. `jj: { range: 8, level: 0, ... }`).
+#
+# In a given order, the update of a register when loop L is incremented is
+# its stride along loop L minus the distance covered by the inner loops, which
+# are reset: each non-zero update is an `add` of a constant read-only register
+# (equal constants share a register). A loop with a range above 1 and no
+# updates gets a no-op, as a loop without operations executes the first
+# operation of the next one. Orders are scored by ucode_cycles; among
+# equivalent ones, the shortest code and the fewest constants win.
+#
+
+from __future__ import print_function
+try:
+    from .ucode_common import *
+except (ImportError, ValueError):
+    # run as a script
+    from ucode_common import *
+from multiprocessing import Pool
+import argparse, itertools, sys, time
+
+UCODE_MAX_OPS   = (1 << UCODE_NB_OPS_WIDTH) - 1
+UCODE_NB_RO_REG = 28
+UCODE_ADDR_MAX  = (1 << UCODE_ADDR_WIDTH) - 1
+UCODE_CNT_MAX   = (1 << UCODE_CNT_WIDTH) - 1
+
+def tune_load(name):
+    with open(name) as f:
+        space = yaml_ordered_load(f, yaml.SafeLoader)
+    registers = space['registers']
+    if len(registers) > NB_REG or max(registers.values()) >= NB_REG:
+        print("ERROR: at most %d writable registers (0-%d) are available." % (NB_REG, NB_REG-1))
+        sys.exit(1)
+    loops = space['loops']
+    if len(loops) > NB_LOOPS:
+        print("ERROR: at most %d loops are supported." % NB_LOOPS)
+        sys.exit(1)
+    for l in loops:
+        if loops[l]['range'] < 1 or loops[l]['range'] > UCODE_CNT_MAX:
+            print("ERROR: the range of loop %s must be within 1-%d." % (l, UCODE_CNT_MAX))
+            sys.exit(1)
+        for r in loops[l].get('stride', {}):
+            if r not in registers:
+                print("ERROR: loop %s has a stride for unknown register %s." % (l, r))
+                sys.exit(1)
+    ro = space.get('ro_registers', list(range(NB_REG, NB_REG+UCODE_NB_RO_REG)))
+    if len(ro) > 0 and (min(ro) < NB_REG or max(ro) > UCODE_ADDR_MAX):
+        print("ERROR: read-only registers must be within %d-%d." % (NB_REG, UCODE_ADDR_MAX))
+        sys.exit(1)
+    return space
+
+def tune_program(space, order):
+    # Returns the program of the given loop order (innermost first), None if
+    # it does not fit in the sequencer: loops_ops, loops_range, the code as
+    # (loop, register, constant) entries, and the constants.
+    registers = space['registers']
+    loops = space['loops']
+    # loops pinned to a level must stay there
+    for L,l in enumerate(order):
+        if loops[l].get('level', L) != L:
+            return None
+    loops_ops = []
+    loops_range = []
+    entries = []
+    constants = []
+    for L,l in enumerate(order):
+        nb_ops = 0
+        for r in registers:
+            delta = loops[l].get('stride', {}).get(r, 0)
+            for j in order[:L]:
+                delta -= (loops[j]['range']-1) * loops[j].get('stride', {}).get(r, 0)
+            if delta != 0 and loops[l]['range'] > 1:
+                if delta not in constants:
+                    constants.append(delta)
+                entries.append((l, r, delta))
+                nb_ops += 1
+        if nb_ops == 0 and loops[l]['range'] > 1:
+            entries.append((l, list(registers.keys())[0], None))
+            nb_ops = 1
+        loops_ops.append(nb_ops)
+        loops_range.append(loops[l]['range'])
+    ro = space.get('ro_registers', list(range(NB_REG, NB_REG+UCODE_NB_RO_REG)))
+    if max(loops_ops) > UCODE_MAX_OPS or sum(loops_ops) > UCODE_LENGTH or len(constants) > len(ro):
+        return None
+    return loops_ops, loops_range, entries, constants
+
+def tune_code(space, program):
+    # program in the format of ucode_load
+    loops_ops, loops_range, entries, constants = program
+    ro = space.get('ro_registers', list(range(NB_REG, NB_REG+UCODE_NB_RO_REG)))
+    code = []
+    for l,r,delta in entries:
+        a = space['registers'][r]
+        if delta is None:
+            code.append({'op_sel': 0, 'a': a, 'b': a})
+        else:
+            code.append({'op_sel': 1, 'a': a, 'b': ro[constants.index(delta)]})
+    return code
+
+def tune_score(order):
+    program = tune_program(tune_space, order)
+    if program is None:
+        return None
+    loops_ops, loops_range, entries, constants = program
+    cycles = ucode_cycles(tune_code(tune_space, program), loops_ops, loops_range)['cycles']
+    return (cycles, sum(loops_ops), len(constants)), order
+
+def tune_init(space):
+    global tune_space
+    tune_space = space
+
+def tune(space, jobs=None):
+    # Returns the best loop order and its score, by exhaustive search across a
+    # process pool; None if no order fits in the sequencer.
+    orders = list(itertools.permutations(space['loops'].keys()))
+    if jobs == 1:
+        tune_init(space)
+        scores = [tune_score(o) for o in orders]
+    else:
+        pool = Pool(jobs, initializer=tune_init, initargs=(space,))
+        try:
+            scores = pool.map(tune_score, orders, chunksize=max(1, len(orders)//64))
+        finally:
+            pool.close()
+            pool.join()
+    scores = [s for s in scores if s is not None]
+    if len(scores) == 0:
+        return None
+    return min(scores)
+
+def tune_write(name, space, program, order, source):
+    loops_ops, loops_range, entries, constants = program
+    ro = space.get('ro_registers', list(range(NB_REG, NB_REG+UCODE_NB_RO_REG)))
+    names = {}
+    with open(name, "w") as f:
+        f.write("#\n# generated by ucode_tune.py from %s\n#\n\n" % source)
+        for L,l in enumerate(order):
+            f.write("# LOOP%d %s: for %s in range(0,%d)\n" % (L, l, l, loops_range[L]))
+        for L in range(len(order), NB_LOOPS):
+            f.write("# LOOP%d unused\n" % L)
+        f.write("\n# read-only registers to be set to:\n")
+        for i,c in enumerate(constants):
+            names[c] = "k%d" % i
+            while names[c] in space['registers']:
+                names[c] += "_"
+            f.write("#   %-4s (%d) = %d\n" % (names[c], ro[i], c))
+        f.write("\n# mnemonics to simplify microcode writing\nmnemonics:\n")
+        for r,a in space['registers'].items():
+            f.write("    %-12s %d\n" % (r + ":", a))
+        for i,c in enumerate(constants):
+            f.write("    %-12s %d\n" % (names[c] + ":", ro[i]))
+        f.write("\n# actual microcode\ncode:\n")
+        for L,l in enumerate(order):
+            # loops without operations keep their place, for ucode_load
+            if loops_ops[L] == 0:
+                f.write("  %s: []\n" % l)
+                continue
+            f.write("  %s:\n" % l)
+            for e,r,delta in entries:
+                if e != l:
+                    continue
+                if delta is None:
+                    f.write("    - { op : mv,  a : %s, b : %s, } # no-op\n" % (r, r))
+                else:
+                    f.write("    - { op : add, a : %s, b : %s, }\n" % (r, names[delta]))
+
+def tune_check(space, program, order, code):
+    # the registers at the beginning of each iteration must be the offsets of
+    # the loop indices along the strides
+    try:
+        from .ucode_trace import ucode_trace
+    except (ImportError, ValueError):
+        from ucode_trace import ucode_trace
+    import numpy as np
+    loops_ops, loops_range, entries, constants = program
+    ro = space.get('ro_registers', list(range(NB_REG, NB_REG+UCODE_NB_RO_REG)))
+    registers = [0]*(UCODE_ADDR_MAX+1)
+    for i,c in enumerate(constants):
+        registers[ro[i]] = c
+    trace = ucode_trace(code, loops_ops, loops_range, registers)
+    first = np.nonzero(np.diff(np.concatenate(([-1], trace['iteration']))))[0]
+    idx = trace['idx'][first][:,:len(order)]
+    for r,a in space['registers'].items():
+        stride = np.array([space['loops'][l].get('stride', {}).get(r, 0) for l in order], dtype=np.int64)
+        if not np.array_equal(trace['registers'][first][:,a], np.dot(idx, stride)):
+            return False
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Search the loop order of a microcode program with the fewest cycles.")
+    parser.add_argument("space", help="iteration space")
+    parser.add_argument("-o", "--output", default=None, help="write the best microcode to this file")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes (default: all CPUs)")
+    parser.add_argument("--check", action="store_true", help="check the offsets of the best microcode by tracing it")
+    args = parser.parse_args()
+
+    space = tune_load(args.space)
+    t0 = time.time()
+    best = tune(space, jobs=args.jobs)
+    t1 = time.time()
+    if best is None:
+        print("ERROR: no loop order fits in %d operations (%d per loop) and %d read-only registers." % (UCODE_LENGTH, UCODE_MAX_OPS, len(space.get('ro_registers', range(UCODE_NB_RO_REG)))))
+        sys.exit(1)
+    (cycles, nb_ops, nb_constants), order = best
+    program = tune_program(space, order)
+    code = tune_code(space, program)
+    bytecode = ucode_bytecode(code, program[0])
+    print("searched %d loop orders in %.3f s" % (len(list(itertools.permutations(space['loops'].keys()))), t1-t0))
+    print("best order:     %s (innermost first)" % " ".join(order))
+    print("cycles:         %d" % cycles)
+    print("operations:     %d" % nb_ops)
+    print("constants:      %s" % " ".join(str(c) for c in program[3]))
+    print("ucode bytecode: %d'h%s" % (len(bytecode['code']), str(bytecode['code'].hex)))
+    print("ucode loops:    %d'h%s" % (len(bytecode['loops']), str(bytecode['loops'].hex)))
+    if args.output is not None:
+        tune_write(args.output, space, program, order, args.space)
+    if args.check:
+        if not tune_check(space, program, order, code):
+            print("ERROR: the traced offsets differ from the strides.")
+            sys.exit(1)
+        print("offsets checked against the strides")
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+#
+# ucode_vcd.py
+# Francesco Conti <fconti@iis.ee.ethz.ch>
+#
+# Copyright (C) 2018 ETH Zurich, University of Bologna
+# Copyright and related rights are licensed under the Solderpad Hardware
+# License, Version 0.51 (the "License"); you may not use this file except in
+# compliance with the License.  You may obtain a copy of the License at
+# http://solderpad.org/licenses/SHL-0.51. Unless required by applicable law
+# or agreed to in writing, software, hardware and materials distributed under
+# this License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#
+# Compares the curr_addr and registers of a hwpe_ctrl_ucode instance in a VCD
+# dump (e.g. export.vcd.gz, from sim/tcl_files/config/export_all.tcl) with
+# the trace of the Python model, and stops at the first mismatch:
+#   python ucode_vcd.py export.vcd.gz code.yml --range 16 --reg 5=64 --reg 6=4
+# The dump is streamed, keeping only the current value of the signals of the
+# instance, and the trace is computed lazily in chunks, so memory does not
+# grow with either of them.
+#
+# The signals are sampled at each rising edge of the clock, with the values
+# they had right before it. If an enable signal is given (--enable, e.g. the
+# enable field of ctrl_i if the dump has it), each sample with enable high is
+# a step of the model; otherwise, as the state only changes on enabled
+# cycles, the sequence of distinct (curr_addr, registers) states is compared.
+#
+
+from __future__ import print_function
+try:
+    from .ucode_common import *
+except (ImportError, ValueError):
+    # run as a script
+    from ucode_common import *
+try:
+    from .ucode_trace import ucode_trace_chunks
+except (ImportError, ValueError):
+    from ucode_trace import ucode_trace_chunks
+from collections import deque
+import argparse, gzip, sys, time
+
+def vcd_open(name):
+    if name.endswith(".gz"):
+        return gzip.open(name, "rb")
+    return open(name, "rb")
+
+def vcd_header(f):
+    # Reads the definitions of the dump, and returns its variables as
+    # (scope, reference, index, size, identifier) tuples.
+    variables = []
+    scope = []
+    tokens = []
+    for line in f:
+        tokens.extend(line.decode('utf-8', 'replace').split())
+        if "$end" not in tokens:
+            continue
+        while "$end" in tokens:
+            end = tokens.index("$end")
+            command, tokens = tokens[:end], tokens[end+1:]
+            if len(command) == 0:
+                continue
+            if command[0] == "$scope":
+                scope.append(command[2])
+            elif command[0] == "$upscope":
+                scope.pop()
+            elif command[0] == "$var":
+                index = "".join(command[5:])
+                reference = command[4]
+                # some simulators glue the index to the name
+                if "[" in reference:
+                    reference, index = reference[:reference.index("[")], reference[reference.index("["):] + index
+                variables.append((".".join(scope), reference, index, int(command[2]), command[3].encode('utf-8')))
+            elif command[0] == "$enddefinitions":
+                return variables
+    print("ERROR: the dump has no $enddefinitions.")
+    sys.exit(1)
+
+def vcd_select(variables, scope=None, clock="clk_i", enable=None, nb_reg=NB_REG):
+    # Returns the scope of the ucode instance and the identifiers of its clock,
+    # enable (None if not given), curr_addr and registers (one identifier for
+    # the whole packed array, or one per register), with the width of curr_addr.
+    if scope is None:
+        scopes = sorted(set(v[0] for v in variables if v[1] == "curr_addr") & set(v[0] for v in variables if v[1] == "registers"))
+        if len(scopes) != 1:
+            print("ERROR: %s ucode instances in the dump, select one with --scope: %s." % ("no" if len(scopes) == 0 else "several", " ".join(scopes)))
+            sys.exit(1)
+        scope = scopes[0]
+    def find(name):
+        for v in variables:
+            if v[0] == scope and v[1] == name:
+                return v
+        print("ERROR: no signal %s in %s." % (name, scope))
+        sys.exit(1)
+    clk = find(clock)[4]
+    en = find(enable)[4] if enable is not None else None
+    addr = find("curr_addr")
+    registers = [v for v in variables if v[0] == scope and v[1] == "registers"]
+    whole = [v for v in registers if v[3] == nb_reg*REG_WIDTH]
+    if len(whole) > 0:
+        registers = [whole[0][4]]
+    else:
+        # one variable per register, registers[i] or registers[i][31:0]
+        by_index = dict((int(v[2][1:v[2].index("]")]), v[4]) for v in registers if v[3] == REG_WIDTH)
+        if sorted(by_index.keys()) != list(range(nb_reg)):
+            print("ERROR: the registers of %s are not in the dump." % scope)
+            sys.exit(1)
+        registers = [by_index[i] for i in range(nb_reg)]
+    return scope, clk, en, addr[4], registers, addr[3]
+
+def vcd_samples(f, clk, en, addr, registers, start=0, block=1<<22):
+    # Generator of (time, enable, curr_addr, registers) right before each
+    # rising edge of the clock from time start on, with values as strings of
+    # bits. The dump is read in blocks, where the changes of the selected
+    # signals are found by searching their identifiers at the end of a line,
+    # so that the other signals are skipped without being parsed; only the
+    # current and previous values of the selected ones are kept.
+    slots = dict((v, i) for i,v in enumerate([clk, en, addr] + registers) if v is not None)
+    cur = [b"x"] * (3 + len(registers))
+    if en is None:
+        cur[1] = b"1"
+    prev = list(cur)
+    time = 0
+    changed = False
+    rest = b""
+    while True:
+        data = f.read(block)
+        eof = len(data) == 0
+        data = b"\n" + rest + data + (b"\n" if eof else b"")
+        cut = data.rfind(b"\n") + 1
+        data, rest = data[:cut], data[cut:]
+        events = []
+        for ident, i in slots.items():
+            key = ident + b"\n"
+            pos = data.find(key)
+            while pos >= 0:
+                # a scalar change, 0<ident>, or a vector one, b<value> <ident>
+                begin = data.rfind(b"\n", 0, pos) + 1
+                line = data[begin:pos]
+                if len(line) == 1 and line in b"01xzXZ":
+                    events.append((begin, i, line))
+                elif line[:1] in (b"b", b"B") and line[-1:] == b" " and b" " not in line[1:-1]:
+                    events.append((begin, i, line[1:-1]))
+                pos = data.find(key, pos + 1)
+        events.sort()
+        # each timestamp starts a new set of simultaneous changes
+        last = 0
+        for begin, i, value in events + [(len(data), None, None)]:
+            ts = data.rfind(b"\n#", last, begin)
+            if ts >= 0:
+                if changed:
+                    if prev[0] == b"0" and cur[0] == b"1" and time >= start:
+                        yield time, prev[1], prev[2], prev[3:]
+                    prev[:] = cur
+                    changed = False
+                time = int(data[ts+2:data.find(b"\n", ts+2)])
+                last = ts + 1
+            if i is not None:
+                cur[i] = value
+                changed = True
+        if eof:
+            break
+    if changed and prev[0] == b"0" and cur[0] == b"1" and time >= start:
+        yield time, prev[1], prev[2], prev[3:]
+
+def vcd_value(bits):
+    try:
+        return int(bits, 2)
+    except ValueError:
+        return None
+
+def vcd_registers(values, nb_reg=NB_REG):
+    if len(values) == 1:
+        v = vcd_value(values[0])
+        return tuple(None if v is None else (v >> REG_WIDTH*i) & ((1 << REG_WIDTH)-1) for i in range(nb_reg))
+    return tuple(vcd_value(v) for v in values)
+
+def ucode_vcd_reference(code, loops_ops, loops_range, registers, addr_width, distinct=False, nb_reg=NB_REG, chunk_size=1<<16):
+    # Generator of the expected (step, curr_addr, registers, loop, idx) of
+    # each step, truncated to the width of the signals; with distinct, only
+    # the steps changing curr_addr or the registers.
+    last = None
+    for chunk in ucode_trace_chunks(code, loops_ops, loops_range, registers, chunk_size=chunk_size, nb_reg=nb_reg):
+        addr = (chunk['addr'] & ((1 << addr_width)-1)).tolist()
+        regs = (chunk['registers'] & ((1 << REG_WIDTH)-1)).tolist()
+        for i in range(len(addr)):
+            state = (addr[i], tuple(regs[i]))
+            if distinct and state == last:
+                continue
+            last = state
+            yield chunk['first_step'] + i, state[0], state[1], int(chunk['loop'][i]), tuple(chunk['idx'][i].tolist())
+
+def ucode_vcd_compare(samples, reference, distinct=False, context=8, nb_reg=NB_REG):
+    # Returns (None, matched) if the samples match the whole reference, or
+    # (mismatch, matched) at the first mismatch, where mismatch is a
+    # dictionary with the 'expected' and 'got' states, the 'time' and the
+    # 'context' of the previous matching samples.
+    history = deque(maxlen=context)
+    matched = 0
+    last = None
+    for expected in reference:
+        got = None
+        for time, enable, addr, registers in samples:
+            if enable != b"1":
+                continue
+            got = (time, vcd_value(addr), vcd_registers(registers, nb_reg))
+            # unknown values before the reset
+            if matched == 0 and (got[1] is None or None in got[2]):
+                got = None
+                continue
+            if distinct and got[1:] == last:
+                got = None
+                continue
+            last = got[1:]
+            break
+        if got is None:
+            return dict(expected=expected, got=None, time=None, context=list(history)), matched
+        if got[1] != expected[1] or got[2] != expected[2]:
+            return dict(expected=expected, got=got[1:], time=got[0], context=list(history)), matched
+        history.append((got[0],) + expected)
+        matched += 1
+    return None, matched
+
+def vcd_format(addr, registers):
+    return "addr=%s regs=[%s]" % ("x" if addr is None else "%d" % addr, ", ".join("x" if r is None else "0x%08x" % r for r in registers))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare a VCD dump of hwpe_ctrl_ucode with the Python model.")
+    parser.add_argument("vcd", help="VCD dump (.vcd or .vcd.gz)")
+    parser.add_argument("code", nargs="?", default=UCODE_DEFAULT, help="microcode (default: code.yml of mac_ctrl)")
+    parser.add_argument("--range", type=int, nargs="+", default=[1], help="range of each loop, from loop 0")
+    parser.add_argument("--reg", action="append", default=[], metavar="IDX=VALUE", help="initial value of a register (default: 0)")
+    parser.add_argument("--scope", default=None, help="hierarchical name of the ucode instance in the dump (default: the only one)")
+    parser.add_argument("--clock", default="clk_i", help="clock of the ucode instance (default: clk_i)")
+    parser.add_argument("--enable", default=None, help="enable of the ucode instance (default: compare distinct states)")
+    parser.add_argument("--start", type=int, default=0, help="time from which the dump is compared")
+    parser.add_argument("--context", type=int, default=8, help="matching steps printed before a mismatch")
+    args = parser.parse_args()
+
+    loops_ops,code = ucode_load(args.code)
+    if len(loops_ops) > NB_LOOPS or len(args.range) > NB_LOOPS:
+        print("ERROR: at most %d loops are supported." % NB_LOOPS)
+        sys.exit(1)
+    registers = [0]*(1 << UCODE_ADDR_WIDTH)
+    for r in args.reg:
+        idx,value = r.split("=", 1)
+        registers[int(idx)] = int(value, 0)
+
+    distinct = args.enable is None
+    t0 = time.time()
+    with vcd_open(args.vcd) as f:
+        scope, clk, en, addr, regs, addr_width = vcd_select(vcd_header(f), args.scope, args.clock, args.enable)
+        samples = vcd_samples(f, clk, en, addr, regs, args.start)
+        reference = ucode_vcd_reference(code, loops_ops, args.range, registers, addr_width, distinct)
+        mismatch, matched = ucode_vcd_compare(samples, reference, distinct, args.context)
+        # bytes of the dump parsed, uncompressed
+        size = f.tell()
+    t1 = time.time()
+    print("%s: %d %s compared, %.1f MB in %.3f s (%.1f MB/s)" % (scope, matched, "distinct states" if distinct else "steps", size/1e6, t1-t0, size/1e6/max(t1-t0, 1e-9)))
+    if mismatch is not None:
+        for t, step, a, r, loop, idx in mismatch['context']:
+            print("  @%-12d step %-8d loop %d idx %s %s" % (t, step, loop, list(idx), vcd_format(a, r)))
+        step, a, r, loop, idx = mismatch['expected']
+        if mismatch['got'] is None:
+            print("ERROR: the dump ends before step %d (loop %d idx %s)." % (step, loop, list(idx)))
+        else:
+            print("ERROR: mismatch at time %d, step %d (loop %d idx %s):" % (mismatch['time'], step, loop, list(idx)))
+            print("  expected %s" % vcd_format(a, r))
+            print("  got      %s" % vcd_format(*mismatch['got']))
+        sys.exit(1)
+    print("identical to the Python model")
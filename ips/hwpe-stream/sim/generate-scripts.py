@@ -44,7 +44,7 @@ execute("mkdir -p vcompile/rtl")
 execute("rm -rf vcompile/rtl/*")
 
 # creates an IPApproX database
-ipdb = ipstools.IPDatabase(rtl_dir='./')
+ipdb = ipstools.IPDatabase(rtl_dir='./', lazy=True)
 # generate ModelSim/QuestaSim compilation scripts
 ipdb.export_make(script_path="vcompile/rtl", target_tech='gf22', source='rtl', local=True)
 # generate vsim.tcl with ModelSim/QuestaSim "linking" script
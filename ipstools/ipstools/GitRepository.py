@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#
+# GitRepository.py
+# Francesco Conti <f.conti@unibo.it>
+#
+# Copyright (C) 2015-2018 ETH Zurich, University of Bologna
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the BSD license.  See the LICENSE file for details.
+#
+
+from __future__ import print_function
+from .IPApproX_common import *
+
+class GitRepository(object):
+    """Access layer to a git repository, minimizing the number of `git` processes spawned.
+
+        :param path:                Path of the working tree (or of the bare repository).
+        :type  path: str
+
+        :param git:                 The `git` executable.
+        :type  git: str
+
+    Object and ref lookups (:func:`resolve`, :func:`show`) are served by a single long-lived `git cat-file --batch`
+    process per repository; staged, unstaged and untracked files are collected by a single `git status` call and cached
+    (see :func:`status`). Commands are always run with the repository as working directory, without changing the
+    working directory of the Python process. Commands run through :func:`run` may modify the repository, therefore they
+    drop the cached status and restart the `cat-file` process on the next lookup.
+
+    The class attribute `forks` counts all the `git` processes spawned through this class.
+
+    """
+
+    forks = 0
+
+    def __init__(self, path, git='git'):
+        super(GitRepository, self).__init__()
+        self.path = os.path.abspath(path)
+        self.git = git
+        self.batch = None
+        self.status_cache = None
+
+    @classmethod
+    def clone(cls, url, path, options=[], git='git'):
+        """Clones a repository.
+
+            :param url:                 URL of the remote repository.
+            :type  url: str
+
+            :param path:                Directory of the new clone.
+            :type  path: str
+
+            :param options:             Additional options of `git clone` (e.g. `['--mirror']`).
+            :type  options: list
+
+            :returns: `tuple` -- (return code, :class:`GitRepository` of the new clone).
+        """
+        cls.forks += 1
+        ret = subprocess.call([git, "clone"] + list(options) + [url, path])
+        return ret, cls(path, git=git)
+
+    @classmethod
+    def init(cls, path, git='git'):
+        """Creates an empty repository.
+
+            :returns: `tuple` -- (return code, :class:`GitRepository` of the new repository).
+        """
+        cls.forks += 1
+        ret = subprocess.call([git, "init", "-q", path])
+        return ret, cls(path, git=git)
+
+    def run(self, *args, **kwargs):
+        """Runs a git command in the repository, with its output going to the terminal.
+
+            :param args:                Arguments of the git command (e.g. `'checkout', 'master'`).
+            :type  args: str
+
+            :param silent:              If true, the output of the command is discarded.
+            :type  silent: bool
+
+            :returns: `int` -- the return code.
+        """
+        self.invalidate()
+        GitRepository.forks += 1
+        with open(os.devnull, "w") as devnull:
+            if kwargs.get('silent', False):
+                return subprocess.call([self.git] + list(args), cwd=self.path, stdout=devnull, stderr=devnull)
+            return subprocess.call([self.git] + list(args), cwd=self.path)
+
+    def lines(self, *args):
+        """Runs a read-only git command in the repository.
+
+            :returns: `list` -- the non-empty lines of the output (empty if the command fails).
+        """
+        GitRepository.forks += 1
+        with open(os.devnull, "w") as devnull:
+            p = subprocess.Popen([self.git] + list(args), cwd=self.path, stdout=subprocess.PIPE, stderr=devnull)
+            out, err = p.communicate()
+        if p.returncode != 0:
+            return []
+        return [l for l in out.decode('utf-8').split("\n") if l != ""]
+
+    def __batch_query(self, rev):
+        if "\n" in rev:
+            # would be read as several queries
+            return None, None, None
+        if self.batch is None:
+            GitRepository.forks += 1
+            with open(os.devnull, "w") as devnull:
+                self.batch = subprocess.Popen([self.git, "cat-file", "--batch"], cwd=self.path, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull)
+        self.batch.stdin.write(("%s\n" % rev).encode('utf-8'))
+        self.batch.stdin.flush()
+        header = self.batch.stdout.readline().decode('utf-8').split()
+        if header[-1] in ("missing", "ambiguous"):
+            # "<rev> missing" or "<rev> ambiguous", where <rev> may contain spaces
+            return None, None, None
+        sha, kind, size = header
+        content = self.batch.stdout.read(int(size))
+        self.batch.stdout.read(1)
+        return sha, kind, content
+
+    def resolve(self, rev):
+        """Resolves a revision (e.g. `HEAD`, `tags/v1.0^{commit}`, `master:ips_list.yml`) to an object name.
+
+            :returns: `str` or None -- the object name, None if the revision does not exist.
+        """
+        return self.__batch_query(rev)[0]
+
+    def show(self, rev):
+        """Reads the content of an object (e.g. `v1.0:ips_list.yml`).
+
+            :returns: `str` or None -- the decoded content, None if the object does not exist.
+        """
+        content = self.__batch_query(rev)[2]
+        return content.decode('utf-8') if content is not None else None
+
+    def head(self):
+        """Returns the commit hash of HEAD (None for an empty repository).
+        """
+        return self.resolve("HEAD^{commit}")
+
+    def branch(self):
+        """Returns the name of the checked-out branch (None in detached-HEAD mode).
+        """
+        branch = self.lines("symbolic-ref", "-q", "--short", "HEAD")
+        return branch[0] if len(branch) > 0 else None
+
+    def newest_tag(self):
+        """Returns the newest tag reachable from HEAD (None if there is none).
+        """
+        tag = self.lines("describe", "--tags", "--abbrev=0")
+        return tag[0] if len(tag) > 0 else None
+
+    def is_shallow(self):
+        return self.lines("rev-parse", "--is-shallow-repository") == ["true"]
+
+    def diff_names(self, *revs):
+        """Lists the files changed between revisions (or between a revision and the working tree).
+
+            :returns: `list` -- the changed paths, relative to the repository root.
+        """
+        return self.lines("diff", "--name-only", *revs)
+
+    def status(self):
+        """Collects the state of the working tree with a single `git status` call.
+
+            :returns: `dict` -- lists of 'staged', 'unstaged' and 'untracked' paths.
+
+        The result is cached until the next :func:`run`, or until :func:`invalidate` is called.
+        """
+        if self.status_cache is not None:
+            return self.status_cache
+        GitRepository.forks += 1
+        with open(os.devnull, "w") as devnull:
+            p = subprocess.Popen([self.git, "status", "--porcelain", "-z", "--untracked-files=all"], cwd=self.path, stdout=subprocess.PIPE, stderr=devnull)
+            out, err = p.communicate()
+        status = {
+            'staged'    : [],
+            'unstaged'  : [],
+            'untracked' : []
+        }
+        entries = out.decode('utf-8').split("\0")
+        i = 0
+        while i < len(entries):
+            e = entries[i]
+            i += 1
+            if len(e) < 4:
+                continue
+            x, y, name = e[0], e[1], e[3:]
+            if x == '?':
+                status['untracked'].append(name)
+                continue
+            if x in "RC":
+                # renames and copies are followed by their source path
+                i += 1
+            if x not in " !":
+                status['staged'].append(name)
+            if y not in " !":
+                status['unstaged'].append(name)
+        self.status_cache = status
+        return status
+
+    def is_clean(self, untracked=False):
+        """Checks whether the working tree has no staged or unstaged changes (nor untracked files, if `untracked` is True).
+        """
+        status = self.status()
+        return len(status['staged']) + len(status['unstaged']) + (len(status['untracked']) if untracked else 0) == 0
+
+    def invalidate(self):
+        """Drops the cached status and stops the `cat-file` process.
+        """
+        self.status_cache = None
+        self.close()
+
+    def close(self):
+        if self.batch is not None:
+            self.batch.stdin.close()
+            self.batch.wait()
+            self.batch.stdout.close()
+            self.batch = None
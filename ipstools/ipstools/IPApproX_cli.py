@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+#
+# IPApproX_cli.py
+# Francesco Conti <f.conti@unibo.it>
+#
+# Copyright (C) 2015-2018 ETH Zurich, University of Bologna
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the BSD license.  See the LICENSE file for details.
+#
+
+from __future__ import print_function
+from .IPApproX_common import *
+from .IPDatabase import *
+from .IPSnapshot import *
+import argparse, json, shutil, time
+
+COMMANDS = [
+    'update',
+    'generate',
+    'status',
+    'tag',
+    'diff',
+    'snapshot',
+    'restore',
+    'variant'
+]
+
+class IPApproXCLI(object):
+    """Command-line front-end running several `ipstools` commands on a single in-memory :class:`IPDatabase`.
+
+        :param list_path:           Path where the main `ips_list.yml` and `rtl_list.yml` files are found.
+        :type  list_path: str
+
+        :param ips_dir:             Path where the IPs are to be deployed.
+        :type  ips_dir: str
+
+        :param rtl_dir:             Path where the local RTL files are deployed.
+        :type  rtl_dir: str
+
+        :param vsim_dir:            Path where the simulation platform is set up.
+        :type  vsim_dir: str
+
+        :param default_server:      Git remote repository to be used if not otherwise specified.
+        :type  default_server: str
+
+    Commands are executed in the order they are given (e.g. `update generate`): the database built for the first
+    command is reused by the following ones, so the IP lists and `src_files.yml` are parsed only once per process.
+    `snapshot` stores the IPs and the generated scripts in a cache, from which `restore` rebuilds the workspace
+    without any git operation (see :class:`IPSnapshot`). `variant --variant NAME --pin IP=COMMIT` checks out other
+    versions of some IPs as git worktrees, and `generate --variant NAME` targets them.
+
+    """
+
+    def __init__(self, list_path=".", ips_dir="ips", rtl_dir="rtl", vsim_dir="sim", default_server="https://github.com"):
+        super(IPApproXCLI, self).__init__()
+        self.list_path      = list_path
+        self.ips_dir        = ips_dir
+        self.rtl_dir        = rtl_dir
+        self.vsim_dir       = vsim_dir
+        self.default_server = default_server
+        self.ipdb           = None
+        self.scripts_loaded = False
+        self.timings        = []
+
+    def phase(self, name, fn, *args, **kwargs):
+        """Runs a phase of the flow and records its wall time.
+        """
+        t0 = time.time()
+        ret = fn(*args, **kwargs)
+        self.timings.append((name, time.time() - t0))
+        return ret
+
+    def get_parser(self):
+        parser = argparse.ArgumentParser(description="IPApproX IP management tools.")
+        parser.add_argument("commands", nargs="+", choices=COMMANDS, metavar="command", help="one or more of %s, executed in order" % ", ".join(COMMANDS))
+        parser.add_argument("--tag-name", default=None, help="name of the tag (tag command)")
+        parser.add_argument("--changes-severity", default='warning', choices=['warning', 'error'], help="whether changes in an IP are a warning or an error (tag command)")
+        parser.add_argument("--mirror-dir", default=None, help="directory of the local bare mirrors new IP clones fetch objects from (update command)")
+        parser.add_argument("--conflict-policy", default=None, choices=CONFLICT_POLICIES, help="how to resolve IP version conflicts in the dependency tree (update command, defaults to $IPSTOOLS_CONFLICT_POLICY or interactive)")
+        parser.add_argument("--full", action="store_true", help="update all IPs, not only the ones changed since the last update (update command)")
+        parser.add_argument("--shallow", action="store_true", help="only fetch the commit of each IP in ips_list.yml, at depth 1 (update command)")
+        parser.add_argument("--partial", action="store_true", help="clone new IPs without blobs, fetching them on demand (update command)")
+        parser.add_argument("--cache-dir", default=None, help="directory of the workspace snapshots (snapshot and restore commands)")
+        parser.add_argument("--variant", default=None, help="name of the variant (generate and variant commands)")
+        parser.add_argument("--pin", action="append", default=[], metavar="IP=COMMIT", help="use IP at COMMIT in the variant (variant command, can be repeated)")
+        parser.add_argument("--drop", action="store_true", help="remove the variant (variant command)")
+        parser.add_argument("--json", action="store_true", help="print the status as JSON (status command)")
+        parser.add_argument("--timing", action="store_true", help="print the wall time of each phase")
+        parser.add_argument("--verbose", action="store_true", help="print all information on the dependencies that are being fetched")
+        return parser
+
+    def load_database(self, update=False, verbose=False, mirror_dir=None, conflict_policy=None):
+        if update:
+            try:
+                os.mkdir(self.ips_dir)
+            except OSError:
+                pass
+            self.ipdb = IPDatabase(
+                list_path=self.list_path,
+                skip_scripts=True,
+                build_deps_tree=True,
+                resolve_deps_conflicts=True,
+                rtl_dir=self.rtl_dir,
+                ips_dir=self.ips_dir,
+                vsim_dir=self.vsim_dir,
+                default_server=self.default_server,
+                verbose=verbose,
+                mirror_dir=mirror_dir,
+                conflict_policy=conflict_policy
+            )
+        else:
+            self.ipdb = IPDatabase(
+                list_path=self.list_path,
+                skip_scripts=True,
+                rtl_dir=self.rtl_dir,
+                ips_dir=self.ips_dir,
+                vsim_dir=self.vsim_dir,
+                default_server=self.default_server,
+                load_cache=os.path.exists(os.path.join(self.list_path, '.cached_ipdb.json'))
+            )
+        self.scripts_loaded = False
+
+    def load_scripts(self, variant=None):
+        if self.scripts_loaded:
+            return
+        if variant is not None:
+            self.ipdb.use_variant(variant)
+        self.ipdb.import_ips(source='ips')
+        if self.ipdb.rtl_list is not None:
+            self.ipdb.import_ips(source='rtl')
+        self.scripts_loaded = True
+
+    def update(self, shallow=False, partial=False, incremental=True):
+        self.ipdb.update_ips(shallow=shallow, partial=partial, incremental=incremental)
+        self.ipdb.save_database(filename=os.path.join(self.list_path, '.cached_ipdb.json'))
+
+    def generate(self):
+        vcompile_dir = "%s/vcompile" % self.vsim_dir
+        for d in ("ips", "rtl", "tb"):
+            path = "%s/%s" % (vcompile_dir, d)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.makedirs(path)
+        # generate ModelSim/QuestaSim compilation scripts
+        self.ipdb.export_make(script_path="%s/ips" % vcompile_dir)
+        self.ipdb.export_make(script_path="%s/rtl" % vcompile_dir, source='rtl')
+        # generate vsim.tcl with ModelSim/QuestaSim "linking" script
+        self.ipdb.generate_vsim_tcl("%s/tcl_files/config/vsim_ips.tcl" % self.vsim_dir)
+        self.ipdb.generate_vsim_tcl("%s/tcl_files/config/vsim_rtl.tcl" % self.vsim_dir, source='rtl')
+        # generate script to compile all IPs for ModelSim/QuestaSim
+        self.ipdb.generate_makefile("%s/ips.mk" % vcompile_dir)
+        self.ipdb.generate_makefile("%s/rtl.mk" % vcompile_dir, source='rtl')
+        print(tcolors.OK + "Generated new scripts for IPs!" + tcolors.ENDC)
+
+    def status(self, as_json=False):
+        snapshot = self.ipdb.get_status()
+        if as_json:
+            print(json.dumps(list(snapshot.values()), indent=4))
+            return
+        for name in snapshot.keys():
+            status = snapshot[name]
+            if not status['exists']:
+                print("%-32s %s" % (name, tcolors.WARNING + "missing" + tcolors.ENDC))
+                continue
+            if len(status['staged']) + len(status['unstaged']) > 0:
+                state = tcolors.WARNING + "modified" + tcolors.ENDC
+            else:
+                state = tcolors.OK + "clean" + tcolors.ENDC
+            print("%-32s %-40s %-16s %s (%s)" % (name, status['head'] if status['head'] is not None else "-", status['newest_tag'] if status['newest_tag'] is not None else "-", state, status['commit']))
+
+    def variant(self, variant=None, pins=[], drop=False):
+        if variant is None:
+            variants = self.ipdb.load_variants()
+            for v in variants.keys():
+                print("%-24s %s" % (v, ", ".join(["%s @ %s" % (ip, variants[v][ip]) for ip in variants[v].keys()])))
+            return True
+        if drop:
+            self.ipdb.remove_variant(variant)
+            return True
+        return self.ipdb.add_variant(variant, OrderedDict([p.split("=", 1) for p in pins]))
+
+    def snapshot(self, cache_dir=None):
+        IPSnapshot(cache_dir).export(self.ipdb, list_path=self.list_path)
+
+    def restore(self, cache_dir=None):
+        if not IPSnapshot(cache_dir).restore(list_path=self.list_path, ips_dir=self.ips_dir):
+            return False
+        # the restored database cache replaces the one loaded before
+        self.load_database()
+        return True
+
+    def main(self, argv=None):
+        """Parses the command line and executes the requested commands.
+
+            :param argv:                Command-line arguments (defaults to `sys.argv[1:]`).
+            :type  argv: list or None
+
+            :returns: `int` -- the exit code.
+        """
+        args = self.get_parser().parse_args(argv)
+        if 'tag' in args.commands and args.tag_name is None:
+            print(tcolors.ERROR + "ERROR: the tag command requires --tag-name." + tcolors.ENDC)
+            return 1
+        if len([p for p in args.pin if "=" not in p]) > 0:
+            print(tcolors.ERROR + "ERROR: --pin expects IP=COMMIT." + tcolors.ENDC)
+            return 1
+        self.phase("database", self.load_database, update='update' in args.commands, verbose=args.verbose, mirror_dir=args.mirror_dir, conflict_policy=args.conflict_policy)
+        for cmd in args.commands:
+            if cmd == 'update':
+                self.phase("update", self.update, shallow=args.shallow, partial=args.partial, incremental=not args.full)
+            elif cmd == 'generate':
+                self.phase("parse", self.load_scripts, variant=args.variant)
+                self.phase("generate", self.generate)
+            elif cmd == 'status':
+                self.phase("status", self.status, as_json=args.json)
+            elif cmd == 'tag':
+                self.phase("tag", self.ipdb.tag_ips, args.tag_name, changes_severity=args.changes_severity)
+            elif cmd == 'diff':
+                self.phase("diff", self.ipdb.diff_ips)
+            elif cmd == 'variant':
+                if not self.phase("variant", self.variant, variant=args.variant, pins=args.pin, drop=args.drop):
+                    return 1
+            elif cmd == 'snapshot':
+                self.phase("snapshot", self.snapshot, cache_dir=args.cache_dir)
+            elif cmd == 'restore':
+                if not self.phase("restore", self.restore, cache_dir=args.cache_dir):
+                    return 1
+        if args.timing:
+            print(tcolors.WARNING + "TIMING" + tcolors.ENDC)
+            for name, t in self.timings:
+                print("  %-16s %8.3fs" % (name, t))
+            print("  %-16s %8.3fs" % ("total", sum([t for name, t in self.timings])))
+        return 0
@@ -12,6 +12,7 @@
 
 from __future__ import print_function
 import re, os, subprocess, sys, os, stat
+from multiprocessing.pool import ThreadPool
 try:
     from StringIO import StringIO
 except ImportError:
@@ -58,6 +59,76 @@ def execute_popen(cmd, silent=False):
         else:
             return subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
 
+def execute_lines(cmd, silent=False):
+    out, err = execute_popen(cmd, silent=silent).communicate()
+    return [l for l in out.decode('utf-8').split("\n") if l != ""]
+
+try:
+    read_input = raw_input
+except NameError:
+    read_input = input
+
+def version_key(commit):
+    # natural order of version tags, e.g. tags/v1.10 > tags/v1.9
+    if commit[:5] == "tags/":
+        commit = commit[5:]
+    return [(int(t), "") if t.isdigit() else (-1, t) for t in re.split(r"(\d+)", commit) if t != ""]
+
+def is_commit_hash(commit):
+    return re.match("^[0-9a-f]{7,40}$", commit) is not None
+
+def is_immutable_ref(commit, path):
+    # tags and commit hashes never move; a name that looks like a hash is only taken as one if
+    # it is a commit in the repository at path and not also a (remote-tracking) branch there
+    if commit is None:
+        return False
+    if commit[:5] == "tags/":
+        return True
+    if not is_commit_hash(commit):
+        return False
+    with open(os.devnull, "w") as devnull:
+        if subprocess.call(("git cat-file -e %s^{commit}" % commit).split(), cwd=path, stderr=devnull) != 0:
+            return False
+        p = subprocess.Popen(["git", "for-each-ref", "--format=%(refname)", "refs/heads/%s" % commit, "refs/remotes/*/%s" % commit], cwd=path, stdout=subprocess.PIPE, stderr=devnull)
+        out = p.communicate()[0]
+    return p.returncode == 0 and out.strip() == b""
+
+def dir_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return size
+
+def remove_tree(path, threads=8):
+    # deletes a directory tree, unlinking its files from a pool of threads
+    files = []
+    dirs = []
+    for root, dnames, fnames in os.walk(path):
+        dirs.append(root)
+        files.extend([os.path.join(root, f) for f in fnames])
+        # symbolic links to directories are not followed by os.walk
+        files.extend([os.path.join(root, d) for d in dnames if os.path.islink(os.path.join(root, d))])
+    def unlink(f):
+        try:
+            os.unlink(f)
+        except OSError:
+            pass
+    pool = ThreadPool(threads)
+    try:
+        pool.map(unlink, files, chunksize=64)
+    finally:
+        pool.close()
+        pool.join()
+    for d in reversed(dirs):
+        try:
+            os.rmdir(d)
+        except OSError:
+            pass
+
 def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
     class OrderedLoader(Loader):
         pass
@@ -72,7 +143,11 @@ def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
 def load_ips_list(filename, skip_commit=False):
     # get a list of all IPs that we are interested in from ips_list.yml
     with open(filename, "r") as f:
-        ips_list = ordered_load(f, yaml.SafeLoader)
+        return load_ips_list_from_yml(f, skip_commit=skip_commit)
+
+def load_ips_list_from_yml(ips_list_yml, skip_commit=False):
+    # ips_list_yml can be either a stream or a string
+    ips_list = ordered_load(ips_list_yml, yaml.SafeLoader)
     ips = []
     for i in ips_list.keys():
         if not skip_commit:
@@ -149,8 +224,25 @@ def get_ips_list_yml(server="git@github.com", group='pulp-platform', name='pulpi
                 ips_list_yml = ips_list_yml.decode(sys.stdout.encoding)
     return ips_list_yml
 
-def load_ips_list_from_server(server="git@github.com", group='pulp-platform', name='pulpissimo.git', commit='master', verbose=False, skip_commit=False):
-    ips_list_yml = get_ips_list_yml(server, group, name, commit, verbose=verbose)
+def get_local_ips_list_yml(path, commit, verbose=False):
+    # an immutable commit found in a local clone has the same ips_list.yml as on the server
+    if not os.path.isdir(os.path.join(path, ".git")) or not is_immutable_ref(commit, path):
+        return None
+    with open(os.devnull, "w") as devnull:
+        if subprocess.call(("git cat-file -e %s^{commit}" % commit).split(), cwd=path, stderr=devnull) != 0:
+            return None
+        if verbose:
+            print("   Reading ips_list.yml from %s @ %s" % (path, commit))
+        p = subprocess.Popen(("git show %s:ips_list.yml" % commit).split(), cwd=path, stdout=subprocess.PIPE, stderr=devnull)
+        out = p.communicate()[0]
+    return out.decode('utf-8') if p.returncode == 0 else ""
+
+def load_ips_list_from_server(server="git@github.com", group='pulp-platform', name='pulpissimo.git', commit='master', verbose=False, skip_commit=False, local_path=None):
+    ips_list_yml = None
+    if local_path is not None:
+        ips_list_yml = get_local_ips_list_yml(local_path, commit, verbose=verbose)
+    if ips_list_yml is None:
+        ips_list_yml = get_ips_list_yml(server, group, name, commit, verbose=verbose)
     if ips_list_yml is None:
         print("No ips_list.yml gathered for %s" % name)
         return []
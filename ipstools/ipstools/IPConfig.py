@@ -19,6 +19,10 @@ from .vivado_defines         import *
 from .synopsys_defines       import *
 from .cadence_defines        import *
 from .SubIPConfig            import *
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 
 class IPConfig(object):
     def __init__(self, ip_name, ip_dic, ip_path, ips_dir, vsim_dir, domain=None, alternatives=None):
@@ -53,13 +57,12 @@ class IPConfig(object):
         commands = ""
         phony = ""
         for s in self.sub_ips.keys():
-            if ("all" in self.sub_ips[s].targets or "rtl" in self.sub_ips[s].targets or target_tech in self.sub_ips[s].targets):
-                if ("skip_simulation" not in self.sub_ips[s].flags and (("only_local" not in self.sub_ips[s].flags) or local)):
-                    commands += "$(LIB_PATH)/%s.%s " % (s, vmake)
-                    if simulator == 'vsim':
-                        phony += "vcompile-subip-%s " %s
-                    elif simulator == 'ncsim':
-                        phony += "ncompile-subip-%s " %s
+            if has_make_goal(self.sub_ips[s].targets, self.sub_ips[s].flags, target_tech=target_tech, local=local):
+                commands += "$(LIB_PATH)/%s.%s " % (s, vmake)
+                if simulator == 'vsim':
+                    phony += "vcompile-subip-%s " %s
+                elif simulator == 'ncsim':
+                    phony += "ncompile-subip-%s " %s
         if self.ip_path[0] == '/':
             makefile = mk_preamble % (prepare(self.ip_name), '', self.ip_path[1:], phony, commands) 
         else:
@@ -115,3 +118,85 @@ class IPConfig(object):
                 l.extend(self.sub_ips[s].incdirs)
         return l
 
+class LazyIPDict(MutableMapping):
+    """Ordered mapping of IP names to :class:`IPConfig` objects that are materialized on first access.
+
+        :param loader:              Callable building an :class:`IPConfig` from the arguments registered with :func:`add_pending` (returns None if the IP has to be skipped).
+        :type  loader: callable
+
+    Keys are known as soon as the IP list is loaded, so name-only operations (e.g. generating the `vsim.tcl`
+    or the mid-level Makefiles) never read any `src_files.yml`. The Yaml of an IP is parsed and validated
+    only when its :class:`IPConfig` is first accessed.
+
+    """
+
+    def __init__(self, loader):
+        super(LazyIPDict, self).__init__()
+        self.loader  = loader
+        self.configs = OrderedDict()
+        self.pending = {}
+
+    def add_pending(self, ip_name, filename, *args, **kwargs):
+        """Registers an IP whose `src_files.yml` is going to be parsed on first access.
+
+            :param ip_name:             Name of the IP
+            :type  ip_name: str
+
+            :param filename:            Path to the IP's `src_files.yml`
+            :type  filename: str
+
+        Further arguments are passed through to the loader.
+        """
+        self.configs[ip_name] = None
+        self.pending[ip_name] = (filename, args, kwargs)
+
+    def is_materialized(self, ip_name):
+        return ip_name in self.configs and ip_name not in self.pending
+
+    def __materialize(self, ip_name):
+        filename, args, kwargs = self.pending[ip_name]
+        # if the loader raises, the IP stays pending and the error is raised again on the next access
+        ip_config = self.loader(ip_name, filename, *args, **kwargs)
+        del self.pending[ip_name]
+        if ip_config is None:
+            del self.configs[ip_name]
+            raise KeyError(ip_name)
+        self.configs[ip_name] = ip_config
+        return ip_config
+
+    def __getitem__(self, ip_name):
+        if ip_name in self.pending:
+            return self.__materialize(ip_name)
+        return self.configs[ip_name]
+
+    def __setitem__(self, ip_name, ip_config):
+        self.pending.pop(ip_name, None)
+        self.configs[ip_name] = ip_config
+
+    def __delitem__(self, ip_name):
+        self.pending.pop(ip_name, None)
+        del self.configs[ip_name]
+
+    def __has(self, ip_name):
+        # IPs without a src_files.yml are dropped (with a warning) as in the eager flow;
+        # this only requires a stat, not parsing the Yaml
+        if ip_name in self.pending and not os.path.isfile(self.pending[ip_name][0]):
+            try:
+                self.__materialize(ip_name)
+            except KeyError:
+                return False
+        return ip_name in self.configs
+
+    def __iter__(self):
+        for ip_name in list(self.configs.keys()):
+            if self.__has(ip_name):
+                yield ip_name
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __contains__(self, ip_name):
+        return self.__has(ip_name)
+
+    def keys(self):
+        return list(iter(self))
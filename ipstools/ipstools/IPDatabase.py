@@ -18,15 +18,27 @@ from .vivado_defines import *
 from .makefile_defines import *
 from .makefile_defines_ncsim import *
 from .IPConfig import *
+from .IPFileIndex import *
+from .GitRepository import *
 import signal
 import json, gzip
-import os, sys
+import os, sys, time, hashlib
+from multiprocessing.pool import ThreadPool
+import threading
 
 ALLOWED_SOURCES=[
   "ips",
   "rtl"
 ]
 
+CONFLICT_POLICIES=[
+  "interactive",
+  "root",
+  "newest-tag",
+  "pinned",
+  "fail"
+]
+
 class IPDatabase(object):
     """Main interaction class for accessing the IP database.
 
@@ -69,13 +81,26 @@ class IPDatabase(object):
         :param verbose:                     If true, prints all information on the dependencies that are being fetched.
         :type  verbose: bool
 
+        :param lazy:                        If true, each IP's `src_files.yml` is parsed and validated only when its :class:`IPConfig` is first accessed.
+        :type  lazy: bool
+
+        :param mirror_dir:                  Directory of the bare mirrors new IP clones fetch objects from (defaults to the IPSTOOLS_MIRROR_DIR environment variable, if set).
+        :type  mirror_dir: str or None
+
+        :param conflict_policy:             Policy resolving dependency conflicts, one of `CONFLICT_POLICIES` (defaults to the IPSTOOLS_CONFLICT_POLICY environment variable, or 'interactive').
+        :type  conflict_policy: str or None
+
+        :param conflict_overrides:          File pinning the IPs in conflict for the 'pinned' policy, in the `ips_list.yml` format (defaults to `ips_overrides.yml` in `list_path`).
+        :type  conflict_overrides: str or None
+
     This class is used for interacting with the IP database for:
       1. resolving the IP hierarchy, including dependency conflicts
       2. downloading the necessary IP set
       3. generating scripts for a number of backends
-    If `build_deps_tree` and `resolve_deps_conflicts` are set to True, the hierarchical IP flow will be started and the 
-    user will be asked to resolve IP version conflicts manually in case different version of IPs are referenced throughout
-    the dependency tree.
+    If `build_deps_tree` and `resolve_deps_conflicts` are set to True, the hierarchical IP flow will be started and IP
+    version conflicts, i.e. different versions of an IP referenced throughout the dependency tree, are resolved according
+    to `conflict_policy`: by the user ('interactive'), or without any user intervention, so that unattended builds can use
+    the hierarchical flow (see :func:`resolve_deps_conflicts`).
 
     """
 
@@ -97,15 +122,35 @@ class IPDatabase(object):
         default_group='pulp-platform',
         default_commit='master',
         load_cache=False,
-        verbose=False
+        verbose=False,
+        lazy=False,
+        mirror_dir=None,
+        conflict_policy=None,
+        conflict_overrides=None
     ):
         super(IPDatabase, self).__init__()
         self.ips_dir = ips_dir
         self.rtl_dir = rtl_dir
         self.vsim_dir = vsim_dir
         self.fpgasim_dir = fpgasim_dir
-        self.ip_dic = OrderedDict()
-        self.rtl_dic = OrderedDict()
+        self.list_path = list_path
+        self.lazy = lazy
+        self.mirror_dir = mirror_dir if mirror_dir is not None else os.environ.get('IPSTOOLS_MIRROR_DIR')
+        self.refreshed_mirrors = set()
+        self.repositories = {}
+        self.status_snapshot = None
+        self.removal_thread = None
+        self.conflict_policy = conflict_policy if conflict_policy is not None else os.environ.get('IPSTOOLS_CONFLICT_POLICY', 'interactive')
+        if self.conflict_policy not in CONFLICT_POLICIES:
+            print(tcolors.ERROR + "ERROR: unknown conflict policy '%s', use one of %s." % (self.conflict_policy, ", ".join(CONFLICT_POLICIES)) + tcolors.ENDC)
+            sys.exit(1)
+        self.conflict_overrides = conflict_overrides if conflict_overrides is not None else os.path.join(list_path, "ips_overrides.yml")
+        if lazy:
+            self.ip_dic = LazyIPDict(self.load_ip_config)
+            self.rtl_dic = LazyIPDict(self.load_ip_config)
+        else:
+            self.ip_dic = OrderedDict()
+            self.rtl_dic = OrderedDict()
         self.default_server = default_server
         self.default_group = default_group
         self.default_commit = default_commit
@@ -128,61 +173,70 @@ class IPDatabase(object):
         if load_cache:
             self.load_database()
         if not skip_scripts:
-            for ip in self.ip_list:
-                ip_full_name = ip['name']
-                if ip['path'] == "$SITE_DEPENDENT_PATH":
-                    try:
-                        ip_full_path = "%s/src_files.yml" % os.environ['SITE_DEPENDENT_PATH']
-                        ip['path'] = os.environ['SITE_DEPENDENT_PATH']
-                    except KeyError:
-                        print(tcolors.ERROR + "ERROR: you must define the SITE_DEPENDENT_PATH environment variable.")
-                        sys.exit(1)
-                else:
-                    ip_full_path = "%s/%s/%s/src_files.yml" % (list_path, ips_dir, ip['path'])
-                self.import_yaml(ip_full_name, ip_full_path, ip['path'], domain=ip['domain'], alternatives=ip['alternatives'], ips_dic=self.ip_dic)
-            sub_ip_check_list = []
-            for i in self.ip_dic.keys():
-                sub_ip_check_list.extend(self.ip_dic[i].sub_ips.keys())
-            if len(set(sub_ip_check_list)) != len(sub_ip_check_list):
-                print(tcolors.WARNING + "WARNING: two sub-IPs have the same name. This can cause trouble!" + tcolors.ENDC)
-                blacklist = OrderedDict()
-                for el in set(sub_ip_check_list):
-                    blacklist[el] = 0
-                    for item in sub_ip_check_list:
-                        if el==item:
-                             blacklist[el] += 1
-                for el in blacklist.keys():
-                    cnt = blacklist[el]
-                    if cnt > 1:
-                        print(tcolors.WARNING + "  %s" % el + tcolors.ENDC)
+            self.import_ips(source='ips')
         if not skip_scripts and self.rtl_list is not None:
-            for ip in self.rtl_list:
-                ip_full_name = ip['name']
-                if ip['path'] == "$SITE_DEPENDENT_PATH":
-                    try:
-                        ip_full_path = "%s/src_files.yml" % os.environ['SITE_DEPENDENT_PATH']
-                        ip['path'] = os.environ['SITE_DEPENDENT_PATH']
-                    except KeyError:
-                        print(tcolors.ERROR + "ERROR: you must define the SITE_DEPENDENT_PATH environment variable.")
-                        sys.exit(1)
-                else:
-                    ip_full_path = "%s/%s/%s/src_files.yml" % (list_path, rtl_dir, ip['path'])
-                self.import_yaml(ip_full_name, ip_full_path, ip['path'], domain=ip['domain'], alternatives=ip['alternatives'], ips_dic=self.rtl_dic, ips_dir=rtl_dir)
-            sub_ip_check_list = []
-            for i in self.rtl_dic.keys():
-                sub_ip_check_list.extend(self.rtl_dic[i].sub_ips.keys())
-            if len(set(sub_ip_check_list)) != len(sub_ip_check_list):
-                print(tcolors.WARNING + "WARNING: two sub-IPs have the same name. This can cause trouble!" + tcolors.ENDC)
-                blacklist = OrderedDict()
-                for el in set(sub_ip_check_list):
-                    blacklist[el] = 0
-                    for item in sub_ip_check_list:
-                        if el==item:
-                             blacklist[el] += 1
-                for el in blacklist.keys():
-                    cnt = blacklist[el]
-                    if cnt > 1:
-                        print(tcolors.WARNING + "  %s" % el + tcolors.ENDC)
+            self.import_ips(source='rtl')
+
+    def import_ips(self, source='ips'):
+        """Imports the `src_files.yml` of all IPs in the `ips_list.yml` or `rtl_list.yml` list.
+
+            :param source:              'ips' or 'rtl'
+            :type  source: str
+
+        This function generates the :class:`IPConfig` of every IP in the given list. In lazy mode, the IPs are only
+        registered and their `src_files.yml` is parsed on first access.
+        """
+        if source not in ALLOWED_SOURCES:
+            print(tcolors.ERROR + "ERROR: import_ips() accepts source='ips' or source='rtl'." + tcolors.ENDC)
+            sys.exit(1)
+        if source == 'ips':
+            ip_list = self.ip_list
+            ips_dir = self.ips_dir
+            ips_dic = self.ip_dic
+        else:
+            ip_list = self.rtl_list
+            ips_dir = self.rtl_dir
+            ips_dic = self.rtl_dic
+        for ip in ip_list:
+            ip_full_name = ip['name']
+            if ip['path'] == "$SITE_DEPENDENT_PATH":
+                try:
+                    ip_full_path = "%s/src_files.yml" % os.environ['SITE_DEPENDENT_PATH']
+                    ip['path'] = os.environ['SITE_DEPENDENT_PATH']
+                except KeyError:
+                    print(tcolors.ERROR + "ERROR: you must define the SITE_DEPENDENT_PATH environment variable.")
+                    sys.exit(1)
+            else:
+                ip_full_path = "%s/%s/%s/src_files.yml" % (self.list_path, ips_dir, ip['path'])
+            if self.lazy:
+                ips_dic.add_pending(ip_full_name, ip_full_path, ip['path'], domain=ip['domain'], alternatives=ip['alternatives'], ips_dir=ips_dir)
+            else:
+                self.import_yaml(ip_full_name, ip_full_path, ip['path'], domain=ip['domain'], alternatives=ip['alternatives'], ips_dic=ips_dic, ips_dir=ips_dir)
+        # checking for duplicate sub-IPs requires all src_files.yml, so it is skipped in lazy mode
+        if not self.lazy:
+            self.check_sub_ips(ips_dic)
+
+    def check_sub_ips(self, ips_dic):
+        """Warns if two sub-IPs in the given dictionary of IPs have the same name.
+
+            :param ips_dic:             Dictionary of IPs that is being checked
+            :type  ips_dic: dict
+        """
+        sub_ip_check_list = []
+        for i in ips_dic.keys():
+            sub_ip_check_list.extend(ips_dic[i].sub_ips.keys())
+        if len(set(sub_ip_check_list)) != len(sub_ip_check_list):
+            print(tcolors.WARNING + "WARNING: two sub-IPs have the same name. This can cause trouble!" + tcolors.ENDC)
+            blacklist = OrderedDict()
+            for el in set(sub_ip_check_list):
+                blacklist[el] = 0
+                for item in sub_ip_check_list:
+                    if el==item:
+                         blacklist[el] += 1
+            for el in blacklist.keys():
+                cnt = blacklist[el]
+                if cnt > 1:
+                    print(tcolors.WARNING + "  %s" % el + tcolors.ENDC)
 
     def save_database(self, filename='.cached_ipdb.json', gzip=False):
         """Saves the IP database state in a cache JSON gzipped file.
@@ -246,66 +300,133 @@ class IPDatabase(object):
 
         for i in range(len(self.ip_list)):
             ip = self.ip_list[i]
-            children.append(IPTreeNode(ip, self.default_server, self.default_group, self.default_commit, verbose=True))
+            children.append(IPTreeNode(ip, self.default_server, self.default_group, self.default_commit, verbose=True, ips_dir=self.ips_dir))
 
         root = IPTreeNode(None, children=children)
         self.ip_tree = root
         print(tcolors.OK + "Generated IP dependency tree." + tcolors.ENDC)
 
-    def resolve_deps_conflicts(self, verbose=False):
+    def resolve_deps_conflicts(self, verbose=False, policy=None):
         """Resolves the IP dependency conflicts in the IP hierarchical flow.                    
 
             :param verbose:             If true, prints all information on the dependencies that are being fetched.
             :type  verbose: bool
 
+            :param policy:              One of `CONFLICT_POLICIES` (defaults to the policy of the database).
+            :type  policy: str or None
+
             :returns: `list` -- the final list of IPs after resolving all conflicts.
 
-        This function resolves conflicts between IPs in a hierarchical flow by calling for the user's intervention.
+        The policies are:
+          * 'interactive': the user selects an alternative for each conflict; CTRL+C switches to the flat IP flow.
+          * 'root': the version referenced closest to the root `ips_list.yml` wins.
+          * 'newest-tag': the newest tag (in version order, e.g. v1.10 > v1.9) among the alternatives wins.
+          * 'pinned': the version given in the overrides file wins, even if no alternative references it.
+          * 'fail': any conflict is an error.
+        Non-interactive policies are applied to the whole conflict set in one pass: all conflicts that cannot be resolved
+        are reported together, then the execution stops.
         """
-
+        if policy is None:
+            policy = self.conflict_policy
+        overrides = self.load_conflict_overrides() if policy == 'pinned' else None
         conflicts = self.ip_tree.get_conflicts()
         selected = OrderedDict()
+        unresolved = []
         for c in conflicts.keys():
             if len(conflicts[c]) == 1:
-                selected[c] = conflicts[c][0]
+                selected[c] = conflicts[c][0].node
                 continue
-            print(tcolors.WARNING + "Conflict for IP %s" % c + tcolors.ENDC)
-            for i,el in enumerate(conflicts[c]):
-                if el.father is None:
-                    if verbose:
-                        print("  %d. %s:%s/%s @ %s (retrieved from local root repository)" % (
-                            i+1, el.itself['server'], el.itself['group'], c, el.itself['commit']))
-                    else:
-                        print("  %d. %s/%s @ %s (retrieved from local root repository)" % (
-                            i+1, el.itself['group'], c, el.itself['commit']))
-                else:
-                    if verbose:
-                        print("  %d. %s:%s/%s @ %s (retrieved from %s:%s/%s @ %s)" % (
-                            i+1, el.itself['server'], el.itself['group'], c, el.itself['commit'],
-                            el.father['server'], el.father['group'], el.father['name'], el.father['commit']))
-                    else:
-                        print("  %d. %s/%s @ %s (retrieved from %s/%s @ %s)" % (
-                            i+1, el.itself['group'], c, el.itself['commit'],
-                            el.father['group'], el.father['name'], el.father['commit']))
-            flag = False
-            signal.signal(signal.SIGINT, signal.default_int_handler)
-            while not flag:
-                try:
-                    std_in = raw_input("Select the desired alternative (1-%d, CTRL+C to exit hierarchical flow): " % (len(conflicts[c])))
-                except KeyboardInterrupt:
+            if policy == 'interactive':
+                print(tcolors.WARNING + "Conflict for IP %s" % c + tcolors.ENDC)
+                self.__print_alternatives(c, conflicts[c], verbose=verbose)
+                idx = self.__ask_alternative(len(conflicts[c]))
+                if idx is None:
                     print(tcolors.WARNING + "\nEscaped from IP choice, switching from hierarchical IP flow to flat IP flow." + tcolors.ENDC)
-                    return
-                if not std_in.isdigit():
-                    print(tcolors.WARNING + "Alternative selected is not a number." + tcolors.ENDC)
-                elif int(std_in) < 1 or int(std_in) > len(conflicts[c]):
-                    print(tcolors.WARNING + "Alternative selected is not within 1-%d." % (len(conflicts[c])) + tcolors.ENDC)
+                    return self.ip_list
+                selected[c] = conflicts[c][idx].node
+                continue
+            node = self.__select_alternative(policy, c, conflicts[c], overrides)
+            if node is None:
+                unresolved.append(c)
+                continue
+            print("Conflict for IP " + tcolors.WARNING + "'%s'" % c + tcolors.ENDC + " resolved to %s (%s policy)." % (node['commit'], policy))
+            selected[c] = node
+        if len(unresolved) > 0:
+            for c in unresolved:
+                print(tcolors.ERROR + "ERROR: unresolved conflict for IP %s (%s policy)" % (c, policy) + tcolors.ENDC)
+                self.__print_alternatives(c, conflicts[c], verbose=verbose)
+            if policy == 'pinned':
+                print(tcolors.ERROR + "ERROR: pin the IPs above in %s." % self.conflict_overrides + tcolors.ENDC)
+            sys.exit(1)
+        return list(selected.values())
+
+    def load_conflict_overrides(self):
+        """Loads the overrides file of the 'pinned' conflict policy.
+
+            :returns: `dict` -- the overriding IP entries, by IP name.
+        """
+        try:
+            return OrderedDict([(ip['name'], ip) for ip in load_ips_list(self.conflict_overrides)])
+        except IOError:
+            print(tcolors.ERROR + "ERROR: the pinned conflict policy requires %s." % self.conflict_overrides + tcolors.ENDC)
+            sys.exit(1)
+
+    def __select_alternative(self, policy, name, alternatives, overrides=None):
+        # returns the selected IP entry, None if the policy cannot resolve the conflict
+        if policy == 'root':
+            depth = min([el.depth for el in alternatives])
+            closest = [el for el in alternatives if el.depth == depth]
+            # same depth (e.g. two sibling IPs) is a tie that the policy cannot break
+            return closest[0].node if len(closest) == 1 else None
+        elif policy == 'newest-tag':
+            tags = [el for el in alternatives if el.node['commit'] is not None and el.node['commit'][:5] == "tags/"]
+            if len(tags) == 0:
+                return None
+            return max(tags, key=lambda el: version_key(el.node['commit'])).node
+        elif policy == 'pinned':
+            if name not in overrides.keys():
+                return None
+            pin = overrides[name]
+            node = dict(alternatives[0].node)
+            for k in ('commit', 'server', 'group'):
+                if pin[k] is not None:
+                    node[k] = pin[k]
+            return node
+        return None
+
+    def __print_alternatives(self, c, alternatives, verbose=False):
+        for i,el in enumerate(alternatives):
+            if el.father is None:
+                if verbose:
+                    print("  %d. %s:%s/%s @ %s (retrieved from local root repository)" % (
+                        i+1, el.itself['server'], el.itself['group'], c, el.itself['commit']))
+                else:
+                    print("  %d. %s/%s @ %s (retrieved from local root repository)" % (
+                        i+1, el.itself['group'], c, el.itself['commit']))
+            else:
+                if verbose:
+                    print("  %d. %s:%s/%s @ %s (retrieved from %s:%s/%s @ %s)" % (
+                        i+1, el.itself['server'], el.itself['group'], c, el.itself['commit'],
+                        el.father['server'], el.father['group'], el.father['name'], el.father['commit']))
                 else:
-                    flag = True
-                    selected[c] = conflicts[c][int(std_in)-1]
-        new_ips_list = []
-        for s in selected.values():
-            new_ips_list.append(s.node)
-        return new_ips_list
+                    print("  %d. %s/%s @ %s (retrieved from %s/%s @ %s)" % (
+                        i+1, el.itself['group'], c, el.itself['commit'],
+                        el.father['group'], el.father['name'], el.father['commit']))
+
+    def __ask_alternative(self, n):
+        # returns the index of the selected alternative, None if the user escapes
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        while True:
+            try:
+                std_in = read_input("Select the desired alternative (1-%d, CTRL+C to exit hierarchical flow): " % (n))
+            except (KeyboardInterrupt, EOFError):
+                return None
+            if not std_in.isdigit():
+                print(tcolors.WARNING + "Alternative selected is not a number." + tcolors.ENDC)
+            elif int(std_in) < 1 or int(std_in) > n:
+                print(tcolors.WARNING + "Alternative selected is not within 1-%d." % (n) + tcolors.ENDC)
+            else:
+                return int(std_in)-1
 
     def import_yaml(self, ip_name, filename, ip_path, domain=None, alternatives=None, ips_dic=None, ips_dir=None):
         """Generates a new :class:`IPConfig` for an IP and adds it to the :class:`IPDatabase` internal dictionary.                    
@@ -335,6 +456,30 @@ class IPDatabase(object):
         """
         if ips_dic is None:
             ips_dic = self.ip_dic
+        try:
+            ip_config = self.load_ip_config(ip_name, filename, ip_path, domain=domain, alternatives=alternatives, ips_dir=ips_dir)
+        except KeyError:
+            print(tcolors.WARNING + "WARNING: Skipped ip '%s' with %s config file as it seems it is already in the ip database." % (ip_name, filename) + tcolors.ENDC)
+            return
+        if ip_config is not None:
+            ips_dic[ip_name] = ip_config
+
+    def load_ip_config(self, ip_name, filename, ip_path, domain=None, alternatives=None, ips_dir=None):
+        """Parses an IP's `src_files.yml` and returns the corresponding :class:`IPConfig`.
+
+            :param ip_name:             Name of the IP
+            :type  ip_name: str
+
+            :param filename:            Path to the IP's `src_files.yml`
+            :type  filename: str
+
+            :param ip_path:             Path to the IP
+            :type  ip_path: str
+
+            :returns: :class:`IPConfig` or None -- None if the IP has no `src_files.yml`.
+
+        This function is used both by :func:`import_yaml` and, in lazy mode, on first access to an IP.
+        """
         if ips_dir is None:
             ips_dir = self.ips_dir
         if not os.path.exists(os.path.dirname(filename)):
@@ -345,173 +490,421 @@ class IPDatabase(object):
                 ips_yaml_dic = ordered_load(f, yaml.SafeLoader)
         except IOError:
             print(tcolors.WARNING + "WARNING: Skipped ip '%s' as it has no src_files.yml file." % ip_name + tcolors.ENDC)
-            return
+            return None
+        return IPConfig(ip_name, ips_yaml_dic, ip_path, ips_dir, self.vsim_dir, domain=domain, alternatives=alternatives)
 
-        try:
-            ips_dic[ip_name] = IPConfig(ip_name, ips_yaml_dic, ip_path, ips_dir, self.vsim_dir, domain=domain, alternatives=alternatives)
-        except KeyError:
-            print(tcolors.WARNING + "WARNING: Skipped ip '%s' with %s config file as it seems it is already in the ip database." % (ip_name, filename) + tcolors.ENDC)
+    def get_file_index(self, filename='.cached_ipindex.json', verbose=False):
+        """Returns the reverse file-to-IP index, refreshed against the current IP database.
+
+            :param filename:            Name of the JSON file where the index is persisted (defaults to '.cached_ipindex.json').
+            :type  filename: str
+
+            :param verbose:             If true, prints the IPs that are (re-)indexed.
+            :type  verbose: bool
+
+            :returns: :class:`IPFileIndex` -- the up-to-date index.
+
+        Only the IPs whose `src_files.yml` changed since the last call are parsed again; the refreshed index is saved back.
+        """
+        index = IPFileIndex(filename)
+        index.refresh(self, verbose=verbose)
+        index.save()
+        return index
+
+    def get_changed_files(self, commit_from, commit_to=None, ip_commits=None):
+        """Lists the files changed between two commits of the main repository and of the IP repositories.
+
+            :param commit_from:         Base commit of the main repository.
+            :type  commit_from: str
+
+            :param commit_to:           Target commit of the main repository (if None, the working tree).
+            :type  commit_to: str or None
+
+            :param ip_commits:          Dictionary mapping IP names to (from, to) commit pairs; if None, the pairs are taken from the `ips_list.yml` at the two commits of the main repository.
+            :type  ip_commits: dict or None
+
+            :returns: `list` -- absolute paths of the changed files.
+        """
+        changed = []
+        main = GitRepository(self.list_path)
+        toplevel = main.lines("rev-parse", "--show-toplevel")
+        if len(toplevel) > 0:
+            revs = [commit_from] if commit_to is None else [commit_from, commit_to]
+            for f in main.diff_names(*revs):
+                changed.append(os.path.normpath(os.path.join(toplevel[0], f)))
+        if ip_commits is None:
+            ip_commits = OrderedDict()
+            old_ips = {}
+            for ip in self.__load_ips_list_at(main, commit_from):
+                old_ips[ip['name']] = ip['commit']
+            new_ips = self.ip_list if commit_to is None else self.__load_ips_list_at(main, commit_to)
+            for ip in new_ips:
+                if ip['name'] in old_ips and old_ips[ip['name']] != ip['commit']:
+                    ip_commits[ip['name']] = (old_ips[ip['name']], ip['commit'])
+        main.close()
+        for ip in self.ip_list:
+            if ip['name'] not in ip_commits:
+                continue
+            ip_root = os.path.abspath(os.path.join(self.list_path, self.ips_dir, ip['path']))
+            if not os.path.isdir(os.path.join(ip_root, ".git")):
+                continue
+            for f in GitRepository(ip_root).diff_names(*ip_commits[ip['name']]):
+                changed.append(os.path.join(ip_root, f))
+        return changed
+
+    def __load_ips_list_at(self, repo, commit):
+        ips_list_yml = repo.show("%s:./ips_list.yml" % commit)
+        if ips_list_yml is None or len(ips_list_yml) == 0:
+            return []
+        return load_ips_list_from_yml(ips_list_yml)
+
+    def get_impacted_libs(self, changed_files, index=None, target_tech=None, local=False):
+        """Computes the sub-IP libraries to be recompiled after a change.
+
+            :param changed_files:       Paths of the changed files (see :func:`get_changed_files`).
+            :type  changed_files: list
+
+            :param index:               The file index to be used (if None, the one returned by :func:`get_file_index`).
+            :type  index: :class:`IPFileIndex` or None
+
+            :param target_tech:         Target technology the Makefiles are exported for (see :func:`export_make`).
+            :type  target_tech: None or str
+
+            :param local:               If set to True, sub-IPs used only locally are built as well.
+            :type  local: bool
+
+            :returns: `tuple` -- (libs, unknown, skipped): the list of (source, IP, sub-IP) keys to be recompiled in compilation order, the list of changed paths not referenced by any IP, and the list of impacted keys that :func:`export_make` does not build for this target.
+
+        Besides the sub-IPs directly compiling or including a changed file, all sub-IPs importing a package from an
+        impacted sub-IP are transitively selected.
+        """
+        if index is None:
+            index = self.get_file_index()
+        libs, unknown, skipped = index.get_impacted_libs(changed_files, target_tech=target_tech, local=local)
+        index.save()
+        return libs, unknown, skipped
+
+    def generate_impact_makefile(self, filename, libs, target_tech=None, local=False):
+        """Exports a Makefile rebuilding only the given sub-IP libraries.
+
+            :param filename:            Output Makefile file name.
+            :type  filename: str
+
+            :param libs:                List of (source, IP, sub-IP) keys (see :func:`get_impacted_libs`).
+            :type  libs: list
+
+            :param target_tech:         Target technology the Makefiles are exported for (see :func:`export_make`).
+            :type  target_tech: None or str
+
+            :param local:               If set to True, sub-IPs used only locally are built as well.
+            :type  local: bool
+
+        The `build` target of the generated Makefile forces the recompilation of the selected sub-IPs, in the given
+        order, through the per-IP Makefiles generated by :func:`export_make`. Sub-IPs without a goal in those Makefiles
+        (not built for `target_tech`, simulation skipped or local only) are skipped with a warning.
+        """
+        vcompile_libs = MK_LIBS_PREAMBLE
+        for (source, ip, sub_ip) in libs:
+            ips_dic = self.ip_dic if source == 'ips' else self.rtl_dic
+            try:
+                sub_ip_config = ips_dic[ip].sub_ips[sub_ip]
+            except (KeyError, AttributeError):
+                sub_ip_config = None
+            if sub_ip_config is None or not has_make_goal(sub_ip_config.targets, sub_ip_config.flags, target_tech=target_tech, local=local):
+                print(tcolors.WARNING + "WARNING: skipping sub-IP %s/%s/%s, which has no goal in the generated Makefiles." % (source, ip, sub_ip) + tcolors.ENDC)
+                continue
+            vcompile_libs += MK_IMPACT_CMD % (source, ip, sub_ip)
+        vcompile_libs += "\n\n"
+        with open(filename, "w") as f:
+            f.write(vcompile_libs)
 
-    def diff_ips(self):
+    def diff_ips(self, ips=None):
         """Performs `git diff` for each of the IPs referenced by the tool.                    
+
+            :param ips:                 If not None, the IPs to be diffed (by default, all IPs in `ips_list.yml`).
+            :type  ips: list or None
         """
         prepend = "  "
-        ips = self.ip_list
-        cwd = os.getcwd()
+        snapshot = self.get_status(ips=ips)
+        if ips is None:
+            ips = self.ip_list
         unstaged_ips = []
         staged_ips = []
         for ip in ips:
-            try:
-                # print "Diffing " + tcolors.WARNING + "%s" % ip['name'] + tcolors.ENDC + "..." 
-                os.chdir("%s/%s" % (self.ips_dir, ip['path']))
-                output, err = execute_popen("git diff --name-only").communicate()
-                unstaged_out = ""
-                if output.split("\n")[0] != "":
-                    for line in output.split("\n"):
-                        l = line.split()
-                        try:
-                            unstaged_out += "%s%s\n" % (prepend, l[0])
-                        except IndexError:
-                            break
-                output, err = execute_popen("git diff --cached --name-only").communicate()
-                staged_out = ""
-                if output.split("\n")[0] != "":
-                    for line in output.split("\n"):
-                        l = line.split()
-                        try:
-                            staged_out += "%s%s\n" % (prepend, l[0])
-                        except IndexError:
-                            break
-                os.chdir(cwd)
-                if unstaged_out != "":
-                    print("Changes not staged for commit in ip " + tcolors.WARNING + "'%s'" % ip['name'] + tcolors.ENDC + ".")
-                    print(unstaged_out)
-                    unstaged_ips.append(ip)
-                if staged_out != "":
-                    print("Changes staged for commit in ip " + tcolors.WARNING + "'%s'" % ip['name'] + tcolors.ENDC + ".\nUse " + tcolors.BLUE + "git reset HEAD" + tcolors.ENDC + " in the ip directory to unstage.")
-                    print(staged_out)
-                    staged_ips.append(ip)
-            except OSError:
+            # print "Diffing " + tcolors.WARNING + "%s" % ip['name'] + tcolors.ENDC + "..." 
+            status = snapshot[ip['name']]
+            if not status['exists']:
                 print(tcolors.WARNING + "WARNING: Skipping ip '%s'" % ip['name'] + " as it doesn't exist." + tcolors.ENDC)
+                continue
+            unstaged_out = "".join(["%s%s\n" % (prepend, f) for f in status['unstaged']])
+            staged_out = "".join(["%s%s\n" % (prepend, f) for f in status['staged']])
+            if unstaged_out != "":
+                print("Changes not staged for commit in ip " + tcolors.WARNING + "'%s'" % ip['name'] + tcolors.ENDC + ".")
+                print(unstaged_out)
+                unstaged_ips.append(ip)
+            if staged_out != "":
+                print("Changes staged for commit in ip " + tcolors.WARNING + "'%s'" % ip['name'] + tcolors.ENDC + ".\nUse " + tcolors.BLUE + "git reset HEAD" + tcolors.ENDC + " in the ip directory to unstage.")
+                print(staged_out)
+                staged_ips.append(ip)
         return (unstaged_ips, staged_ips)
 
-    def remove_ips(self, skip_check=False):
+    def remove_ips(self, skip_check=False, ips=None, wait=False):
         """Removes the currently downloaded IPs.                    
 
             :param skip_check:          If set to True, removes all IPs without checking for changes first
             :type  skip_check: bool
 
+            :param ips:                 If not None, the IPs to be removed (by default, all IPs in `ips_list.yml`, and then the IP directory itself).
+            :type  ips: list or None
+
+            :param wait:                If true, returns only when the IP files have been deleted.
+            :type  wait: bool
+
         This function removes the currently downloaded IPs, after having checked whether there are changes to be committed / pushed first.
+        Each IP directory is atomically renamed into a trash directory next to `ips_dir`, so that the workspace is consistent as soon
+        as this function returns; the trash is then emptied by a background thread (see :func:`wait_removal`).
         """
-        ips = self.ip_list
-        cwd = os.getcwd()
-        unstaged_ips, staged_ips = self.diff_ips()
-        os.chdir(self.ips_dir)
+        remove_all = ips is None
+        if remove_all:
+            ips = self.ip_list
+        unstaged_ips, staged_ips = self.diff_ips(ips=None if remove_all else ips)
         if not skip_check and (len(unstaged_ips)+len(staged_ips) > 0):
             print(tcolors.ERROR + "ERROR: Cowardly refusing to remove IPs as there are changes." + tcolors.ENDC)
             print("If you *really* want to remove ips, run remove-ips.py with the --skip-check flag.")
             sys.exit(1)
+        trash = os.path.join(os.path.dirname(os.path.abspath(self.ips_dir)), ".ipstools_trash")
         for ip in ips:
-            import shutil
-            for root, dirs, files in os.walk('%s' % ip['path']):
-                for f in files:
-                    os.unlink(os.path.join(root, f))
-                for d in dirs:
-                    shutil.rmtree(os.path.join(root, d))
+            path = os.path.abspath(os.path.join(self.ips_dir, ip['path']))
+            repo = self.repositories.pop(path, None)
+            if repo is not None:
+                repo.close()
+            if not os.path.lexists(path):
+                continue
             try:
-                os.removedirs("%s" % ip['path'])
+                if not os.path.isdir(trash):
+                    os.makedirs(trash)
+                os.rename(path, os.path.join(trash, "%s-%d-%d" % (prepare(ip['path']), os.getpid(), int(time.time()*1e6))))
             except OSError:
-                pass
+                # e.g. the trash is on another file system
+                remove_tree(path)
+            # remove the parent directories left empty, up to ips_dir
+            parent = os.path.dirname(ip['path'])
+            while parent != "":
+                try:
+                    os.rmdir(os.path.join(self.ips_dir, parent))
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+        self.status_snapshot = None
+        if os.path.isdir(trash):
+            self.wait_removal()
+            self.removal_thread = threading.Thread(target=remove_tree, args=(trash,))
+            self.removal_thread.start()
+            if wait:
+                self.wait_removal()
+        if not remove_all:
+            print(tcolors.OK + "Removed ips %s." % ", ".join([ip['name'] for ip in ips]) + tcolors.ENDC)
+            return
         print(tcolors.OK + "Removed all IPs listed in ips_list.yml." + tcolors.ENDC)
-        os.chdir(cwd)
         try:
             os.removedirs(self.ips_dir)
         except OSError:
             print(tcolors.WARNING + "WARNING: Not removing %s as there are unknown IPs there." % (self.ips_dir) + tcolors.ENDC)
 
-    def update_ips(self, origin='origin'):
+    def wait_removal(self):
+        """Waits for the background deletion started by :func:`remove_ips`, if any.
+        """
+        if self.removal_thread is not None:
+            self.removal_thread.join()
+            self.removal_thread = None
+
+    def update_ips(self, origin='origin', shallow=False, partial=False, incremental=True, applied_file='.ipstools_applied.json'):
         """Updates the IPs against the given repository.                    
                  
             :param origin:             The GIT remote to be used (by default 'origin')
             :type  origin: str
 
+            :param shallow:            If true, only the commit in `ips_list.yml` is fetched, at depth 1 (see :func:`fetch_ref`).
+            :type  shallow: bool
+
+            :param partial:            If true, new IPs are cloned without blobs, which are then fetched on demand at checkout.
+            :type  partial: bool
+
+            :param incremental:        If true, IPs unchanged since the last successful update are not touched.
+            :type  incremental: bool
+
+            :param applied_file:       Name of the file (in `list_path`) recording the last applied IP list.
+            :type  applied_file: str
+
         This function updates the currently downloaded IPs, after having checked whether the IPs are actually GIT repos and they
-        are not in detached mode. If the IPs are not there yet, they are cloned.
+        are not in detached mode. IPs whose HEAD already matches the tag or hash in `ips_list.yml` and whose tree is clean are
+        skipped without any network access. If the IPs are not there yet, they are cloned; if a mirror directory is configured,
+        new clones fetch their objects from a local bare mirror of the remote (see :func:`update_mirror`).
+
+        The flat list of applied IPs (name, path, remote, requested commit and resolved hash) is recorded in `applied_file`. In
+        incremental mode, IPs whose entry did not change and whose HEAD is still at the recorded hash are left alone (including
+        IPs following a branch: use `incremental=False` to pull the latest commits). IPs that were dropped from the list (or
+        moved) since the last update are removed if they have no changes (see :func:`remove_ips`).
         """
         errors = []
+        skipped = []
+        clone_stats = []
         ips = self.ip_list
-        git = "git"
-        # make sure we are in the correct directory to start
-        owd = os.getcwd()
-        os.chdir(self.ips_dir)
-        cwd = os.getcwd()
+        applied_file = os.path.join(self.list_path, applied_file)
+        applied = self.load_applied(applied_file)
+        record = OrderedDict()
+        delta = OrderedDict([('added', []), ('re-pinned', []), ('moved', []), ('updated', []), ('removed', []), ('kept', []), ('unchanged', [])])
 
         for ip in ips:
-            os.chdir(cwd)
+            path = os.path.join(self.ips_dir, ip['path'])
+            url = "%s/%s.git" % (self.get_remote(ip), ip['name'])
+            old = applied.get(ip['name'])
+            if old is None:
+                change = 'added'
+            elif old['path'] != ip['path']:
+                change = 'moved'
+            elif old['remote'] != url or old['commit'] != ip['commit']:
+                change = 're-pinned'
+            else:
+                change = 'updated'
+            if incremental and change == 'updated' and os.path.exists(os.path.join(path, ".git")):
+                if self.get_repository(ip).head() == old['hash']:
+                    record[ip['name']] = old
+                    delta['unchanged'].append(ip['name'])
+                    continue
             # check if directory already exists, this hints to the fact that we probably already cloned it
-            if os.path.isdir("./%s" % ip['path']):
-                os.chdir("./%s" % ip['path'])
+            if os.path.isdir(path):
 
                 # now check if the directory is a git directory
-                if not os.path.isdir(".git"):
-                    print(tcolors.ERROR + "ERROR: Found a normal directory instead of a git directory at %s. You may have to delete this folder to make this script work again" % os.getcwd() + tcolors.ENDC)
+                if not os.path.exists(os.path.join(path, ".git")):
+                    print(tcolors.ERROR + "ERROR: Found a normal directory instead of a git directory at %s. You may have to delete this folder to make this script work again" % os.path.abspath(path) + tcolors.ENDC)
                     errors.append("%s - %s: Not a git directory" % (ip['name'], ip['path']));
                     continue
+                repo = self.get_repository(ip)
+
+                # nothing to fetch if HEAD is already at the requested tag / hash and the tree is clean
+                if is_immutable_ref(ip['commit'], repo.path):
+                    head = repo.head()
+                    if head is not None and head == repo.resolve("%s^{commit}" % ip['commit']) and repo.is_clean():
+                        skipped.append(ip['name'])
+                        record[ip['name']] = self.__applied_entry(ip, url, head)
+                        delta[change if change != 'updated' else 'unchanged'].append(ip['name'])
+                        continue
 
                 print(tcolors.OK + "\nUpdating ip '%s'..." % ip['name'] + tcolors.ENDC)
 
-                # fetch everything first so that all commits are available later
-                ret = execute("%s fetch" % (git))
+                # follow the remote of ips_list.yml if it changed
+                if old is not None and old['remote'] != url:
+                    repo.run("remote", "set-url", origin, url)
+
+                # fetch everything first so that all commits are available later (only the needed one in shallow mode)
+                if shallow:
+                    ret = 0 if self.fetch_ref(repo, ip['commit'], origin=origin) else 1
+                else:
+                    ret = repo.run("fetch")
                 if ret != 0:
                     print(tcolors.ERROR + "ERROR: could not fetch ip '%s'." % (ip['name']) + tcolors.ENDC)
                     errors.append("%s - Could not fetch" % (ip['name']));
                     continue
 
                 # make sure we have the correct branch/tag for the pull
-                ret = execute("%s checkout %s" % (git, ip['commit']))
+                ret = repo.run("checkout", ip['commit'])
                 if ret != 0:
                     print(tcolors.ERROR + "ERROR: could not checkout ip '%s' at %s." % (ip['name'], ip['commit']) + tcolors.ENDC)
                     errors.append("%s - Could not checkout commit %s" % (ip['name'], ip['commit']));
                     continue
 
                 # only do the pull if we are not in detached head mode
-                stdout = execute_out("%s rev-parse --abbrev-ref HEAD" % (git))
-                if stdout[:4].decode(sys.stdout.encoding) != "HEAD":
-                    ret = execute("%s pull --ff-only %s %s" % (git, origin, ip['commit']))
+                if repo.branch() is not None:
+                    if shallow:
+                        ret = self.fast_forward(repo, ip['commit'], origin=origin)
+                    else:
+                        ret = repo.run("pull", "--ff-only", origin, ip['commit'])
                     if ret != 0:
                         print(tcolors.ERROR + "ERROR: could not update ip '%s'" % ip['name'] + tcolors.ENDC)
                         errors.append("%s - Could not update" % (ip['name']));
                         continue
+                record[ip['name']] = self.__applied_entry(ip, url, repo.head())
+                delta[change].append(ip['name'])
 
             # Not yet cloned, so we have to do that first
             else:
-                os.chdir("./")
-
                 print(tcolors.OK + "\nCloning ip '%s'..." % ip['name'] + tcolors.ENDC)
 
-
                 # compose remote name
-                server = ip['server'] if ip['server'] is not None else self.default_server
-                group  = ip['group']  if ip['group']  is not None else self.default_group
-                if server[:5] == "https":
-                    ip['remote'] = "%s/%s" % (server, group)
-                else:
-                    ip['remote'] = "%s:%s" % (server, group)
+                ip['remote'] = self.get_remote(ip)
 
-                ret = execute("%s clone %s/%s.git %s" % (git, ip['remote'], ip['name'], ip['path']))
+                # copy objects from the local mirror, if any
+                t0 = time.time()
+                mirror = self.update_mirror(url)
+                if shallow:
+                    ret, repo = self.shallow_clone(url, path, ip['commit'], origin=origin, mirror=mirror, partial=partial)
+                else:
+                    opts = []
+                    if mirror is not None:
+                        # the mirror is pruned on refresh: do not keep borrowing its objects
+                        opts += ["--reference", mirror, "--dissociate"]
+                    if partial:
+                        opts += ["--filter=blob:none"]
+                    ret, repo = GitRepository.clone(url, path, opts)
                 if ret != 0:
                     print(tcolors.ERROR + "ERROR: could not clone, you probably have to remove the '%s' directory." % ip['name'] + tcolors.ENDC)
                     errors.append("%s - Could not clone" % (ip['name']));
                     continue
-                os.chdir("./%s" % ip['path'])
-                ret = execute("%s checkout %s" % (git, ip['commit']))
+                if mirror is not None:
+                    clone_stats.append((ip['name'], time.time() - t0, dir_size(os.path.join(path, ".git")), dir_size(os.path.join(mirror, "objects"))))
+                self.repositories[repo.path] = repo
+                ret = repo.run("checkout", ip['commit'])
                 if ret != 0:
                     print(tcolors.ERROR + "ERROR: could not checkout ip '%s' at %s." % (ip['name'], ip['commit']) + tcolors.ENDC)
                     errors.append("%s - Could not checkout commit %s" % (ip['name'], ip['commit']));
                     continue
-        os.chdir(cwd)
+                record[ip['name']] = self.__applied_entry(ip, url, repo.head())
+                delta[change].append(ip['name'])
+
+        # IPs that failed keep their previous state
+        names = [ip['name'] for ip in ips]
+        for name in names:
+            if name not in record and name in applied:
+                record[name] = applied[name]
+        # remove the IPs dropped from the list (or moved), unless they have changes
+        dropped = []
+        for name in applied.keys():
+            old = applied[name]
+            moved = name in names and name in record and record[name]['path'] != old['path']
+            if (name not in names or moved) and os.path.exists(os.path.join(self.ips_dir, old['path'], ".git")):
+                dropped.append(old)
+        if len(dropped) > 0:
+            snapshot = self.get_status(ips=dropped)
+            safe = [ip for ip in dropped if len(snapshot[ip['name']]['staged']) + len(snapshot[ip['name']]['unstaged']) == 0]
+            if len(safe) > 0:
+                self.remove_ips(skip_check=True, ips=safe)
+            for ip in dropped:
+                if ip in safe:
+                    delta['removed'].append(ip['name'])
+                else:
+                    print(tcolors.WARNING + "WARNING: not removing ip '%s' at %s as it has changes." % (ip['name'], ip['path']) + tcolors.ENDC)
+                    delta['kept'].append(ip['name'])
+                    if ip['name'] not in names:
+                        record[ip['name']] = ip
+        self.store_applied(applied_file, record)
+        self.status_snapshot = None
         print('\n\n')
         print(tcolors.WARNING + "SUMMARY" + tcolors.ENDC)
+        if len(skipped) > 0:
+            print("Already at the requested tag / hash, skipped:")
+            for name in skipped:
+                print("    %s" % name)
+        for change in delta.keys():
+            if len(delta[change]) > 0 and change != 'unchanged':
+                print("%-12s %s" % (change.capitalize() + ":", ", ".join(delta[change])))
+        if len(delta['unchanged']) > 0:
+            print("%-12s %d IPs" % ("Unchanged:", len(delta['unchanged'])))
+        if len(clone_stats) > 0:
+            print("Cloned from mirrors in %s:" % self.mirror_dir)
+            for name, t, size, saved in clone_stats:
+                print("    %-32s %7.2fs   .git %9.1f MB   mirror %9.1f MB" % (name, t, size/1e6, saved/1e6))
+            print("    %-32s %7.2fs   .git %9.1f MB   mirror %9.1f MB" % ("total", sum([c[1] for c in clone_stats]), sum([c[2] for c in clone_stats])/1e6, sum([c[3] for c in clone_stats])/1e6))
         if len(errors) == 0:
             print(tcolors.OK + "IPs updated successfully!" + tcolors.ENDC)
         else:
@@ -520,7 +913,412 @@ class IPDatabase(object):
             print()
             print(tcolors.ERROR + "ERRORS during IP update!" + tcolors.ENDC)
             sys.exit(1)
-        os.chdir(owd)
+
+    def load_applied(self, filename='.ipstools_applied.json'):
+        """Loads the IP list recorded by the last update.
+
+            :param filename:            Path of the JSON file.
+            :type  filename: str
+
+            :returns: `OrderedDict` -- for each IP name, a dictionary with its 'name', 'path', 'remote', requested 'commit' and resolved 'hash' (empty if there is no record).
+        """
+        try:
+            with open(filename, "r") as f:
+                return OrderedDict([(e['name'], e) for e in json.loads(f.read(), object_pairs_hook=OrderedDict)])
+        except (IOError, ValueError, KeyError):
+            return OrderedDict()
+
+    def store_applied(self, filename, applied):
+        """Records the applied IP list (see :func:`load_applied`).
+        """
+        with open(filename, "w") as f:
+            f.write(json.dumps(list(applied.values()), indent=4))
+
+    def __applied_entry(self, ip, url, head):
+        return OrderedDict([
+            ('name',   ip['name']),
+            ('path',   ip['path']),
+            ('remote', url),
+            ('commit', ip['commit']),
+            ('hash',   head)
+        ])
+
+    def load_variants(self, filename='.ipstools_variants.json'):
+        """Loads the IP variants of the workspace.
+
+            :param filename:            Name of the JSON file (in `list_path`) where the variants are recorded.
+            :type  filename: str
+
+            :returns: `OrderedDict` -- for each variant name, a dictionary mapping IP names to the commit used in the variant.
+        """
+        try:
+            with open(os.path.join(self.list_path, filename), "r") as f:
+                return json.loads(f.read(), object_pairs_hook=OrderedDict)
+        except (IOError, ValueError):
+            return OrderedDict()
+
+    def store_variants(self, variants, filename='.ipstools_variants.json'):
+        with open(os.path.join(self.list_path, filename), "w") as f:
+            f.write(json.dumps(variants, indent=4))
+
+    def get_variant_path(self, variant, ip):
+        """Returns the path (relative to `ips_dir`) where an IP is deployed in a variant.
+        """
+        return os.path.join(".variants", variant, ip['path'])
+
+    def add_variant(self, variant, pins, origin='origin'):
+        """Creates or updates a variant of the workspace, in which some IPs are used at a different commit.
+
+            :param variant:             Name of the variant.
+            :type  variant: str
+
+            :param pins:                Dictionary mapping IP names to the branch / tag / commit hash to be used in the variant.
+            :type  pins: dict
+
+            :param origin:              The GIT remote to be used to fetch missing commits.
+            :type  origin: str
+
+            :returns: `bool` -- True if all IPs have been deployed.
+
+        Each IP of the variant is checked out as a `git worktree` of the IP repository in `<ips_dir>/.variants/<variant>/`, so
+        that all versions of an IP share a single object database and a variant only costs its working trees. The other IPs
+        are shared with the main workspace.
+        """
+        variants = self.load_variants()
+        entries = variants.setdefault(variant, OrderedDict())
+        ok = True
+        for name in pins.keys():
+            commit = pins[name]
+            ip = None
+            for i in self.ip_list:
+                if i['name'] == name:
+                    ip = i
+            repo = self.get_repository(ip) if ip is not None else None
+            if repo is None:
+                print(tcolors.ERROR + "ERROR: ip '%s' is not deployed in %s, cannot create a variant of it." % (name, self.ips_dir) + tcolors.ENDC)
+                ok = False
+                continue
+            if repo.resolve("%s^{commit}" % commit) is None:
+                if repo.is_shallow():
+                    self.fetch_ref(repo, commit, origin=origin)
+                else:
+                    repo.run("fetch", "--tags", origin)
+            path = os.path.join(self.ips_dir, self.get_variant_path(variant, ip))
+            if os.path.exists(path):
+                ret = GitRepository(path).run("checkout", "--detach", commit)
+            else:
+                ret = repo.run("worktree", "add", "--detach", os.path.abspath(path), commit)
+            if ret != 0:
+                print(tcolors.ERROR + "ERROR: could not check out ip '%s' at %s in variant '%s'." % (name, commit, variant) + tcolors.ENDC)
+                ok = False
+                continue
+            print("Deployed ip " + tcolors.WARNING + "'%s'" % name + tcolors.ENDC + " @ %s in variant '%s'." % (commit, variant))
+            entries[name] = commit
+        self.store_variants(variants)
+        return ok
+
+    def remove_variant(self, variant):
+        """Removes a variant and its working trees (working trees with changes are kept).
+
+            :param variant:             Name of the variant.
+            :type  variant: str
+        """
+        variants = self.load_variants()
+        if variant not in variants:
+            print(tcolors.WARNING + "WARNING: there is no variant '%s'." % variant + tcolors.ENDC)
+            return
+        for ip in self.ip_list:
+            if ip['name'] not in variants[variant]:
+                continue
+            repo = self.get_repository(ip)
+            path = os.path.abspath(os.path.join(self.ips_dir, self.get_variant_path(variant, ip)))
+            if repo is not None and repo.run("worktree", "remove", path) == 0:
+                del variants[variant][ip['name']]
+            else:
+                print(tcolors.WARNING + "WARNING: not removing ip '%s' from variant '%s', as it has changes." % (ip['name'], variant) + tcolors.ENDC)
+        if len(variants[variant]) == 0:
+            del variants[variant]
+            try:
+                os.removedirs(os.path.join(self.ips_dir, ".variants", variant))
+            except OSError:
+                pass
+        self.store_variants(variants)
+
+    def use_variant(self, variant):
+        """Points the IPs of a variant to their working trees, so that the scripts generated afterwards target the variant.
+
+            :param variant:             Name of the variant.
+            :type  variant: str
+
+        This function must be called before the `src_files.yml` are imported (see :func:`import_ips`).
+        """
+        variants = self.load_variants()
+        if variant not in variants:
+            print(tcolors.ERROR + "ERROR: there is no variant '%s' (known variants: %s)." % (variant, ", ".join(variants.keys())) + tcolors.ENDC)
+            sys.exit(1)
+        for ip in self.ip_list:
+            if ip['name'] in variants[variant]:
+                ip['path'] = self.get_variant_path(variant, ip)
+
+    def get_repository(self, ip):
+        """Returns the :class:`GitRepository` of a deployed IP.
+
+            :param ip:                  Dictionary representing the IP.
+            :type  ip: dict
+
+            :returns: :class:`GitRepository` or None -- None if the IP is not a git repository.
+
+        Repositories are cached, so that their `cat-file` processes and status are shared by all the methods of the database.
+        """
+        path = os.path.abspath(os.path.join(self.ips_dir, ip['path']))
+        if not os.path.exists(os.path.join(path, ".git")):
+            return None
+        try:
+            return self.repositories[path]
+        except KeyError:
+            repo = GitRepository(path)
+            self.repositories[path] = repo
+            return repo
+
+    def get_status(self, refresh=False, threads=8, ips=None):
+        """Collects a snapshot of the state of all IPs in a single parallel pass.
+
+            :param refresh:             If true, the snapshot is collected again even if one is available.
+            :type  refresh: bool
+
+            :param threads:             Number of IPs queried concurrently.
+            :type  threads: int
+
+            :param ips:                 If not None, the IPs to be queried instead of those in `ips_list.yml` (the result is then not cached).
+            :type  ips: list or None
+
+            :returns: `OrderedDict` -- for each IP name (in `ips_list.yml` order), a dictionary with the IP 'name', 'path' and requested 'commit', whether it 'exists' as a git repository and, if so, its 'head' hash, 'branch' (None if detached), 'newest_tag' (None if there is none), whether 'newest_tag_current' points to the same tree as HEAD, and the lists of 'staged', 'unstaged' and 'untracked' files.
+
+        The snapshot is cached and shared by :func:`diff_ips`, :func:`tag_ips` and :func:`get_latest_ips`; it is dropped when
+        the IPs are updated or tagged.
+        """
+        if ips is None and self.status_snapshot is not None and not refresh:
+            return self.status_snapshot
+        repos = []
+        for ip in (ips if ips is not None else self.ip_list):
+            repo = self.get_repository(ip)
+            if repo is not None and refresh:
+                repo.invalidate()
+            repos.append((ip, repo))
+        pool = ThreadPool(max(1, min(threads, len(repos))))
+        try:
+            entries = pool.map(self.__collect_status, repos)
+        finally:
+            pool.close()
+            pool.join()
+        snapshot = OrderedDict([(e['name'], e) for e in entries])
+        if ips is None:
+            self.status_snapshot = snapshot
+        return snapshot
+
+    def __collect_status(self, ip_repo):
+        ip, repo = ip_repo
+        entry = OrderedDict([
+            ('name',   ip['name']),
+            ('path',   ip['path']),
+            ('commit', ip['commit']),
+            ('exists', repo is not None)
+        ])
+        if repo is None:
+            return entry
+        status = repo.status()
+        entry['head']       = repo.head()
+        entry['branch']     = repo.branch()
+        entry['newest_tag'] = repo.newest_tag()
+        entry['newest_tag_current'] = entry['newest_tag'] is not None and repo.resolve("tags/%s^{tree}" % entry['newest_tag']) == repo.resolve("HEAD^{tree}")
+        entry['staged']     = status['staged']
+        entry['unstaged']   = status['unstaged']
+        entry['untracked']  = status['untracked']
+        return entry
+
+    def shallow_clone(self, url, path, commit, origin='origin', mirror=None, partial=False):
+        """Clones a single commit of a repository at depth 1.
+
+            :param url:                 URL of the remote repository.
+            :type  url: str
+
+            :param path:                Directory of the new clone.
+            :type  path: str
+
+            :param commit:              Branch, tag (`tags/<name>`) or commit hash to be fetched.
+            :type  commit: str
+
+            :param origin:              Name of the remote.
+            :type  origin: str
+
+            :param mirror:              Local mirror to copy objects from, if any.
+            :type  mirror: str or None
+
+            :param partial:             If true, blobs are not fetched until they are needed.
+            :type  partial: bool
+
+            :returns: `tuple` -- (return code, :class:`GitRepository` of the new clone).
+
+        Nothing is checked out: the caller is expected to run `git checkout <commit>` in the new clone. Objects found in the
+        mirror are copied into the clone, which does not depend on the mirror afterwards (as `git clone --dissociate`).
+        """
+        ret, repo = GitRepository.init(path)
+        if ret != 0:
+            return ret, repo
+        repo.run("remote", "add", origin, url)
+        if partial:
+            repo.run("config", "remote.%s.promisor" % origin, "true")
+            repo.run("config", "remote.%s.partialclonefilter" % origin, "blob:none")
+        alternates = os.path.join(repo.path, ".git", "objects", "info", "alternates")
+        if mirror is not None:
+            with open(alternates, "w") as f:
+                f.write("%s/objects\n" % mirror)
+        ret = 0 if self.fetch_ref(repo, commit, origin=origin) else 1
+        if mirror is not None:
+            # the mirror is pruned on refresh: copy the borrowed objects before dropping it
+            if ret == 0:
+                ret = repo.run("repack", "-a", "-d", "-q")
+            if ret == 0:
+                os.remove(alternates)
+        return ret, repo
+
+    def fetch_ref(self, repo, commit, origin='origin'):
+        """Fetches a single branch, tag or commit hash at depth 1.
+
+            :param repo:                The repository.
+            :type  repo: :class:`GitRepository`
+
+            :param commit:              Branch, tag (`tags/<name>`) or commit hash to be fetched.
+            :type  commit: str
+
+            :param origin:              Name of the remote.
+            :type  origin: str
+
+            :returns: `bool` -- True if the commit is available locally after the fetch.
+
+        Branches are fetched into `refs/remotes/<origin>/`, tags into `refs/tags/`. Commit hashes are requested directly, after
+        trying them as branch or tag names (a branch may be named like a hash); if the server does not serve them (e.g.
+        abbreviated or unadvertised hashes), the branch tips are fetched and their history is deepened until the commit
+        shows up.
+        """
+        if commit[:5] == "tags/":
+            refspecs = ["+refs/%s:refs/%s" % (commit, commit)]
+        else:
+            refspecs = ["+refs/heads/%s:refs/remotes/%s/%s" % (commit, origin, commit), "+refs/tags/%s:refs/tags/%s" % (commit, commit)]
+            # a branch may be named like a hash: try the branch first
+            if is_commit_hash(commit):
+                refspecs.append(commit)
+        for i, refspec in enumerate(refspecs):
+            # only the errors of the last attempt are shown
+            if repo.run("fetch", "-q", "--depth", "1", origin, refspec, silent=i < len(refspecs)-1) == 0:
+                return True
+        if not is_commit_hash(commit):
+            return False
+        print(tcolors.WARNING + "WARNING: %s is not served directly, deepening the history." % commit + tcolors.ENDC)
+        if repo.run("fetch", "-q", "--depth", "1", origin) != 0:
+            return False
+        return self.deepen(repo, origin, lambda: repo.resolve("%s^{commit}" % commit) is not None)
+
+    def fast_forward(self, repo, branch, origin='origin'):
+        """Fast-forwards the current branch to its fetched remote counterpart in a shallow repository.
+
+            :param repo:                The repository.
+            :type  repo: :class:`GitRepository`
+
+            :param branch:              Name of the branch.
+            :type  branch: str
+
+            :param origin:              Name of the remote.
+            :type  origin: str
+
+            :returns: `int` -- 0 on success.
+
+        The history is deepened until the local branch is found to be an ancestor of the remote one.
+        """
+        target = "%s/%s" % (origin, branch)
+        self.deepen(repo, origin, lambda: repo.run("merge-base", "--is-ancestor", "HEAD", target) == 0, refspec="+refs/heads/%s:refs/remotes/%s" % (branch, target))
+        return repo.run("merge", "-q", "--ff-only", target)
+
+    def deepen(self, repo, origin, available, refspec=None, steps=(1, 16, 256)):
+        """Deepens the history of a shallow repository until a condition is met.
+
+            :param repo:                The repository.
+            :type  repo: :class:`GitRepository`
+
+            :param origin:              Name of the remote.
+            :type  origin: str
+
+            :param available:           Function returning True when the history is deep enough.
+            :type  available: function
+
+            :param refspec:             Refspec to be deepened (by default, the one configured for the remote).
+            :type  refspec: str or None
+
+            :param steps:               Numbers of commits added to the history at each step, before fetching it in full.
+            :type  steps: tuple
+
+            :returns: `bool` -- the last value returned by `available`.
+        """
+        refspecs = [refspec] if refspec is not None else []
+        for depth in steps:
+            if available():
+                return True
+            if repo.run("fetch", "-q", "--deepen=%d" % depth, origin, *refspecs) != 0:
+                return False
+        if available():
+            return True
+        if repo.is_shallow():
+            repo.run("fetch", "-q", "--unshallow", origin, *refspecs)
+        return available()
+
+    def get_remote(self, ip):
+        """Composes the remote (server and group) of an IP.
+
+            :param ip:                  Dictionary representing the IP.
+            :type  ip: dict
+
+            :returns: `str` -- the remote, to be completed with `/<name>.git`.
+
+        HTTPS servers and local paths (including `file://` URLs) are joined to the group with a slash, SSH servers with a colon.
+        """
+        server = ip['server'] if ip['server'] is not None else self.default_server
+        group  = ip['group']  if ip['group']  is not None else self.default_group
+        if server[:5] == "https" or server[:7] == "file://" or os.path.isdir(server):
+            return "%s/%s" % (server, group)
+        else:
+            return "%s:%s" % (server, group)
+
+    def update_mirror(self, url):
+        """Creates or refreshes the local bare mirror of a remote repository.
+
+            :param url:                 URL of the remote repository.
+            :type  url: str
+
+            :returns: `str` or None -- absolute path of the mirror, None if no mirror directory is configured or the mirror could not be set up.
+
+        Mirrors are kept in `mirror_dir`, keyed by the remote URL, and are shared by all workspaces using the same directory.
+        Each mirror is refreshed at most once per :class:`IPDatabase` instance. As refreshing prunes deleted branches (and
+        `git gc` may then drop their objects), clones copy what they need from the mirror instead of borrowing it.
+        """
+        if self.mirror_dir is None:
+            return None
+        name = os.path.basename(url.rstrip("/"))
+        if name[-4:] == ".git":
+            name = name[:-4]
+        mirror = os.path.join(os.path.abspath(self.mirror_dir), "%s-%s.git" % (prepare(name), hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]))
+        if mirror in self.refreshed_mirrors:
+            return mirror
+        if not os.path.isdir(mirror):
+            print("Creating mirror of %s..." % url)
+            ret, repo = GitRepository.clone(url, mirror, ["--mirror"])
+        else:
+            print("Refreshing mirror of %s..." % url)
+            ret = GitRepository(mirror).run("fetch", "--prune", "origin")
+        if ret != 0:
+            print(tcolors.WARNING + "WARNING: could not set up the mirror of %s, cloning without it." % url + tcolors.ENDC)
+            return None
+        self.refreshed_mirrors.add(mirror)
+        return mirror
 
     def delete_tag_ips(self, tag_name):
         """Deletes a tag for all IPs.                    
@@ -530,13 +1328,10 @@ class IPDatabase(object):
 
         This function removes a tag to all IPs (no safety checks).
         """
-        cwd = os.getcwd()
-        ips = self.ip_list
-        new_ips = []
-        for ip in ips:
-            os.chdir("%s/%s" % (self.ips_dir, ip['path']))
-            ret = execute("git tag -d %s" % tag_name)
-            os.chdir(cwd)
+        for ip in self.ip_list:
+            repo = self.get_repository(ip)
+            if repo is not None:
+                repo.run("tag", "-d", tag_name)
 
     def push_tag_ips(self, tag_name=None):
         """Pushes a tag for all IPs.                    
@@ -546,22 +1341,14 @@ class IPDatabase(object):
 
         Pushes the latest tagged version, or a specific tag, for all IPs.
         """
-        cwd = os.getcwd()
-        ips = self.ip_list
-        new_ips = []
-        for ip in ips:
-            os.chdir("%s/%s" % (self.ips_dir, ip['path']))
-            if tag_name == None:
-                newest_tag = execute_popen("git describe --tags --abbrev=0", silent=True).communicate()
-                try:
-                    newest_tag = newest_tag[0].split()
-                    newest_tag = newest_tag[0]
-                except IndexError:
-                    pass
-            else:
-                newest_tag = tag_name
-            ret = execute("git push origin tags/%s" % newest_tag)
-            os.chdir(cwd)
+        for ip in self.ip_list:
+            repo = self.get_repository(ip)
+            if repo is None:
+                continue
+            newest_tag = tag_name if tag_name is not None else repo.newest_tag()
+            if newest_tag is None:
+                continue
+            repo.run("push", "origin", "tags/%s" % newest_tag)
 
     # def push_ips(self, remote_name, remote):
     #     cwd = os.getcwd()
@@ -589,48 +1376,40 @@ class IPDatabase(object):
         on the `changes_severity` setting. If no identical tag exists or `tag_always` is set to True, the current HEAD of the IP will
         be tagged with the given `tag_name`.
         """
-        cwd = os.getcwd()
         ips = self.ip_list
         new_ips = []
+        snapshot = self.get_status()
         for ip in ips:
-            os.chdir("%s/%s" % (self.ips_dir, ip['path']))
-            newest_tag, err = execute_popen("git describe --tags --abbrev=0", silent=True).communicate()
-            unstaged_changes, err = execute_popen("git diff --name-only").communicate()
-            staged_changes, err = execute_popen("git diff --cached --name-only").communicate()
-            if staged_changes.split("\n")[0] != "":
+            status = snapshot[ip['name']]
+            if not status['exists']:
+                print(tcolors.WARNING + "WARNING: Skipping ip '%s'" % ip['name'] + " as it doesn't exist." + tcolors.ENDC)
+                continue
+            newest_tag = status['newest_tag']
+            if len(status['staged']) > 0:
                 if changes_severity == 'warning':
                     print(tcolors.WARNING + "WARNING: skipping ip '%s' as it has changes staged for commit." % ip['name'] + tcolors.ENDC + "\nSolve, commit and " + tcolors.BLUE + "git tag %s" % tag_name + tcolors.ENDC + " manually.")
-                    os.chdir(cwd)
                     continue
                 else:
                     print(tcolors.ERROR + "ERROR: ip '%s' has changes staged for commit." % ip['name'] + tcolors.ENDC + "\nSolve and commit before trying to auto-tag.")
                     sys.exit(1)
-            if unstaged_changes.split("\n")[0] != "":
+            if len(status['unstaged']) > 0:
                 if changes_severity == 'warning':
                     print(tcolors.WARNING + "WARNING: skipping ip '%s' as it has unstaged changes." % ip['name'] + tcolors.ENDC + "\nSolve, commit and " + tcolors.BLUE + "git tag %s" % tag_name + tcolors.ENDC + " manually.")
-                    os.chdir(cwd)
                     continue
                 else:
                     print(tcolors.ERROR + "ERROR: ip '%s' has unstaged changes." % ip['name'] + tcolors.ENDC + "\nSolve and commit before trying to auto-tag.")
                     sys.exit(1)
-            if newest_tag != "":
-                output, err = execute_popen("git diff --name-only tags/%s" % newest_tag).communicate()
-            else:
-                output = ""
-            if output.split("\n")[0] != "" or newest_tag=="" or tag_always:
-                ret = execute("git tag %s" % tag_name)
+            # the tree is clean, so the newest tag is up to date iff it points to the same tree as HEAD
+            if not status['newest_tag_current'] or tag_always:
+                ret = self.get_repository(ip).run("tag", tag_name)
                 if ret != 0:
                     print(tcolors.WARNING + "WARNING: could not tag ip '%s', probably the tag already exists." % (ip['name']) + tcolors.ENDC)
                 else:
                     print("Tagged ip " + tcolors.WARNING + "'%s'" % ip['name'] + tcolors.ENDC + " with tag %s." % tag_name)
                 newest_tag = tag_name
-            try:
-                newest_tag = newest_tag.split()[0]
-            except IndexError:
-                pass
             new_ips.append({'name': ip['name'], 'path': ip['path'], 'server': ip['server'], 'domain': ip['domain'], 'alternatives': ip['alternatives'], 'group': ip['group'], 'commit': "tags/%s" % newest_tag})
-            os.chdir(cwd)
 
+        self.status_snapshot = None
         if store:
             store_ips_list("new_ips_list.yml", new_ips)
         
@@ -649,34 +1428,30 @@ class IPDatabase(object):
         This function collects the latest version of all IPs from the local repo and stores it in a new `ips_list.yml` file.
         If there are changes (staged or unstaged) it will throw a warning, or die if `changes_severity` is set to 'error'.
         """
-        cwd = os.getcwd()
         ips = self.ip_list
         new_ips = []
+        snapshot = self.get_status()
         for ip in ips:
-            os.chdir("%s/%s" % (self.ips_dir, ip['path']))
-            #commit, err = execute_popen("git checkout master", silent=True).communicate()
-            #commit, err = execute_popen("git pull", silent=True).communicate()
-            commit, err = execute_popen("git log -n 1 --format=format:%H", silent=True).communicate()
-            unstaged_changes, err = execute_popen("git diff --name-only").communicate()
-            staged_changes, err = execute_popen("git diff --cached --name-only").communicate()
-            if staged_changes.split("\n")[0] != "":
+            status = snapshot[ip['name']]
+            if not status['exists']:
+                print(tcolors.WARNING + "WARNING: Skipping ip '%s'" % ip['name'] + " as it doesn't exist." + tcolors.ENDC)
+                continue
+            commit = status['head']
+            if len(status['staged']) > 0:
                 if changes_severity == 'warning':
                     print(tcolors.WARNING + "WARNING: skipping ip '%s' as it has changes staged for commit." % ip['name'] + tcolors.ENDC + "\nSolve and commit manually.")
-                    os.chdir(cwd)
                     continue
                 else:
                     print(tcolors.ERROR + "ERROR: ip '%s' has changes staged for commit." % ip['name'] + tcolors.ENDC + "\nSolve and commit before trying to get latest version.")
                     sys.exit(1)
-            if unstaged_changes.split("\n")[0] != "":
+            if len(status['unstaged']) > 0:
                 if changes_severity == 'warning':
                     print(tcolors.WARNING + "WARNING: skipping ip '%s' as it has unstaged changes." % ip['name'] + tcolors.ENDC + "\nSolve and commit manually.")
-                    os.chdir(cwd)
                     continue
                 else:
                     print(tcolors.ERROR + "ERROR: ip '%s' has unstaged changes." % ip['name'] + tcolors.ENDC + "\nSolve and commit before trying to get latest version.")
                     sys.exit(1)
             new_ips.append({'name': ip['name'], 'path': ip['path'], 'server': ip['server'], 'domain': ip['domain'], 'alternatives': ip['alternatives'], 'group': ip['group'], 'commit': "%s" % commit})
-            os.chdir(cwd)
 
         store_ips_list(new_ips_list, new_ips)
 
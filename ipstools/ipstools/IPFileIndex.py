@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+#
+# IPFileIndex.py
+# Francesco Conti <f.conti@unibo.it>
+#
+# Copyright (C) 2015-2018 ETH Zurich, University of Bologna
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the BSD license.  See the LICENSE file for details.
+#
+
+from __future__ import print_function
+from .IPApproX_common import *
+from .SubIPConfig import *
+import json
+
+IP_FILE_INDEX_VERSION = 2
+
+# regular expressions used to scan (System)Verilog sources for dependencies
+SV_COMMENT_RE = re.compile(r"//.*?$|/\*.*?\*/", re.DOTALL | re.MULTILINE)
+SV_PACKAGE_RE = re.compile(r"^\s*package\s+(?:automatic\s+|static\s+)?(\w+)\s*;", re.MULTILINE)
+SV_SCOPE_RE   = re.compile(r"\b(\w+)\s*::")
+SV_INCLUDE_RE = re.compile(r"`include\s+\"([^\"]+)\"")
+
+class IPFileIndex(object):
+    """Reverse index from source files to the IPs / sub-IPs compiling them.
+
+        :param filename:            Path of the JSON file where the index is persisted.
+        :type  filename: str
+
+    This class maps the absolute path of every source file listed in a `src_files.yml` (and of every
+    include directory) to the (IP, sub-IP, targets) entries referencing it. The index is persisted in a
+    JSON file and refreshed incrementally: only the IPs whose `src_files.yml` changed since the last
+    refresh are parsed again.
+
+    """
+
+    def __init__(self, filename='.cached_ipindex.json'):
+        super(IPFileIndex, self).__init__()
+        self.filename = filename
+        self.ips      = OrderedDict()
+        self.deps     = {}
+        self.files    = None
+        self.incdirs  = None
+        try:
+            with open(filename, "r") as f:
+                index = json.loads(f.read(), object_pairs_hook=OrderedDict)
+            if index['version'] == IP_FILE_INDEX_VERSION:
+                self.ips  = index['ips']
+                self.deps = index['deps']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        """Saves the index in its JSON file.
+        """
+        index = {
+            'version' : IP_FILE_INDEX_VERSION,
+            'ips'     : self.ips,
+            'deps'    : self.deps
+        }
+        with open(self.filename, "w") as f:
+            f.write(json.dumps(index, indent=4))
+
+    def refresh(self, ipdb, verbose=False):
+        """Brings the index up to date with the IPs of an :class:`IPDatabase`.
+
+            :param ipdb:                The IP database to be indexed.
+            :type  ipdb: :class:`IPDatabase`
+
+            :param verbose:             If true, prints the IPs that are (re-)indexed.
+            :type  verbose: bool
+
+            :returns: `list` -- the keys of the IPs that have been (re-)indexed.
+
+        Only IPs whose `src_files.yml` has been modified (or is new) are parsed; IPs that disappeared from
+        the database are evicted from the index.
+        """
+        refreshed = []
+        current = OrderedDict()
+        for source, ip_list, ips_dir, ips_dic in (
+            ('ips', ipdb.ip_list,  ipdb.ips_dir, ipdb.ip_dic),
+            ('rtl', ipdb.rtl_list, ipdb.rtl_dir, ipdb.rtl_dic)
+        ):
+            if ip_list is None:
+                continue
+            for ip in ip_list:
+                key = "%s:%s" % (source, ip['name'])
+                ip_root = os.path.abspath(os.path.join(ipdb.list_path, ips_dir, ip['path']))
+                src_files = os.path.join(ip_root, "src_files.yml")
+                try:
+                    mtime = os.path.getmtime(src_files)
+                except OSError:
+                    continue
+                old = self.ips.get(key)
+                if old is not None and old['src_files'] == src_files and old['mtime'] == mtime:
+                    current[key] = old
+                    continue
+                try:
+                    ip_config = ips_dic[ip['name']]
+                except KeyError:
+                    ip_config = ipdb.load_ip_config(ip['name'], src_files, ip['path'], domain=ip['domain'], alternatives=ip['alternatives'], ips_dir=ips_dir)
+                if ip_config is None:
+                    continue
+                if verbose:
+                    print("Indexing ip " + tcolors.WARNING + "'%s'" % ip['name'] + tcolors.ENDC + "...")
+                sub_ips = OrderedDict()
+                for s in ip_config.sub_ips.keys():
+                    sub_ip = ip_config.sub_ips[s]
+                    sub_ips[s] = {
+                        'files'   : [os.path.normpath(os.path.join(ip_root, f)) for f in sub_ip.files],
+                        'incdirs' : [os.path.normpath(os.path.join(ip_root, i)) for i in sub_ip.incdirs],
+                        'targets' : list(sub_ip.targets),
+                        'flags'   : list(sub_ip.flags)
+                    }
+                current[key] = {
+                    'name'      : ip['name'],
+                    'source'    : source,
+                    'path'      : ip_root,
+                    'src_files' : src_files,
+                    'mtime'     : mtime,
+                    'sub_ips'   : sub_ips
+                }
+                refreshed.append(key)
+        self.ips = current
+        self.files = None
+        self.incdirs = None
+        return refreshed
+
+    def __build_reverse_maps(self):
+        self.files   = {}
+        self.incdirs = {}
+        for key in self.ips.keys():
+            ip = self.ips[key]
+            for s in ip['sub_ips'].keys():
+                sub_ip = ip['sub_ips'][s]
+                for f in sub_ip['files']:
+                    self.files.setdefault(f, []).append(self.__entry(ip, s, 'file'))
+                for i in sub_ip['incdirs']:
+                    self.incdirs.setdefault(i, []).append(self.__entry(ip, s, 'incdir'))
+
+    def __entry(self, ip, sub_ip_name, kind):
+        return {
+            'ip'      : ip['name'],
+            'source'  : ip['source'],
+            'sub_ip'  : sub_ip_name,
+            'targets' : ip['sub_ips'][sub_ip_name]['targets'],
+            'flags'   : ip['sub_ips'][sub_ip_name]['flags'],
+            'kind'    : kind
+        }
+
+    def lookup(self, path):
+        """Finds the sub-IPs referencing a source file.
+
+            :param path:                Path of the source file (relative paths are taken from the current directory).
+            :type  path: str
+
+            :returns: `list` -- one dictionary (ip, source, sub_ip, targets, flags, kind) per referencing sub-IP.
+
+        A file is referenced by a sub-IP if it is one of its `files`, or if it lives (possibly in a subdirectory)
+        inside one of its `incdirs`; `kind` is respectively 'file' or 'incdir'.
+        """
+        if self.files is None:
+            self.__build_reverse_maps()
+        path = os.path.normpath(os.path.abspath(path))
+        entries = list(self.files.get(path, []))
+        d = os.path.dirname(path)
+        while True:
+            entries.extend(self.incdirs.get(d, []))
+            parent = os.path.dirname(d)
+            if parent == d:
+                break
+            d = parent
+        return entries
+
+    def get_impacted(self, paths):
+        """Computes the minimal set of rebuild and retest targets for a list of changed files.
+
+            :param paths:               Paths of the changed files (e.g. the output of `git diff --name-only`).
+            :type  paths: list
+
+            :returns: `tuple` -- (rebuild, retest, unknown): an ordered dictionary mapping (source, IP) keys to the list of sub-IP libraries to be rebuilt, the list of IPs to be retested, and the list of paths not referenced by any IP.
+        """
+        rebuild = OrderedDict()
+        unknown = []
+        for p in paths:
+            entries = self.lookup(p)
+            if len(entries) == 0:
+                unknown.append(p)
+            for e in entries:
+                sub_ips = rebuild.setdefault((e['source'], e['ip']), [])
+                if e['sub_ip'] not in sub_ips:
+                    sub_ips.append(e['sub_ip'])
+        retest = [ip for (source, ip) in rebuild.keys()]
+        return rebuild, retest, unknown
+
+    def __scan_file(self, path):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        old = self.deps.get(path)
+        if old is not None and old['mtime'] == mtime:
+            return old
+        deps = {
+            'mtime'    : mtime,
+            'packages' : [],
+            'imports'  : [],
+            'includes' : []
+        }
+        if not is_vhdl(path):
+            with open(path, "rb") as f:
+                text = SV_COMMENT_RE.sub("", f.read().decode('utf-8', 'replace'))
+            deps['packages'] = sorted(set(SV_PACKAGE_RE.findall(text)))
+            deps['imports']  = sorted(set(SV_SCOPE_RE.findall(text)) - set(deps['packages']))
+            deps['includes'] = sorted(set(SV_INCLUDE_RE.findall(text)))
+        self.deps[path] = deps
+        return deps
+
+    def get_dependency_graph(self):
+        """Computes the package / include dependency graph between the indexed sub-IPs.
+
+            :returns: `tuple` -- (dependents, includers): a dictionary mapping each (source, IP, sub-IP) key to the set of sub-IP keys importing one of its packages, and a dictionary mapping each resolved header path to the set of sub-IP keys including it.
+
+        Source files are scanned for `package` declarations, `pkg::` references and `` `include`` directives; the
+        scan results are cached in the index and only refreshed for modified files.
+        """
+        scanned = set()
+        packages = {}
+        imports  = {}
+        includers = {}
+        for key in self.ips.keys():
+            ip = self.ips[key]
+            for s in ip['sub_ips'].keys():
+                sub_ip = ip['sub_ips'][s]
+                sub_ip_key = (ip['source'], ip['name'], s)
+                imports[sub_ip_key] = set()
+                for f in sub_ip['files']:
+                    deps = self.__scan_file(f)
+                    if deps is None:
+                        continue
+                    scanned.add(f)
+                    for p in deps['packages']:
+                        packages.setdefault(p, set()).add(sub_ip_key)
+                    imports[sub_ip_key].update(deps['imports'])
+                    # headers are searched in the sub-IP include directories first, then next to the source file
+                    for i in deps['includes']:
+                        for d in sub_ip['incdirs'] + [os.path.dirname(f)]:
+                            header = os.path.normpath(os.path.join(d, i))
+                            if os.path.isfile(header):
+                                includers.setdefault(header, set()).add(sub_ip_key)
+                                break
+        # forget the files that are not referenced anymore
+        for f in list(self.deps.keys()):
+            if f not in scanned:
+                del self.deps[f]
+        dependents = {}
+        for sub_ip_key in imports.keys():
+            dependents.setdefault(sub_ip_key, set())
+            for p in imports[sub_ip_key]:
+                for provider in packages.get(p, ()):
+                    if provider != sub_ip_key:
+                        dependents.setdefault(provider, set()).add(sub_ip_key)
+        return dependents, includers
+
+    def get_impacted_libs(self, paths, target_tech=None, local=False):
+        """Computes the transitive set of sub-IP libraries to be recompiled for a list of changed files.
+
+            :param paths:               Paths of the changed files.
+            :type  paths: list
+
+            :param target_tech:         Target technology the Makefiles are exported for (see :func:`IPDatabase.export_make`).
+            :type  target_tech: None or str
+
+            :param local:               If set to True, sub-IPs used only locally are built as well.
+            :type  local: bool
+
+            :returns: `tuple` -- (libs, unknown, skipped): the list of (source, IP, sub-IP) keys to be recompiled in compilation order, the list of paths not referenced by any IP, and the list of impacted (source, IP, sub-IP) keys that are not built for this target (no goal in the exported Makefiles).
+
+        A sub-IP is impacted if it compiles or includes a changed file, or if it imports a package from an impacted
+        sub-IP (recompiling a library refreshes all of its packages, hence the transitive closure).
+        """
+        dependents, includers = self.get_dependency_graph()
+        impacted = []
+        unknown = []
+        for p in paths:
+            path = os.path.normpath(os.path.abspath(p))
+            direct = [(e['source'], e['ip'], e['sub_ip']) for e in self.lookup(path)]
+            direct.extend(sorted(includers.get(path, ())))
+            if len(direct) == 0:
+                unknown.append(p)
+            for d in direct:
+                if d not in impacted:
+                    impacted.append(d)
+        # transitive closure through the package dependencies
+        i = 0
+        while i < len(impacted):
+            for d in sorted(dependents.get(impacted[i], ())):
+                if d not in impacted:
+                    impacted.append(d)
+            i += 1
+        # sort in database order, then make sure package providers are compiled before their users
+        order = []
+        for key in self.ips.keys():
+            ip = self.ips[key]
+            for s in ip['sub_ips'].keys():
+                order.append((ip['source'], ip['name'], s))
+        impacted = [k for k in order if k in impacted]
+        libs = []
+        visiting = set()
+        def visit(k):
+            if k in libs or k in visiting:
+                return
+            visiting.add(k)
+            for provider in impacted:
+                if k in dependents.get(provider, ()):
+                    visit(provider)
+            visiting.discard(k)
+            libs.append(k)
+        for k in impacted:
+            visit(k)
+        built = []
+        skipped = []
+        for k in libs:
+            sub_ip = self.ips["%s:%s" % (k[0], k[1])]['sub_ips'][k[2]]
+            if has_make_goal(sub_ip['targets'], sub_ip['flags'], target_tech=target_tech, local=local):
+                built.append(k)
+            else:
+                skipped.append(k)
+        return built, unknown, skipped
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+#
+# IPSnapshot.py
+# Francesco Conti <f.conti@unibo.it>
+#
+# Copyright (C) 2015-2018 ETH Zurich, University of Bologna
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the BSD license.  See the LICENSE file for details.
+#
+
+from __future__ import print_function
+from .IPApproX_common import *
+import json, hashlib, tarfile, time
+
+IP_SNAPSHOT_VERSION = 1
+
+# files of the workspace (relative to list_path) stored with the generated scripts
+SNAPSHOT_GENERATED_FILES = [
+    '.cached_ipdb.json',
+    '.ipstools_applied.json'
+]
+
+class IPSnapshot(object):
+    """Cache of workspace snapshots, restorable without any git operation.
+
+        :param cache_dir:           Directory of the cache (defaults to the IPSTOOLS_CACHE_DIR environment variable, or `~/.cache/ipstools`).
+        :type  cache_dir: str or None
+
+    A snapshot is made of one tarball per (IP, resolved commit hash), shared by all the snapshots referencing the same
+    commit, plus one tarball of the generated scripts (`<vsim_dir>/vcompile` and the database caches), addressed by the
+    hash of its content. A JSON manifest, named after the hash of `ips_list.yml`, lists the tarballs of a snapshot.
+
+    """
+
+    def __init__(self, cache_dir=None):
+        super(IPSnapshot, self).__init__()
+        if cache_dir is None:
+            cache_dir = os.environ.get('IPSTOOLS_CACHE_DIR', os.path.join(os.path.expanduser("~"), ".cache", "ipstools"))
+        self.cache_dir = os.path.abspath(cache_dir)
+        for d in ("ips", "generated", "manifests"):
+            path = os.path.join(self.cache_dir, d)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def get_manifest_path(self, list_path='.'):
+        """Returns the path of the manifest of the workspace whose `ips_list.yml` is in `list_path`.
+        """
+        with open(os.path.join(list_path, "ips_list.yml"), "rb") as f:
+            key = hashlib.sha1(f.read()).hexdigest()
+        return os.path.join(self.cache_dir, "manifests", "%s.json" % key)
+
+    def __write_tarball(self, filename, members, recursive=True, compresslevel=1):
+        # written to a temporary file first, so that concurrent readers never see partial tarballs
+        tmp = "%s.%d.tmp" % (filename, os.getpid())
+        with tarfile.open(tmp, "w:gz", compresslevel=compresslevel) as tar:
+            for path, arcname in members:
+                tar.add(path, arcname=arcname, recursive=recursive)
+        os.rename(tmp, filename)
+
+    def export(self, ipdb, list_path='.'):
+        """Stores a snapshot of the workspace in the cache.
+
+            :param ipdb:                The IP database of the workspace.
+            :type  ipdb: :class:`IPDatabase`
+
+            :param list_path:           Path where the main `ips_list.yml` is found.
+            :type  list_path: str
+
+            :returns: `str` -- path of the manifest.
+
+        All IPs must be clean git repositories, so that their resolved commit hash identifies their content. Tarballs already
+        in the cache are not written again.
+        """
+        snapshot = ipdb.get_status()
+        dirty = [name for name in snapshot.keys() if not snapshot[name]['exists'] or len(snapshot[name]['staged']) + len(snapshot[name]['unstaged']) > 0]
+        if len(dirty) > 0:
+            print(tcolors.ERROR + "ERROR: cannot snapshot ips %s, as they are missing or have changes." % ", ".join(dirty) + tcolors.ENDC)
+            sys.exit(1)
+        manifest = OrderedDict([
+            ('version',   IP_SNAPSHOT_VERSION),
+            ('created',   time.time()),
+            ('ips_dir',   ipdb.ips_dir),
+            ('ips',       []),
+            ('generated', None)
+        ])
+        written = 0
+        for ip in ipdb.ip_list:
+            head = snapshot[ip['name']]['head']
+            tarball = os.path.join("ips", "%s-%s.tar.gz" % (prepare(ip['name']), head))
+            if not os.path.exists(os.path.join(self.cache_dir, tarball)):
+                print("Storing ip " + tcolors.WARNING + "'%s'" % ip['name'] + tcolors.ENDC + " @ %s..." % head)
+                self.__write_tarball(os.path.join(self.cache_dir, tarball), [(os.path.join(ipdb.ips_dir, ip['path']), ".")])
+                written += 1
+            manifest['ips'].append(OrderedDict([
+                ('name',    ip['name']),
+                ('path',    ip['path']),
+                ('commit',  ip['commit']),
+                ('hash',    head),
+                ('tarball', tarball)
+            ]))
+        # the generated scripts are addressed by the hash of their content
+        members = []
+        for f in SNAPSHOT_GENERATED_FILES:
+            if os.path.isfile(os.path.join(list_path, f)):
+                members.append((os.path.join(list_path, f), f))
+        vcompile = os.path.join(ipdb.vsim_dir, "vcompile")
+        for root, dirs, files in os.walk(vcompile):
+            dirs.sort()
+            members.append((root, os.path.relpath(root, list_path)))
+            for f in sorted(files):
+                members.append((os.path.join(root, f), os.path.relpath(os.path.join(root, f), list_path)))
+        sha = hashlib.sha1()
+        for path, arcname in members:
+            sha.update(arcname.encode('utf-8'))
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    sha.update(f.read())
+        tarball = os.path.join("generated", "%s.tar.gz" % sha.hexdigest())
+        if not os.path.exists(os.path.join(self.cache_dir, tarball)):
+            self.__write_tarball(os.path.join(self.cache_dir, tarball), members, recursive=False)
+            written += 1
+        manifest['generated'] = tarball
+        filename = self.get_manifest_path(list_path)
+        with open(filename, "w") as f:
+            f.write(json.dumps(manifest, indent=4))
+        print(tcolors.OK + "Stored snapshot of %d ips in %s (%d new tarballs)." % (len(manifest['ips']), self.cache_dir, written) + tcolors.ENDC)
+        return filename
+
+    def restore(self, list_path='.', ips_dir=None, manifest=None, threads=8):
+        """Rebuilds a workspace from a snapshot in the cache.
+
+            :param list_path:           Path where the main `ips_list.yml` is found.
+            :type  list_path: str
+
+            :param ips_dir:             Path where the IPs are to be deployed (defaults to the one of the snapshot).
+            :type  ips_dir: str or None
+
+            :param manifest:            Path of the manifest (defaults to the one matching `ips_list.yml`).
+            :type  manifest: str or None
+
+            :param threads:             Number of tarballs extracted concurrently.
+            :type  threads: int
+
+            :returns: `bool` -- True if the workspace has been restored.
+
+        IPs whose directory already exists are left untouched; the generated scripts are overwritten.
+        """
+        if manifest is None:
+            manifest = self.get_manifest_path(list_path)
+        try:
+            with open(manifest, "r") as f:
+                manifest = json.loads(f.read(), object_pairs_hook=OrderedDict)
+        except IOError:
+            print(tcolors.WARNING + "WARNING: no snapshot of this workspace in %s." % self.cache_dir + tcolors.ENDC)
+            return False
+        if ips_dir is None:
+            ips_dir = manifest['ips_dir']
+        jobs = []
+        for ip in manifest['ips']:
+            path = os.path.join(ips_dir, ip['path'])
+            if os.path.exists(path):
+                print(tcolors.WARNING + "WARNING: not restoring ip '%s' as %s already exists." % (ip['name'], path) + tcolors.ENDC)
+                continue
+            jobs.append((os.path.join(self.cache_dir, ip['tarball']), path))
+        jobs.append((os.path.join(self.cache_dir, manifest['generated']), list_path))
+        missing = [tarball for tarball, path in jobs if not os.path.isfile(tarball)]
+        if len(missing) > 0:
+            print(tcolors.ERROR + "ERROR: incomplete snapshot, missing %s." % ", ".join(missing) + tcolors.ENDC)
+            return False
+        pool = ThreadPool(max(1, min(threads, len(jobs))))
+        try:
+            pool.map(extract_tarball, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        print(tcolors.OK + "Restored %d ips and the generated scripts from %s." % (len(jobs)-1, self.cache_dir) + tcolors.ENDC)
+        return True
+
+def extract_tarball(job):
+    tarball, path = job
+    # the cache is trusted: keep links and permissions as they were stored
+    kwargs = {'filter': 'fully_trusted'} if hasattr(tarfile, 'fully_trusted_filter') else {}
+    with tarfile.open(tarball, "r:gz") as tar:
+        tar.extractall(path, **kwargs)
@@ -37,6 +37,9 @@ class IPTreeNode(object):
         :param verbose:             If true, prints all information on the dependencies that are being fetched.
         :type  verbose: bool
 
+        :param ips_dir:             Path where the IPs are deployed: IPs pinned to a tag or hash that is already available there are resolved without network access.
+        :type  ips_dir: str or None
+
     This class represents a node in the IP hierarchy tree. It is used to construct
     the list of all dependencies so that it is possible to resolve conflicts.                       
 
@@ -49,13 +52,15 @@ class IPTreeNode(object):
         default_commit='master',
         children=None,
         father=None,
-        verbose=False
+        verbose=False,
+        ips_dir=None
     ):
 
         super(IPTreeNode, self).__init__()
         self.node = node
         self.father = father
         self.itself = None
+        self.depth = 0 if father is None else father['depth'] + 1
         if children is not None:
             self.children = children
             return
@@ -71,17 +76,19 @@ class IPTreeNode(object):
             commit = node['commit']
         else:
             commit = default_commit
-        ips = load_ips_list_from_server(server, group, node['name'], commit, verbose=verbose)
+        local_path = os.path.join(ips_dir, node['path']) if ips_dir is not None else None
+        ips = load_ips_list_from_server(server, group, node['name'], commit, verbose=verbose, local_path=local_path)
         father_of_children = {
             'server' : server,
             'group'  : group,
             'name'   : node['name'],
-            'commit' : commit
+            'commit' : commit,
+            'depth'  : self.depth
         }
         self.itself = father_of_children
         children = []
         for ip in ips:
-            children.append(IPTreeNode(ip, default_server, default_group, default_commit, father=father_of_children, verbose=verbose))
+            children.append(IPTreeNode(ip, default_server, default_group, default_commit, father=father_of_children, verbose=verbose, ips_dir=ips_dir))
         self.children = children
 
     def flattenize_children(self):
@@ -102,6 +109,17 @@ class IPTreeNode(object):
 
             :returns: `dict` -- Dictionary of all descendant IPTreeNode's.
 
+        Of the nodes of an IP at the same commit, the one closest to the root is kept, also when a sub-IP
+        listing it comes first:
+
+        >>> ip = lambda name, commit, depth=None: IPTreeNode({'name': name, 'commit': commit}, children=[],
+        ...     father=None if depth is None else {'depth': depth-1})
+        >>> y, z = ip('Y', 'master'), ip('Z', 'master')
+        >>> y.children, z.children = [ip('X', 'tags/v1', 1)], [ip('X', 'tags/v2', 1)]
+        >>> root = IPTreeNode(None, children=[y, ip('X', 'tags/v1'), z])
+        >>> [(el.node['commit'], el.depth) for el in root.get_conflicts()['X']]
+        [('tags/v1', 0), ('tags/v2', 1)]
+
         """
 
         flat_list = self.flattenize_children()
@@ -124,15 +142,19 @@ class IPTreeNode(object):
                 removed_keys.append(ck)
         for ck in removed_keys:
             conflict_dict.pop(ck, None)
-        # collapse non-conflict entries from the conflict dictionary
+        # collapse non-conflict entries from the conflict dictionary, keeping
+        # the node closest to the root for each commit (descendants come
+        # before their IP in the flat list)
         for c in conflict_dict.values():
-            removed_keys = []
+            unique = []
             commits = []
-            for i,ip in enumerate(c):
-                if ip.node['commit'] in commits:
-                    removed_keys.append(i)
-                else:
+            for ip in c:
+                if ip.node['commit'] not in commits:
+                    unique.append(ip)
                     commits.append(ip.node['commit'])
-            for i in removed_keys:
-                c.pop(i, None)
+                else:
+                    i = commits.index(ip.node['commit'])
+                    if ip.depth < unique[i].depth:
+                        unique[i] = ip
+            c[:] = unique
         return conflict_dict
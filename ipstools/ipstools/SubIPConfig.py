@@ -35,6 +35,13 @@ def is_verilog_2001(f):
     else:
         return False
 
+# returns true if the Makefile exported for the sub-IP has a build goal
+# (vcompile-subip-<name>), as decided in IPConfig.export_make
+def has_make_goal(targets, flags, target_tech=None, local=False):
+    if "all" not in targets and "rtl" not in targets and target_tech not in targets:
+        return False
+    return "skip_simulation" not in flags and ("only_local" not in flags or local)
+
 # list of allowed and mandatory keys for the Yaml dictionary
 ALLOWED_KEYS = [
     'incdirs',
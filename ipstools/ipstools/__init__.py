@@ -13,4 +13,7 @@
 from .SubIPConfig import *
 from .IPConfig import *
 from .IPDatabase import *
+from .IPFileIndex import *
+from .GitRepository import *
+from .IPSnapshot import *
 
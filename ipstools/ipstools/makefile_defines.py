@@ -81,3 +81,6 @@ MK_LIBS_LIB = "\nlib:"
 
 MK_LIBS_CMD = "\n\t@make --no-print-directory -f $(mkfile_path)/ips/%s.mk %s"
 MK_LIBS_CMD_RTL = "\n\t@make --no-print-directory -f $(mkfile_path)/rtl/%s.mk %s"
+
+# forced rebuild of a single sub-IP library (change-impact builds)
+MK_IMPACT_CMD = "\n\t@make --no-print-directory -B -f $(mkfile_path)/%s/%s.mk vcompile-subip-%s"
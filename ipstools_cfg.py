@@ -8,11 +8,18 @@
 # and you want to push things there
 DEFAULT_SERVER = "https://github.com"
 
+# revision (commit hash or tag) of IPApproX to be used; if None, ipstools
+# follows the master branch and is updated at most once per
+# IPSTOOLS_UPDATE_INTERVAL seconds.
+# Set IPSTOOLS_OFFLINE=1 in the environment to never touch the network.
+IPSTOOLS_REVISION = None
+IPSTOOLS_UPDATE_INTERVAL = 24*3600
+
 #################################
 ## DO NOT EDIT BELOW THIS LINE ##
 #################################
 
-import sys,os,subprocess
+import sys,os,subprocess,time
 
 devnull = open(os.devnull, 'wb')
 
@@ -34,14 +41,56 @@ def execute_out(cmd, silent=False):
     out, err = p.communicate()
     return out
 
-# download latest IPApproX tools in ./ipstools and import them
-if os.path.exists("ipstools") and os.path.isdir("ipstools"):
+IPSTOOLS_URL = "https://github.com/pulp-platform/IPApproX"
+IPSTOOLS_TIMESTAMP = os.path.abspath(".ipstools_last_update")
+IPSTOOLS_OFFLINE = os.environ.get('IPSTOOLS_OFFLINE', '0') not in ('', '0')
+
+def ipstools_resolve(rev):
+    # resolves a revision in the local ipstools checkout, without any network access
+    p = subprocess.Popen(("git rev-parse -q --verify %s^{commit}" % rev).split(), stdout=subprocess.PIPE, stderr=devnull)
+    out, err = p.communicate()
+    return out.strip() if p.returncode == 0 else None
+
+def ipstools_update_due():
+    try:
+        return time.time() - os.path.getmtime(IPSTOOLS_TIMESTAMP) > IPSTOOLS_UPDATE_INTERVAL
+    except OSError:
+        return True
+
+def ipstools_bootstrap():
+    if not (os.path.exists("ipstools") and os.path.isdir("ipstools")):
+        if IPSTOOLS_OFFLINE:
+            print(tcolors.ERROR + "ERROR: ipstools is not available and IPSTOOLS_OFFLINE is set." + tcolors.ENDC)
+            sys.exit(1)
+        if execute("git clone %s ipstools" % IPSTOOLS_URL) != 0:
+            print(tcolors.ERROR + "ERROR: could not clone ipstools from %s." % IPSTOOLS_URL + tcolors.ENDC)
+            sys.exit(1)
+        with open(IPSTOOLS_TIMESTAMP, "w"):
+            pass
+    # a plain directory (e.g. ipstools vendored in this repository) is used as is
+    if not os.path.exists("ipstools/.git"):
+        return
     cwd = os.getcwd()
     os.chdir("ipstools")
-    execute("git pull", silent=True)
+    if IPSTOOLS_REVISION is not None:
+        # pinned mode: only fetch if the pinned revision is not available locally
+        pinned = ipstools_resolve(IPSTOOLS_REVISION)
+        if pinned is None and not IPSTOOLS_OFFLINE:
+            execute("git fetch --tags origin", silent=True)
+            pinned = ipstools_resolve(IPSTOOLS_REVISION)
+        if pinned is None:
+            print(tcolors.WARNING + "WARNING: ipstools revision %s is not available, using the local checkout." % IPSTOOLS_REVISION + tcolors.ENDC)
+        elif pinned != ipstools_resolve("HEAD"):
+            execute("git checkout -q %s" % IPSTOOLS_REVISION, silent=True)
+    elif not IPSTOOLS_OFFLINE and ipstools_update_due():
+        # the timestamp is only refreshed on success, so that a failed pull is retried on the next run
+        if execute("git pull", silent=True) == 0:
+            with open(IPSTOOLS_TIMESTAMP, "w"):
+                pass
+        else:
+            print(tcolors.WARNING + "WARNING: could not update ipstools, using the local checkout." + tcolors.ENDC)
     os.chdir(cwd)
-    import ipstools
-else:
-    execute("git clone https://github.com/pulp-platform/IPApproX ipstools")
-    import ipstools
 
+# set up the IPApproX tools in ./ipstools and import them
+ipstools_bootstrap()
+import ipstools